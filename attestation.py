@@ -0,0 +1,444 @@
+import base64
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from multiprocessing import reduction
+import requests
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+import metrics
+
+logger = logging.getLogger(__name__)
+
+"""
+Per-response attestation
+
+The enclave signs with an Ed25519 app key generated at boot. The SHA-256 of its raw
+public key is registered with nitriding, which puts it in the user data of every
+attestation document as the appKeyHash. A verified attestation document therefore
+vouches for everything the app key signs.
+
+Each response is summarized by a digest over the model hash, the input bytes as the
+client sent them and the output bytes as the node sent them:
+
+    SHA-256( DIGEST_DOMAIN
+             u64 len(model_hash)  model_hash (utf-8)
+             u64 count            count x (u64 len(input)  input)
+             output bytes         u64 len(output) )
+
+All integers are little-endian. The output length comes last so the digest can be
+computed while the output is streamed. Inputs are the model_inputs string(s) of the
+JSON endpoints in utf-8, or the request body of /infer/binary. The output is the whole
+response body, less the trailing attestation line of /infer/batch.
+
+ATTESTATION_MODE selects what is done with the digest:
+    off:    nothing
+    sign:   every response carries the digest and the app key's signature over it
+    merkle: every response carries the digest and its place in the current batch. A
+            batch is sealed every ATTESTATION_BATCH_SECONDS or ATTESTATION_BATCH_SIZE
+            responses, and only its Merkle root is signed, as
+
+                COMMITMENT_DOMAIN  u64 batch  u64 size  root
+
+            Clients fetch the signed root and an inclusion proof for their response.
+
+With several server workers, the first process generates the app key and hands it to
+the workers through an anonymous file they inherit, see KeyHandover, so nitriding
+vouches for one key. Batch numbers
+are then drawn from a counter shared by the workers, and sealed batches are written to
+a shared directory so any worker can serve any batch's proofs.
+"""
+
+# off, sign or merkle
+ATTESTATION_MODE = os.environ.get("ATTESTATION_MODE", "off")
+
+# Most responses committed to by one Merkle root
+ATTESTATION_BATCH_SIZE = int(os.environ.get("ATTESTATION_BATCH_SIZE", "4096"))
+
+# Seconds between seals of the open batch, if it has any responses
+ATTESTATION_BATCH_SECONDS = float(os.environ.get("ATTESTATION_BATCH_SECONDS", "10"))
+
+# Sealed batches kept for proof requests, oldest dropped first
+ATTESTATION_BATCHES_KEPT = 64
+
+# Sealed batches shared between server workers
+ATTESTATION_BATCH_DIR = "./storage/attestation"
+
+# Next batch number, in the shared batch directory
+_BATCH_COUNTER_FILE = ".next-batch"
+
+# Nitriding's internal endpoint for registering the app key hash
+nitriding_hash_url = "http://127.0.0.1:8080/enclave/hash"
+
+DIGEST_DOMAIN = b"opengradient-inference-response-v1\x00"
+COMMITMENT_DOMAIN = b"opengradient-inference-batch-v1\x00"
+_LEAF = b"\x00"
+_NODE = b"\x01"
+
+_U64 = struct.Struct("<Q")
+
+# Raw private key handed over by the parent process, see KeyHandover
+_handed_over = None
+
+SealedBatch = namedtuple("SealedBatch", ["batch", "size", "root", "signature", "sealed_at", "levels"])
+
+ATTESTED_RESPONSES = metrics.Counter("attested_responses_total", "Responses attested, by mode", label="mode")
+SEALED_BATCHES = metrics.Counter("attestation_batches_sealed_total", "Merkle batches of responses sealed and signed")
+
+class ResponseDigest():
+    def __init__(self, model_hash: str, inputs: list):
+        """
+        Streaming digest of one response. Feed the output bytes to update() as they are
+        produced, in any chunking, then call digest().
+        """
+        self.hash = hashlib.sha256(DIGEST_DOMAIN)
+        encoded = model_hash.encode("utf-8")
+        self.hash.update(_U64.pack(len(encoded)))
+        self.hash.update(encoded)
+        self.hash.update(_U64.pack(len(inputs)))
+        for data in inputs:
+            self.hash.update(_U64.pack(len(data)))
+            self.hash.update(data)
+        self.output_length = 0
+
+    def update(self, data) -> None:
+        self.hash.update(data)
+        self.output_length += len(data)
+
+    def digest(self) -> bytes:
+        self.hash.update(_U64.pack(self.output_length))
+        return self.hash.digest()
+
+def response_digest(model_hash: str, inputs: list, outputs: list) -> bytes:
+    """
+    Digest of a response whose output is the concatenation of the outputs buffers.
+    """
+    digest = ResponseDigest(model_hash, inputs)
+    for chunk in outputs:
+        digest.update(chunk)
+    return digest.digest()
+
+def commitment(batch: int, size: int, root: bytes) -> bytes:
+    """
+    The message the app key signs for a sealed batch.
+    """
+    return COMMITMENT_DOMAIN + _U64.pack(batch) + _U64.pack(size) + root
+
+def _leafHash(digest: bytes) -> bytes:
+    return hashlib.sha256(_LEAF + digest).digest()
+
+def _nodeHash(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(_NODE + left + right).digest()
+
+def merkle_levels(digests: list) -> list:
+    """
+    Every level of the Merkle tree over the digests, leaves first and root last. A node
+    without a sibling is carried up to the next level unchanged.
+    """
+    levels = [[_leafHash(digest) for digest in digests]]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [_nodeHash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+def merkle_proof(levels: list, index: int) -> list:
+    """
+    Sibling hashes from the leaf at index up to the root.
+    """
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append(level[sibling])
+        index //= 2
+    return proof
+
+def verify_proof(digest: bytes, index: int, size: int, proof: list, root: bytes) -> bool:
+    """
+    Whether the response digest is leaf index of the size-leaf tree with this root.
+    """
+    if not 0 <= index < size:
+        return False
+    node = _leafHash(digest)
+    siblings = iter(proof)
+    while size > 1:
+        if index ^ 1 < size:
+            sibling = next(siblings, None)
+            if sibling is None:
+                return False
+            node = _nodeHash(sibling, node) if index % 2 else _nodeHash(node, sibling)
+        index //= 2
+        size = (size + 1) // 2
+    return next(siblings, None) is None and node == root
+
+def verify_signature(public_key: bytes, message: bytes, signature: bytes) -> bool:
+    """
+    Whether signature is the raw Ed25519 public key's signature of message. Check that
+    the SHA-256 of public_key is the appKeyHash of a verified attestation document first.
+    """
+    try:
+        Ed25519PublicKey.from_public_bytes(public_key).verify(signature, message)
+    except (InvalidSignature, ValueError):
+        return False
+    return True
+
+class AppKey():
+    def __init__(self):
+        """
+        Ed25519 key generated inside the enclave, it never leaves it. Server workers take
+        the key their parent process handed over, see handover().
+
+        The key is settled on first use: a worker may build its AppKey while the handed
+        over key is still being unpickled.
+        """
+        self._keys = None
+        self.lock = threading.Lock()
+
+    @property
+    def private_key(self) -> Ed25519PrivateKey:
+        return self._settle()[0]
+
+    @property
+    def public_key(self) -> bytes:
+        return self._settle()[1]
+
+    @property
+    def key_hash(self) -> bytes:
+        return self._settle()[2]
+
+    def _settle(self) -> tuple:
+        with self.lock:
+            if self._keys is None:
+                if _handed_over is not None:
+                    private_key = Ed25519PrivateKey.from_private_bytes(_handed_over)
+                else:
+                    private_key = Ed25519PrivateKey.generate()
+                public_key = private_key.public_key().public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+                self._keys = (private_key, public_key, hashlib.sha256(public_key).digest())
+            return self._keys
+
+    def sign(self, message: bytes) -> bytes:
+        return self.private_key.sign(message)
+
+    def register(self, url: str = nitriding_hash_url) -> None:
+        """
+        Have nitriding include the key hash in attestation documents from now on.
+        """
+        response = requests.post(url, data=base64.b64encode(self.key_hash), timeout=10)
+        response.raise_for_status()
+
+    def handover(self) -> "KeyHandover":
+        """
+        The key, ready to be pickled into worker processes.
+        """
+        return KeyHandover(self.private_key.private_bytes(serialization.Encoding.Raw, serialization.PrivateFormat.Raw, serialization.NoEncryption()))
+
+class KeyHandover():
+    def __init__(self, raw: bytes):
+        """
+        The raw app key in an anonymous in-memory file, kept out of the environment and
+        the command line of the workers, where any process could read it.
+
+        Pickled into a process started by multiprocessing, it passes the child a copy
+        of the file descriptor and unpickles by reading the key into _handed_over and
+        closing it, before the child imports the server. The file stays open here so
+        workers restarted later can read it too.
+        """
+        self.fd = os.memfd_create("attestation-app-key", os.MFD_CLOEXEC)
+        os.write(self.fd, raw)
+
+    def __reduce__(self):
+        return _receiveKey, (reduction.DupFd(self.fd),)
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+def _receiveKey(dup) -> None:
+    global _handed_over
+    fd = dup.detach()
+    try:
+        _handed_over = os.pread(fd, 32, 0)
+    finally:
+        os.close(fd)
+
+class MerkleBatches():
+    def __init__(self, key: AppKey, batch_size: int = ATTESTATION_BATCH_SIZE, batches_kept: int = ATTESTATION_BATCHES_KEPT, directory: str = None):
+        """
+        Collects response digests into numbered batches and seals each one by signing
+        its Merkle root. Thread-safe.
+
+        With directory, batch numbers come from a counter shared with the other workers
+        and sealed batches are written there, see the module docstring.
+        """
+        self.key = key
+        self.batch_size = batch_size
+        self.batches_kept = batches_kept
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.batch = None if directory is not None else 0
+        self.digests = []
+        self.sealed = OrderedDict()
+        self.lock = threading.Lock()
+
+    def append(self, digest: bytes) -> tuple:
+        """
+        Add a response digest to the open batch, returns its (batch, index).
+        """
+        with self.lock:
+            if self.batch is None:
+                self.batch = self._nextBatch()
+            place = (self.batch, len(self.digests))
+            self.digests.append(digest)
+            full = len(self.digests) >= self.batch_size
+        if full:
+            self.seal()
+        return place
+
+    def seal(self) -> None:
+        """
+        Sign the Merkle root of the open batch, if it has any responses, and open the next.
+        """
+        with self.lock:
+            if not self.digests:
+                return
+            batch, digests = self.batch, self.digests
+            # Shared batches draw the next number on the next append
+            self.batch = batch + 1 if self.directory is None else None
+            self.digests = []
+
+        levels = merkle_levels(digests)
+        root = levels[-1][0]
+        sealed = SealedBatch(batch, len(digests), root, self.key.sign(commitment(batch, len(digests), root)), time.time(), levels)
+        if self.directory is not None:
+            self._write(sealed, digests)
+        with self.lock:
+            self.sealed[batch] = sealed
+            while len(self.sealed) > self.batches_kept:
+                self.sealed.popitem(last=False)
+        SEALED_BATCHES.inc()
+        logger.debug("Sealed attestation batch %d of %d responses", batch, len(digests))
+
+    def get(self, batch: int) -> SealedBatch:
+        """
+        The sealed batch, None if it is still open or was dropped.
+        """
+        with self.lock:
+            sealed = self.sealed.get(batch)
+        if sealed is None and self.directory is not None:
+            # Sealed by another worker
+            return self._read(batch)
+        return sealed
+
+    def dropped(self, batch: int) -> bool:
+        """
+        Whether a batch that get() doesn't return was sealed and has since been dropped,
+        rather than not sealed yet.
+        """
+        if self.directory is None:
+            with self.lock:
+                return batch < self.batch
+        newest = max(self._sealedOnDisk(), default=-1)
+        return batch <= newest - self.batches_kept
+
+    def _nextBatch(self) -> int:
+        with open(os.path.join(self.directory, _BATCH_COUNTER_FILE), "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            batch = int(f.read() or "0")
+            f.seek(0)
+            f.truncate()
+            f.write(str(batch + 1))
+        return batch
+
+    def _sealedOnDisk(self) -> list:
+        return [int(name[:-5]) for name in os.listdir(self.directory) if name.endswith(".json")]
+
+    def _write(self, sealed: SealedBatch, digests: list) -> None:
+        """
+        Write a sealed batch for the other workers and drop the ones no longer kept.
+        """
+        path = os.path.join(self.directory, "%d.json" % sealed.batch)
+        with open(path + ".part", "w") as f:
+            json.dump({"batch": sealed.batch,
+                       "root": sealed.root.hex(),
+                       "signature": base64.b64encode(sealed.signature).decode(),
+                       "sealed_at": sealed.sealed_at,
+                       "digests": [digest.hex() for digest in digests]}, f)
+        os.replace(path + ".part", path)
+        for batch in self._sealedOnDisk():
+            if batch <= sealed.batch - self.batches_kept:
+                try:
+                    os.remove(os.path.join(self.directory, "%d.json" % batch))
+                except FileNotFoundError:
+                    pass
+
+    def _read(self, batch: int) -> SealedBatch:
+        try:
+            with open(os.path.join(self.directory, "%d.json" % batch), "r") as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+        levels = merkle_levels([bytes.fromhex(digest) for digest in record["digests"]])
+        return SealedBatch(batch, len(record["digests"]), bytes.fromhex(record["root"]),
+                           base64.b64decode(record["signature"]), record["sealed_at"], levels)
+
+class Attestor():
+    def __init__(self, mode: str = ATTESTATION_MODE, batch_directory: str = None):
+        """
+        Attests responses according to mode, see the module docstring. Workers of one
+        server pass the batch_directory they share.
+        """
+        if mode not in ("off", "sign", "merkle"):
+            raise ValueError("Unknown attestation mode %s, expected off, sign or merkle" % mode)
+        self.mode = mode
+        self.key = AppKey() if mode != "off" else None
+        self.batches = MerkleBatches(self.key, directory=batch_directory) if mode == "merkle" else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def start(self, model_hash: str, inputs: list) -> ResponseDigest:
+        """
+        Digest for a response whose output is streamed, pass it to finish() at the end.
+        """
+        return ResponseDigest(model_hash, inputs)
+
+    def attest(self, model_hash: str, inputs: list, outputs: list) -> dict:
+        """
+        Attestation of a response whose output is the concatenation of the outputs
+        buffers, see finish().
+        """
+        return self.finish(response_digest(model_hash, inputs, outputs))
+
+    def finish(self, digest) -> dict:
+        """
+        Attestation of a finished digest: the hex digest, and either the base64 signature
+        over it or the batch and index of the response in its Merkle batch.
+        """
+        if isinstance(digest, ResponseDigest):
+            digest = digest.digest()
+        ATTESTED_RESPONSES.inc(label_value=self.mode)
+        fields = {"digest": digest.hex()}
+        if self.mode == "sign":
+            fields["signature"] = base64.b64encode(self.key.sign(digest)).decode()
+        else:
+            fields["batch"], fields["index"] = self.batches.append(digest)
+        return fields
+
+def headers(fields: dict) -> dict:
+    """
+    Attestation fields as response headers, e.g. X-Attestation-Digest.
+    """
+    return {"X-Attestation-" + name.title(): str(value) for name, value in fields.items()}
@@ -0,0 +1,211 @@
+import asyncio
+import os
+import numpy as np
+
+# Milliseconds to wait for more requests to the same model before running a batch, 0 disables batching
+INFER_BATCH_WINDOW_MS = float(os.environ.get("INFER_BATCH_WINDOW_MS", "0"))
+# Largest number of requests run together in one session.run
+INFER_MAX_BATCH = int(os.environ.get("INFER_MAX_BATCH", "32"))
+
+def batch_axis(inputs: list, outputs: list, opt_in: bool = None) -> bool:
+    """
+    Whether requests to a model can be concatenated along the leading dimension and the
+    outputs split back per request. Every input and output needs a dynamic leading
+    dimension, but such a dimension is as often a sequence length or an item count as
+    a batch, and stacking along it silently changes results. So the model has to opt
+    in, with batch_axis in its session config or by naming the leading dimension of
+    all its inputs, each of rank 2 or more, like a batch.
+    """
+    if opt_in is False:
+        return False
+    for arg in list(inputs) + list(outputs):
+        if len(arg.shape) == 0 or isinstance(arg.shape[0], int):
+            return False
+    if opt_in:
+        return True
+    return all(len(arg.shape) >= 2 and isinstance(arg.shape[0], str) and "batch" in arg.shape[0].lower() for arg in inputs)
+
+def _batch_size(onnx_inputs: dict):
+    """
+    Leading dimension shared by all of a request's inputs, None if they disagree.
+    """
+    sizes = {tensor.shape[0] if tensor.ndim > 0 else None for tensor in onnx_inputs.values()}
+    if len(sizes) != 1:
+        return None
+    return sizes.pop()
+
+def _signature(onnx_inputs: dict) -> tuple:
+    # Requests can only be concatenated if everything but the leading dimension matches
+    return tuple((name, tensor.dtype.str, tensor.shape[1:]) for name, tensor in sorted(onnx_inputs.items()))
+
+def _concatenate(inputs_list: list) -> dict:
+    return {
+        name: np.concatenate([onnx_inputs[name] for onnx_inputs in inputs_list], axis=0)
+        for name in inputs_list[0]
+    }
+
+def _split(outputs: list, sizes: list):
+    """
+    Split batch outputs back along the leading dimension, in request order. None if the
+    outputs aren't laid out per batch row after all.
+    """
+    if any(not isinstance(output, np.ndarray) or output.ndim == 0 or output.shape[0] != sum(sizes) for output in outputs):
+        return None
+    offsets = np.cumsum(sizes)[:-1]
+    split = [np.split(output, offsets, axis=0) for output in outputs]
+    return [[parts[i] for parts in split] for i in range(len(sizes))]
+
+def run_stacked(entry, inputs_list: list) -> list:
+    """
+    Run many input sets through one session with as few session.run calls as the model
+    allows, returning one result (list of outputs) or exception per input set.
+
+    Input sets with matching signatures are concatenated along the batch axis when the
+    model has one. If a stacked run fails, its input sets are retried one by one so an
+    error is only reported for the set that caused it.
+    """
+    results = [None] * len(inputs_list)
+    groups = {}
+    for i, onnx_inputs in enumerate(inputs_list):
+        if entry.batch_axis and _batch_size(onnx_inputs) is not None:
+            groups.setdefault(_signature(onnx_inputs), []).append(i)
+        else:
+            groups[("single", i)] = [i]
+
+    for indices in groups.values():
+        if len(indices) > 1:
+            try:
+                sizes = [_batch_size(inputs_list[i]) for i in indices]
+                outputs = entry.session.run(entry.output_names, _concatenate([inputs_list[i] for i in indices]))
+                split = _split(outputs, sizes)
+            except Exception:
+                split = None
+            if split is not None:
+                for i, result in zip(indices, split):
+                    results[i] = result
+                continue
+
+        for i in indices:
+            try:
+                results[i] = entry.session.run(entry.output_names, inputs_list[i])
+            except Exception as e:
+                results[i] = e
+    return results
+
+class MicroBatcher():
+    def __init__(self, run, window_ms: float = INFER_BATCH_WINDOW_MS, max_batch: int = INFER_MAX_BATCH):
+        """
+        Collects concurrent requests for the same model and runs them as one batch
+
+        run is an async callable run(fn, *args) that executes the blocking session.run,
+        e.g. InferenceExecutor.run, used for requests that don't bring their own, e.g.
+        their Admission.run. Requests are held for up to window_ms, or until max_batch
+        of them are waiting, then grouped by input signature, concatenated along the
+        leading dimension and split back per request. A batch runs through its first
+        request's run; if it fails, each request is run on its own through its own run,
+        so an error only reaches the request that caused it.
+
+        Pending requests are keyed by model hash:
+            key: model_hash
+            value: list of (entry, onnx_inputs, future, run)
+
+        Everything runs on the event loop, so no locking is needed.
+        """
+        self.run_fn = run
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.pending = {}
+        self.timers = {}
+        self.batches = 0
+        self.batched_requests = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 and self.max_batch > 1
+
+    async def run(self, modelHash: str, entry, onnx_inputs: dict, run=None) -> list:
+        """
+        Run inference for one request, batched with others when the model allows it.
+        """
+        run = run if run is not None else self.run_fn
+        if not self.enabled or not entry.batch_axis or _batch_size(onnx_inputs) is None:
+            return await run(entry.session.run, entry.output_names, onnx_inputs)
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self.pending.setdefault(modelHash, [])
+        queue.append((entry, onnx_inputs, future, run))
+
+        if len(queue) >= self.max_batch:
+            self._flush(modelHash)
+        elif modelHash not in self.timers:
+            self.timers[modelHash] = asyncio.get_running_loop().call_later(self.window, self._flush, modelHash)
+
+        return await future
+
+    def _flush(self, modelHash: str) -> None:
+        timer = self.timers.pop(modelHash, None)
+        if timer is not None:
+            timer.cancel()
+
+        queue = self.pending.pop(modelHash, [])
+        groups = {}
+        for request in queue:
+            # Requests racing a session eviction may hold different sessions of the same model
+            key = (id(request[0].session), _signature(request[1]))
+            groups.setdefault(key, []).append(request)
+
+        for group in groups.values():
+            asyncio.ensure_future(self._runBatch(group))
+
+    async def _runBatch(self, group: list) -> None:
+        entry = group[0][0]
+        try:
+            if len(group) == 1:
+                _, onnx_inputs, _, run = group[0]
+                results = [await run(entry.session.run, entry.output_names, onnx_inputs)]
+            else:
+                results = await self._runConcatenated(entry, group)
+        except Exception as e:
+            if len(group) == 1:
+                results = [e]
+            else:
+                # Run the requests one by one so only the one at fault gets the error
+                results = await self._runEach(entry, group)
+
+        for (_, _, future, _), result in zip(group, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _runConcatenated(self, entry, group: list) -> list:
+        sizes = [_batch_size(onnx_inputs) for _, onnx_inputs, _, _ in group]
+        batch_inputs = _concatenate([onnx_inputs for _, onnx_inputs, _, _ in group])
+
+        run = group[0][3]
+        outputs = await run(entry.session.run, entry.output_names, batch_inputs)
+        split = _split(outputs, sizes)
+        if split is None:
+            # Output isn't laid out per batch row after all, run the requests one by one
+            return await self._runEach(entry, group)
+
+        self.batches += 1
+        self.batched_requests += len(group)
+        return split
+
+    async def _runEach(self, entry, group: list) -> list:
+        """
+        Run each request of a group on its own, returning its result or exception.
+        """
+        return await asyncio.gather(*(self._runOne(entry, onnx_inputs, future, run) for _, onnx_inputs, future, run in group))
+
+    async def _runOne(self, entry, onnx_inputs: dict, future, run):
+        if future.done():
+            # The request already gave up, e.g. past its deadline
+            return None
+        try:
+            return await run(entry.session.run, entry.output_names, onnx_inputs)
+        except Exception as e:
+            return e
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+import argparse
+import base64
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+import cbor2
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+from cryptography.x509.oid import NameOID
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import verify_attestation
+
+"""
+Attestation verification throughput: a fresh AttestationVerifier per document, which
+loads the PCRs and root certificate and validates the whole chain every time like the
+original verify_attestation_doc, against one verifier with its chain cache, and
+verify_many over a process pool.
+
+--fixtures reads recorded documents, one base64 document per line, checked against
+--measurements and --root-cert. Record them from a node with --record <attestation url>.
+Without fixtures, documents are generated with the layout of the Nitro Secure Module's:
+a P-384 root, regional, zonal and per-instance intermediates, and a signing
+certificate per node.
+"""
+
+PCR_LENGTH = 48
+
+def _name(common_name: str) -> x509.Name:
+    return x509.Name([x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Amazon"), x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+
+def _certificate(common_name: str, key, issuer_name: x509.Name, issuer_key, ca: bool, hours: float) -> x509.Certificate:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    builder = (x509.CertificateBuilder()
+               .subject_name(_name(common_name))
+               .issuer_name(issuer_name)
+               .public_key(key.public_key())
+               .serial_number(x509.random_serial_number())
+               .not_valid_before(now - datetime.timedelta(minutes=5))
+               .not_valid_after(now + datetime.timedelta(hours=hours))
+               .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True))
+    if ca:
+        builder = builder.add_extension(x509.KeyUsage(digital_signature=False, content_commitment=False, key_encipherment=False,
+                                                      data_encipherment=False, key_agreement=False, key_cert_sign=True,
+                                                      crl_sign=True, encipher_only=False, decipher_only=False), critical=True)
+    return builder.sign(issuer_key, hashes.SHA384())
+
+def _sign1(key, payload: bytes) -> str:
+    phdr = cbor2.dumps({1: verify_attestation.COSE_ES384})
+    der = key.sign(cbor2.dumps(["Signature1", phdr, b"", payload]), ec.ECDSA(hashes.SHA384()))
+    r, s = decode_dss_signature(der)
+    signature = r.to_bytes(PCR_LENGTH, "big") + s.to_bytes(PCR_LENGTH, "big")
+    return base64.b64encode(cbor2.dumps([phdr, {}, payload, signature])).decode()
+
+def generate_fixtures(directory: str, documents: int, nodes: int, nonce: str) -> tuple:
+    """
+    Write a measurements file and root certificate to directory and return
+    (measurements path, root cert path, documents) with documents spread over nodes.
+    """
+    root_key = ec.generate_private_key(ec.SECP384R1())
+    root = _certificate("aws.nitro-enclaves", root_key, _name("aws.nitro-enclaves"), root_key, True, 24 * 365)
+    region_key = ec.generate_private_key(ec.SECP384R1())
+    region = _certificate("us-east-1.aws.nitro-enclaves", region_key, root.subject, root_key, True, 24 * 30)
+    zone_key = ec.generate_private_key(ec.SECP384R1())
+    zone = _certificate("zone.us-east-1.aws.nitro-enclaves", zone_key, region.subject, region_key, True, 24 * 7)
+
+    pcrs = {index: os.urandom(PCR_LENGTH) if index < 3 else bytes(PCR_LENGTH) for index in range(16)}
+    signers = []
+    for node in range(nodes):
+        instance_key = ec.generate_private_key(ec.SECP384R1())
+        instance = _certificate("i-%016x.zone.us-east-1.aws.nitro-enclaves" % node, instance_key, zone.subject, zone_key, True, 24)
+        leaf_key = ec.generate_private_key(ec.SECP384R1())
+        leaf = _certificate("i-%016x-enc%016x.us-east-1.aws" % (node, node), leaf_key, instance.subject, instance_key, False, 3)
+        cabundle = [c.public_bytes(serialization.Encoding.DER) for c in (root, region, zone, instance)]
+        user_data = b"\x12\x20" + os.urandom(32) + b"\x12\x20" + os.urandom(32)
+        signers.append((leaf_key, leaf.public_bytes(serialization.Encoding.DER), cabundle, user_data))
+
+    attestations = []
+    for i in range(documents):
+        leaf_key, leaf_der, cabundle, user_data = signers[i % nodes]
+        payload = cbor2.dumps({"module_id": "i-%016x-enc%016x" % (i % nodes, i % nodes), "digest": "SHA384",
+                               "timestamp": int(time.time() * 1000), "pcrs": pcrs, "certificate": leaf_der,
+                               "cabundle": cabundle, "public_key": None, "user_data": user_data,
+                               "nonce": bytes.fromhex(nonce)})
+        attestations.append(_sign1(leaf_key, payload))
+
+    measurements = os.path.join(directory, "measurements.txt")
+    with open(measurements, "w") as f:
+        json.dump([{"Measurements": {"HashAlgorithm": "Sha384 { ... }", "PCR0": pcrs[0].hex(), "PCR1": pcrs[1].hex(), "PCR2": pcrs[2].hex()}}], f)
+    root_cert = os.path.join(directory, "aws_root_cert.pem")
+    with open(root_cert, "wb") as f:
+        f.write(root.public_bytes(serialization.Encoding.PEM))
+    return measurements, root_cert, attestations
+
+def throughput(fn, attestations: list) -> float:
+    start = time.perf_counter()
+    fn(attestations)
+    return len(attestations) / (time.perf_counter() - start)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark attestation document verification")
+    parser.add_argument("--fixtures", help="recorded documents, one base64 document per line")
+    parser.add_argument("--measurements", default=verify_attestation.measurement_path)
+    parser.add_argument("--root-cert", default=verify_attestation.root_cert_path)
+    parser.add_argument("--nonce", default=verify_attestation.nonce)
+    parser.add_argument("--record", metavar="URL", help="append --documents documents fetched from URL to --fixtures and exit")
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--nodes", type=int, default=20, help="generated fixtures: distinct nodes signing the documents")
+    parser.add_argument("--processes", type=int, nargs="*", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    if args.record:
+        with open(args.fixtures, "a") as f:
+            for _ in range(args.documents):
+                f.write(verify_attestation.get_attestation(args.record, args.nonce).strip() + "\n")
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.fixtures:
+            with open(args.fixtures, "r") as f:
+                attestations = [line.strip() for line in f if line.strip()]
+            measurements, root_cert = args.measurements, args.root_cert
+        else:
+            measurements, root_cert, attestations = generate_fixtures(directory, args.documents, args.nodes, args.nonce)
+        print("%d documents" % len(attestations))
+
+        def cold(attestations):
+            for attestation in attestations:
+                verify_attestation.AttestationVerifier(measurements, root_cert).verify(attestation, args.nonce)
+
+        verifier = verify_attestation.AttestationVerifier(measurements, root_cert)
+        def cached(attestations):
+            for attestation in attestations:
+                verifier.verify(attestation, args.nonce)
+
+        cold_rate = throughput(cold, attestations[:max(1, len(attestations) // 10)])
+        print("%-22s %10.0f docs/s" % ("reload + full chain", cold_rate))
+        rate = throughput(cached, attestations)
+        print("%-22s %10.0f docs/s %8.1fx" % ("cached chain", rate, rate / cold_rate))
+        for processes in args.processes:
+            # The first batch starts the pool and warms each worker's chain cache
+            verifier.verify_many(attestations[:processes * verify_attestation.VERIFY_CHUNK_SIZE], [args.nonce] * processes * verify_attestation.VERIFY_CHUNK_SIZE, processes)
+            rate = throughput(lambda a: verifier.verify_many(a, [args.nonce] * len(a), processes), attestations)
+            print("%-22s %10.0f docs/s %8.1fx" % ("verify_many x%d" % processes, rate, rate / cold_rate))
+        verifier.close()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import batching
+import executor
+from storage import sessions
+import models
+
+"""
+Load test for micro-batching: many concurrent single-row requests to one small model,
+run with batching disabled and with each given window. Reports throughput and p50/p99
+latency per configuration.
+"""
+
+async def load(batcher: batching.MicroBatcher, entry, concurrency: int, requests: int, in_dim: int) -> list:
+    rng = np.random.default_rng(0)
+    latencies = []
+    remaining = requests
+
+    async def client():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            onnx_inputs = {"x": rng.standard_normal((1, in_dim)).astype(np.float32)}
+            start = time.perf_counter()
+            await batcher.run("bench", entry, onnx_inputs)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return latencies
+
+def report(label: str, latencies: list, elapsed: float) -> None:
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    print("%-18s %9.0f req/s   p50 %7.3f ms   p99 %7.3f ms" % (label, len(latencies) / elapsed, p50, p99))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark dynamic micro-batching")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--windows-ms", type=float, nargs="+", default=[1, 2, 5])
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--hidden", type=int, default=256)
+    args = parser.parse_args()
+
+    in_dim = 64
+    with tempfile.TemporaryDirectory() as tmp:
+        path = models.mlp(os.path.join(tmp, "mlp"), in_dim=in_dim, hidden=args.hidden)
+        pool = executor.InferenceExecutor(queue_depth=args.concurrency)
+        config = sessions.node_config(intra_op_threads=executor.intra_op_threads(pool.workers))
+        entry = sessions.SessionPool(config=config).get("bench", path)
+
+        for window in [0] + args.windows_ms:
+            batcher = batching.MicroBatcher(pool.run, window_ms=window, max_batch=args.max_batch)
+            start = time.perf_counter()
+            latencies = asyncio.run(load(batcher, entry, args.concurrency, args.requests, in_dim))
+            label = "unbatched" if window == 0 else "window %g ms" % window
+            report(label, latencies, time.perf_counter() - start)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import utils
+
+"""
+Compares model hashing throughput of the original 4 KB read loop against
+utils.hash_model, for generated model files of the given sizes.
+"""
+
+def hash_model_4k(filename: str) -> str:
+    sha256_hash = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for byte_block in iter(lambda: f.read(4096), b""):
+            sha256_hash.update(byte_block)
+    return sha256_hash.hexdigest()
+
+def write_file(path: str, size: int) -> None:
+    block = os.urandom(1 << 20)
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:min(len(block), remaining)])
+            remaining -= len(block)
+
+def timed(fn, path: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(path)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark model file hashing")
+    parser.add_argument("--sizes-mb", type=int, nargs="+", default=[100, 2048])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for size_mb in args.sizes_mb:
+            path = os.path.join(tmp, "model-%d" % size_mb)
+            write_file(path, size_mb << 20)
+
+            before = timed(hash_model_4k, path, args.repeat)
+            after = timed(utils.hash_model, path, args.repeat)
+            assert hash_model_4k(path) == utils.hash_model(path)
+
+            print("%6d MB  4K reads %8.3fs (%7.1f MB/s)  hash_model %8.3fs (%7.1f MB/s)  speedup %.2fx"
+                  % (size_mb, before, size_mb / before, after, size_mb / after, before / after))
+            os.remove(path)
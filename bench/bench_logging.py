@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import utils
+
+"""
+Per-request overhead of debug logging on a large-tensor request. Runs input conversion
+and output serialization with DEBUG logging written to /dev/null, which formats every
+tensor the way the old print() calls did, and with the default INFO level where the
+debug formatting is skipped.
+"""
+
+class NodeArg():
+    def __init__(self, name, type, shape=None):
+        self.name = name
+        self.type = type
+        self.shape = shape
+
+def make_request(elements: int) -> str:
+    rng = np.random.default_rng(0)
+    values = rng.integers(-10**6, 10**6, elements)
+    return json.dumps({"numbers": [{
+        "name": "x",
+        "shape": [elements],
+        "values": [{"value": str(v), "decimals": "4"} for v in values],
+    }]})
+
+PLAN = utils.compile_inputs([NodeArg("x", "tensor(float)", ["n"])])
+
+def run_request(model_inputs: str, output: np.ndarray) -> None:
+    utils.convert_to_onnx_input(PLAN, model_inputs)
+    utils.serialize_onnx_output([NodeArg("y", "tensor(float)")], [output])
+
+def timed(model_inputs: str, output: np.ndarray, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run_request(model_inputs, output)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark logging overhead per request")
+    parser.add_argument("--elements", type=int, default=224 * 224 * 3)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    model_inputs = make_request(args.elements)
+    output = np.random.default_rng(1).standard_normal(args.elements).astype(np.float32)
+
+    devnull = open(os.devnull, "w")
+    logging.basicConfig(stream=devnull, level=logging.DEBUG)
+    debug = timed(model_inputs, output, args.repeat)
+
+    logging.getLogger().setLevel(logging.INFO)
+    info = timed(model_inputs, output, args.repeat)
+
+    print("%d elements  DEBUG %.3fs  INFO %.3fs  logging overhead %.3fs per request"
+          % (args.elements, debug, info, debug - info))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import argparse
+import ctypes
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import sessions
+import utils
+import models
+
+"""
+Memory held per warm model with weights copied into the session versus mapped from
+the model file. Each mode loads the models in a fresh process, so the resident set
+sizes don't carry over between modes.
+"""
+
+def _memory() -> tuple:
+    """
+    (private, file-backed) resident bytes of this process, after returning freed heap to the OS.
+    """
+    ctypes.CDLL("libc.so.6").malloc_trim(0)
+    with open("/proc/self/statm", "r") as f:
+        fields = f.read().split()
+    page = os.sysconf("SC_PAGE_SIZE")
+    return (int(fields[1]) - int(fields[2])) * page, int(fields[2]) * page
+
+def load_models(paths: list, mmap_weights: bool, repeat: int) -> dict:
+    config = sessions.node_config()._replace(mmap_weights=mmap_weights, cache_optimized_model=False)
+    pool = sessions.SessionPool(config=config)
+    private_before, shared_before = _memory()
+    entries = [pool.get("model%d" % i, path, utils.hash_model(path)) for i, path in enumerate(paths)]
+    private_after, shared_after = _memory()
+
+    x = np.ones((1, entries[0].inputs[0].shape[1]), dtype=np.float32)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for entry in entries:
+            entry.session.run(entry.output_names, {"x": x})
+    run_seconds = (time.perf_counter() - start) / (repeat * len(entries))
+
+    return {"private_bytes": (private_after - private_before) / len(paths),
+            "shared_bytes": (_memory()[1] - shared_before) / len(paths),
+            "run_ms": run_seconds * 1000}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark session memory with copied and mapped weights")
+    parser.add_argument("--models", type=int, default=4)
+    parser.add_argument("--layers", type=int, default=24)
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--mode", choices=["copy", "mmap"], help=argparse.SUPPRESS)
+    parser.add_argument("--paths", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(load_models(args.paths, args.mode == "mmap", args.repeat)))
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [models.deep_mlp(os.path.join(tmp, "model%d" % i), layers=args.layers, width=args.width, seed=i)
+                 for i in range(args.models)]
+        print("%d models of %.1f MB" % (args.models, os.path.getsize(paths[0]) / 1e6))
+
+        for mode in ("copy", "mmap"):
+            output = subprocess.check_output([sys.executable, __file__, "--mode", mode, "--repeat", str(args.repeat), "--paths"] + paths)
+            result = json.loads(output.decode().strip().splitlines()[-1])
+            print("%-5s private %8.1f MB/model   file-backed %8.1f MB/model   run %6.3f ms" % (
+                mode, result["private_bytes"] / 1e6, result["shared_bytes"] / 1e6, result["run_ms"]))
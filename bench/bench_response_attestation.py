@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+import time
+from collections import namedtuple
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import attestation
+import utils
+
+"""
+Per-response attestation overhead for float32 outputs from 1 KB to 100 MB: serializing
+the /infer response, against digesting it and signing the digest (sign mode) or adding
+it to a Merkle batch (merkle mode). Also times sealing a full batch.
+"""
+
+SessionOutput = namedtuple("SessionOutput", ["name", "type"])
+
+def best(fn, repeat: int) -> float:
+    seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        seconds = min(seconds, time.perf_counter() - start)
+    return seconds
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per-response attestation")
+    parser.add_argument("--max-bytes", type=float, default=100e6)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=attestation.ATTESTATION_BATCH_SIZE)
+    args = parser.parse_args()
+
+    signer = attestation.Attestor("sign")
+    batcher = attestation.Attestor("merkle")
+    batcher.batches.batch_size = float("inf")
+    outputs = [SessionOutput("logits", "tensor(float)")]
+    model_inputs = b'{"numbers": []}' * 64
+    rng = np.random.default_rng(0)
+
+    print("%10s %14s %12s %12s %9s" % ("output", "serialize ms", "sign ms", "merkle ms", "sign %"))
+    size = 1000
+    while size <= args.max_bytes:
+        results = [rng.standard_normal(int(size) // 4).astype(np.float32)]
+        repeat = args.repeat if size < 10e6 else 1
+        body = utils.json_dumps({"output": utils.encode_onnx_output(outputs, results), "model_hash": "bench"})
+        serialize = best(lambda: utils.json_dumps({"output": utils.encode_onnx_output(outputs, results), "model_hash": "bench"}), repeat)
+        sign = best(lambda: signer.attest("bench", [model_inputs], [body]), repeat)
+        merkle = best(lambda: batcher.attest("bench", [model_inputs], [body]), repeat)
+        print("%8.0fKB %14.3f %12.3f %12.3f %8.1f%%" % (size / 1e3, serialize * 1000, sign * 1000, merkle * 1000, sign / serialize * 100))
+        size *= 10
+
+    batches = attestation.MerkleBatches(attestation.AppKey(), batch_size=float("inf"))
+    digests = [os.urandom(32) for _ in range(args.batch_size)]
+    def seal():
+        for digest in digests:
+            batches.append(digest)
+        batches.seal()
+    print("sealing a batch of %d responses: %.2f ms, one signature" % (args.batch_size, best(seal, args.repeat) * 1000))
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from starlette.responses import JSONResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import utils
+
+"""
+/infer response serialization for float32 outputs from 1 KB to 100 MB: the list path,
+serialize_onnx_output validated through a pydantic model and rendered the way FastAPI
+does, against encode_onnx_output written by orjson straight from the array.
+"""
+
+SessionOutput = namedtuple("SessionOutput", ["name", "type"])
+
+class InferenceResponse(BaseModel):
+    output: list
+    model_hash: str
+
+def list_path(outputs: list, results: list) -> bytes:
+    response = InferenceResponse(output=utils.serialize_onnx_output(outputs, results), model_hash="bench")
+    return JSONResponse(jsonable_encoder(response)).body
+
+def array_path(outputs: list, results: list) -> bytes:
+    return utils.json_dumps({"output": utils.encode_onnx_output(outputs, results), "model_hash": "bench"})
+
+def measure(fn, outputs: list, results: list, repeat: int) -> tuple:
+    """
+    (best seconds, peak traced bytes) of fn over repeat runs.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(outputs, results)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn(outputs, results)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark /infer output serialization")
+    parser.add_argument("--max-bytes", type=float, default=100e6)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--list-max-bytes", type=float, default=10e6, help="largest output to run the slow list path on")
+    args = parser.parse_args()
+
+    outputs = [SessionOutput("logits", "tensor(float)")]
+    rng = np.random.default_rng(0)
+    size = 1000
+    print("%10s %12s %12s %12s %12s %9s" % ("output", "list ms", "list peak", "array ms", "array peak", "speedup"))
+    while size <= args.max_bytes:
+        results = [rng.standard_normal(int(size) // 4).astype(np.float32)]
+        repeat = args.repeat if size < 10e6 else 1
+        array_seconds, array_peak = measure(array_path, outputs, results, repeat)
+        if size <= args.list_max_bytes:
+            list_seconds, list_peak = measure(list_path, outputs, results, repeat)
+            print("%8.0fKB %12.2f %10.1fMB %12.2f %10.1fMB %8.1fx" % (
+                size / 1e3, list_seconds * 1000, list_peak / 1e6, array_seconds * 1000, array_peak / 1e6, list_seconds / array_seconds))
+        else:
+            print("%8.0fKB %12s %12s %12.2f %10.1fMB %9s" % (size / 1e3, "-", "-", array_seconds * 1000, array_peak / 1e6, "-"))
+        size *= 10
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import sessions
+import utils
+import models
+
+"""
+Cold session load time with and without the optimized model cache. Every load uses a
+fresh SessionPool, so nothing but the on-disk cache carries over between loads.
+"""
+
+def cold_load(path: str, digest: str, config: sessions.SessionConfig) -> float:
+    pool = sessions.SessionPool(config=config)
+    start = time.perf_counter()
+    pool.get("bench", path, digest)
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark cold ONNX session loads")
+    parser.add_argument("--layers", type=int, default=48)
+    parser.add_argument("--width", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = models.deep_mlp(os.path.join(tmp, "model"), layers=args.layers, width=args.width)
+        digest = utils.hash_model(path)
+        print("model %.1f MB, %d layers" % (os.path.getsize(path) / 1e6, args.layers))
+
+        uncached = sessions.node_config()._replace(cache_optimized_model=False)
+        cached = sessions.node_config()._replace(cache_optimized_model=True)
+
+        # First cached load optimizes the graph and writes the cache file
+        first = cold_load(path, digest, cached)
+
+        without_cache = min(cold_load(path, digest, uncached) for _ in range(args.repeat))
+        with_cache = min(cold_load(path, digest, cached) for _ in range(args.repeat))
+
+        print("without cache        %8.1f ms" % (without_cache * 1000))
+        print("with cache (first)   %8.1f ms" % (first * 1000))
+        print("with cache (warm)    %8.1f ms   speedup %.2fx" % (with_cache * 1000, without_cache / with_cache))
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+"""
+Stand-in for the local IPFS daemon HTTP API, serving files from a directory where
+each file name is the CID it is served under.
+
+Supports the subset of /api/v0 the storage manager uses: `cat` (with offset and
+length, and the X-Content-Length header) and `files/stat`. Set `send_length` to
+False to leave out X-Content-Length, like older daemons. Setting `drop_after` makes `cat` cut the connection after
+that many bytes, to exercise resumed downloads. Setting `bandwidth` paces `cat` to that
+many bytes per second, like fetching from remote peers.
+"""
+
+CHUNK_SIZE = 1 << 20
+
+class FakeIPFSHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        arg = params.get("arg", [""])[0]
+        cid = arg.rsplit("/", 1)[-1]
+        path = os.path.join(self.server.directory, cid)
+        self.server.calls.append((url.path, cid))
+
+        if not cid or not os.path.isfile(path):
+            return self._send_json(500, {"Message": "block was not found locally (offline): %s" % cid,
+                                         "Code": 0,
+                                         "Type": "error"})
+
+        size = os.path.getsize(path)
+        if url.path == "/api/v0/files/stat":
+            return self._send_json(200, {"Hash": cid,
+                                         "Size": size,
+                                         "CumulativeSize": size,
+                                         "Blocks": max(1, -(-size // 262144)),
+                                         "Type": "file"})
+        elif url.path == "/api/v0/cat":
+            offset = min(int(params.get("offset", ["0"])[0]), size)
+            length = int(params.get("length", [str(size - offset)])[0])
+            return self._send_file(path, offset, min(length, size - offset))
+
+        self._send_json(404, {"Message": "unknown command", "Code": 0, "Type": "error"})
+
+    def _send_file(self, path, offset, length):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(length))
+        if self.server.send_length:
+            # The daemon announces the stream length up front, like kubo does
+            self.send_header("X-Content-Length", str(length))
+        self.end_headers()
+
+        remaining = length
+        if self.server.drop_after is not None:
+            remaining = min(remaining, self.server.drop_after)
+
+        start = time.monotonic()
+        sent = 0
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+                sent += len(chunk)
+                if self.server.bandwidth:
+                    time.sleep(max(0.0, start + sent / self.server.bandwidth - time.monotonic()))
+
+        if remaining == 0 and self.server.drop_after is not None and self.server.drop_after < length:
+            # Simulate a dropped connection partway through the body
+            self.close_connection = True
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(directory: str, host: str = "127.0.0.1", port: int = 0, drop_after: int = None, send_length: bool = True, bandwidth: float = None) -> ThreadingHTTPServer:
+    """
+    Start the stand-in daemon on a background thread. Use port 0 to pick a free port,
+    the API base URL is then f"http://{host}:{server.server_port}/api/v0".
+    """
+    server = ThreadingHTTPServer((host, port), FakeIPFSHandler)
+    server.daemon_threads = True
+    server.directory = directory
+    server.drop_after = drop_after
+    server.send_length = send_length
+    server.bandwidth = bandwidth
+    server.calls = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a directory of files as a fake IPFS daemon API")
+    parser.add_argument("directory")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--drop-after", type=int, default=None)
+    parser.add_argument("--bandwidth", type=float, default=None, help="bytes per second served by cat")
+    args = parser.parse_args()
+
+    server = serve(args.directory, args.host, args.port, args.drop_after, bandwidth=args.bandwidth)
+    print(f"Fake IPFS API serving {args.directory} on http://{args.host}:{server.server_port}/api/v0")
+    threading.Event().wait()
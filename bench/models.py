@@ -0,0 +1,122 @@
+import numpy as np
+import onnx
+from onnx import helper, numpy_helper, TensorProto
+
+"""
+Generators for the ONNX models used by the benchmarks. Requires the `onnx` package,
+which the node itself doesn't depend on.
+"""
+
+OPSET = 13
+
+def _save(graph, path: str) -> str:
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", OPSET)])
+    model.ir_version = 8
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+    return path
+
+def mlp(path: str, in_dim: int = 16, hidden: int = 64, out_dim: int = 4, batch="batch", seed: int = 0) -> str:
+    """
+    Two-layer float MLP, input "x" of shape [batch, in_dim] and output "y" of shape
+    [batch, out_dim]. Pass an int batch for a model without a dynamic batch axis.
+    """
+    rng = np.random.default_rng(seed)
+    w1 = numpy_helper.from_array(rng.standard_normal((in_dim, hidden)).astype(np.float32), "w1")
+    b1 = numpy_helper.from_array(rng.standard_normal(hidden).astype(np.float32), "b1")
+    w2 = numpy_helper.from_array(rng.standard_normal((hidden, out_dim)).astype(np.float32), "w2")
+    nodes = [
+        helper.make_node("MatMul", ["x", "w1"], ["h0"]),
+        helper.make_node("Add", ["h0", "b1"], ["h1"]),
+        helper.make_node("Relu", ["h1"], ["h2"]),
+        helper.make_node("MatMul", ["h2", "w2"], ["y"]),
+    ]
+    graph = helper.make_graph(nodes, "mlp",
+                              [helper.make_tensor_value_info("x", TensorProto.FLOAT, [batch, in_dim])],
+                              [helper.make_tensor_value_info("y", TensorProto.FLOAT, [batch, out_dim])],
+                              [w1, b1, w2])
+    return _save(graph, path)
+
+def deep_mlp(path: str, layers: int = 48, width: int = 256, batch="batch", seed: int = 0) -> str:
+    """
+    Stack of MatMul + Add + Relu layers, input "x" and output "y" of shape [batch, width].
+    Gives the graph optimizer plenty of fusions to do, for session load benchmarks.
+    """
+    rng = np.random.default_rng(seed)
+    nodes = []
+    initializers = []
+    previous = "x"
+    for i in range(layers):
+        initializers.append(numpy_helper.from_array(rng.standard_normal((width, width)).astype(np.float32), "w%d" % i))
+        initializers.append(numpy_helper.from_array(rng.standard_normal(width).astype(np.float32), "b%d" % i))
+        output = "y" if i == layers - 1 else "r%d" % i
+        nodes.append(helper.make_node("MatMul", [previous, "w%d" % i], ["m%d" % i]))
+        nodes.append(helper.make_node("Add", ["m%d" % i, "b%d" % i], ["a%d" % i]))
+        nodes.append(helper.make_node("Relu", ["a%d" % i], [output]))
+        previous = output
+    graph = helper.make_graph(nodes, "deep_mlp",
+                              [helper.make_tensor_value_info("x", TensorProto.FLOAT, [batch, width])],
+                              [helper.make_tensor_value_info("y", TensorProto.FLOAT, [batch, width])],
+                              initializers)
+    return _save(graph, path)
+
+def mlp_of_size(path: str, model_bytes: float, in_dim: int = 16, out_dim: int = 4, batch="batch", seed: int = 0) -> str:
+    """
+    mlp with its hidden width picked so the weights take about model_bytes.
+    """
+    hidden = max(1, int(model_bytes / 4 / (in_dim + out_dim + 1)))
+    return mlp(path, in_dim=in_dim, hidden=hidden, out_dim=out_dim, batch=batch, seed=seed)
+
+def cnn(path: str, channels: int = 3, size: int = 32, filters: int = 16, classes: int = 10, batch="batch", seed: int = 0) -> str:
+    """
+    Small image classifier, input "x" of shape [batch, channels, size, size] and output
+    "y" of shape [batch, classes]: two 3x3 convolutions with Relu, global average
+    pooling and a dense layer.
+    """
+    rng = np.random.default_rng(seed)
+    initializers = [
+        numpy_helper.from_array(rng.standard_normal((filters, channels, 3, 3)).astype(np.float32), "k1"),
+        numpy_helper.from_array(rng.standard_normal(filters).astype(np.float32), "c1"),
+        numpy_helper.from_array(rng.standard_normal((filters, filters, 3, 3)).astype(np.float32), "k2"),
+        numpy_helper.from_array(rng.standard_normal(filters).astype(np.float32), "c2"),
+        numpy_helper.from_array(rng.standard_normal((filters, classes)).astype(np.float32), "w"),
+    ]
+    nodes = [
+        helper.make_node("Conv", ["x", "k1", "c1"], ["v1"], pads=[1, 1, 1, 1]),
+        helper.make_node("Relu", ["v1"], ["r1"]),
+        helper.make_node("Conv", ["r1", "k2", "c2"], ["v2"], pads=[1, 1, 1, 1], strides=[2, 2]),
+        helper.make_node("Relu", ["v2"], ["r2"]),
+        helper.make_node("GlobalAveragePool", ["r2"], ["p"]),
+        helper.make_node("Flatten", ["p"], ["f"]),
+        helper.make_node("MatMul", ["f", "w"], ["y"]),
+    ]
+    graph = helper.make_graph(nodes, "cnn",
+                              [helper.make_tensor_value_info("x", TensorProto.FLOAT, [batch, channels, size, size])],
+                              [helper.make_tensor_value_info("y", TensorProto.FLOAT, [batch, classes])],
+                              initializers)
+    return _save(graph, path)
+
+def strings(path: str) -> str:
+    """
+    String model, input "text" of shape [n] lowercased into output "normalized". Uses
+    the C locale, the default en_US.UTF-8 isn't installed everywhere.
+    """
+    nodes = [helper.make_node("StringNormalizer", ["text"], ["normalized"], case_change_action="LOWER", locale="C")]
+    graph = helper.make_graph(nodes, "strings",
+                              [helper.make_tensor_value_info("text", TensorProto.STRING, ["n"])],
+                              [helper.make_tensor_value_info("normalized", TensorProto.STRING, ["n"])])
+    return _save(graph, path)
+
+def large_output(path: str, in_dim: int = 16, out_dim: int = 1 << 18, batch="batch", seed: int = 0) -> str:
+    """
+    Single dense layer with a wide output, input "x" of shape [batch, in_dim] and output
+    "y" of shape [batch, out_dim], for response serialization.
+    """
+    rng = np.random.default_rng(seed)
+    w = numpy_helper.from_array(rng.standard_normal((in_dim, out_dim)).astype(np.float32), "w")
+    nodes = [helper.make_node("MatMul", ["x", "w"], ["y"])]
+    graph = helper.make_graph(nodes, "large_output",
+                              [helper.make_tensor_value_info("x", TensorProto.FLOAT, [batch, in_dim])],
+                              [helper.make_tensor_value_info("y", TensorProto.FLOAT, [batch, out_dim])],
+                              [w])
+    return _save(graph, path)
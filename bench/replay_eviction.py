@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import eviction
+
+"""
+Trace-replay simulator for the storage eviction policies. Replays a request log against
+each policy with the same capacity and reports hit ratio, bytes fetched again after
+being evicted, and total time spent downloading.
+
+A trace has one model request per line, whitespace or comma separated:
+
+    <ipfs_hash> <size_bytes> [<download_seconds>]
+
+Lines starting with # are ignored. Without a download time one is derived from
+--bandwidth and --latency. Without --trace a synthetic trace is generated: Zipf-popular
+small and medium models, with a large model requested once every so often.
+"""
+
+def read_trace(path: str, bandwidth: float, latency: float) -> list:
+    trace = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.replace(",", " ").split()
+            size = int(float(fields[1]))
+            seconds = float(fields[2]) if len(fields) > 2 else latency + size / bandwidth
+            trace.append((fields[0], size, seconds))
+    return trace
+
+def synthetic_trace(requests: int, models: int, large_every: int, large_size: float, bandwidth: float, latency: float, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    sizes = rng.lognormal(mean=np.log(200e6), sigma=1.0, size=models).astype(np.int64)
+    popularity = 1.0 / np.arange(1, models + 1) ** 0.9
+    picks = rng.choice(models, size=requests, p=popularity / popularity.sum())
+
+    trace = []
+    for i, pick in enumerate(picks):
+        if large_every and i % large_every == large_every - 1:
+            trace.append(("QmLarge%d" % i, int(large_size), latency + large_size / bandwidth))
+        size = int(sizes[pick])
+        trace.append(("QmModel%d" % pick, size, latency + size / bandwidth))
+    return trace
+
+def replay(name: str, trace: list, capacity: float) -> dict:
+    """
+    Replay a trace the way StorageManager.get would, without any files or downloads.
+    """
+    policy = eviction.create(name, capacity)
+    cache = {}
+    used = 0
+    seen = set()
+    hits = 0
+    refetched_bytes = 0
+    fetched_bytes = 0
+    fetch_seconds = 0.0
+
+    for modelHash, size, seconds in trace:
+        if modelHash in cache:
+            hits += 1
+            policy.access(modelHash)
+            continue
+
+        fetched_bytes += size
+        fetch_seconds += seconds
+        if modelHash in seen:
+            refetched_bytes += size
+        seen.add(modelHash)
+        if size > capacity:
+            continue
+
+        while used + size > capacity:
+            victim = policy.victim(cache)
+            used -= cache.pop(victim)
+            policy.evicted(victim)
+        cache[modelHash] = size
+        used += size
+        policy.insert(modelHash, size, seconds)
+
+    return {"hit_ratio": hits / len(trace) if trace else 0.0,
+            "fetched_bytes": fetched_bytes,
+            "refetched_bytes": refetched_bytes,
+            "fetch_seconds": fetch_seconds}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a model request trace against each eviction policy")
+    parser.add_argument("--trace", help="request log, one '<ipfs_hash> <size> [<seconds>]' per line")
+    parser.add_argument("--capacity", type=float, default=40e9, help="storage capacity in bytes")
+    parser.add_argument("--bandwidth", type=float, default=50e6, help="IPFS bytes per second, for traces without download times")
+    parser.add_argument("--latency", type=float, default=2.0, help="seconds per download on top of the transfer")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--models", type=int, default=500)
+    parser.add_argument("--large-every", type=int, default=200, help="synthetic trace: a one-off large model every N requests")
+    parser.add_argument("--large-size", type=float, default=30e9)
+    parser.add_argument("--policies", nargs="*", default=sorted(eviction.POLICIES))
+    args = parser.parse_args()
+
+    if args.trace:
+        trace = read_trace(args.trace, args.bandwidth, args.latency)
+    else:
+        trace = synthetic_trace(args.requests, args.models, args.large_every, args.large_size, args.bandwidth, args.latency)
+    print("%d requests, %d distinct models, %.1f GB capacity" % (len(trace), len({r[0] for r in trace}), args.capacity / 1e9))
+
+    for name in args.policies:
+        result = replay(name, trace, args.capacity)
+        print("%-8s hit ratio %6.2f%%   re-fetched %9.1f GB   fetched %9.1f GB   downloading %8.1f h" % (
+            name, result["hit_ratio"] * 100, result["refetched_bytes"] / 1e9,
+            result["fetched_bytes"] / 1e9, result["fetch_seconds"] / 3600))
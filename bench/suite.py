@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_ipfs
+import models
+
+"""
+End-to-end benchmark suite for the /infer pipeline, runs offline on any Linux box.
+
+Generates the workload models, serves them from the fake IPFS daemon, starts the real
+server under uvicorn in a scratch directory pointed at it, and for each workload
+measures:
+
+    cold        first request, including the download, session build and warm-up
+    warm        sequential requests against the warm session, latency percentiles
+    stages      mean per-stage milliseconds of the warm requests, from Server-Timing
+    throughput  requests per second and latency at each --concurrency level
+
+Workloads:
+
+    mlp           dense float model of --mlp-bytes, a 16-value input
+    cnn           two-convolution classifier on a 3 x --image-size^2 image
+    strings       string input of --strings values, lowercased into a string output
+    large_output  16-value input to a --output-width float output
+
+The report is written as JSON to --out, with the commit it was run on. Pass an earlier
+report as --compare to print the changes.
+"""
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+WORKLOADS = ["mlp", "cnn", "strings", "large_output"]
+
+def _numbers(name: str, shape: list, rng) -> dict:
+    values = rng.integers(-10000, 10000, size=int(np.prod(shape)))
+    return {"name": name, "shape": shape, "values": [{"value": str(v), "decimals": "2"} for v in values]}
+
+def build_workloads(directory: str, args) -> dict:
+    """
+    Write each workload's model to directory under the CID it is served as, and return
+    workload name -> (CID, model_inputs JSON string).
+    """
+    rng = np.random.default_rng(0)
+    workloads = {}
+    for name in args.workloads:
+        cid = "QmBench%s" % name.title().replace("_", "")
+        path = os.path.join(directory, cid)
+        if name == "mlp":
+            models.mlp_of_size(path, args.mlp_bytes)
+            inputs = {"numbers": [_numbers("x", [1, 16], rng)]}
+        elif name == "cnn":
+            models.cnn(path, size=args.image_size)
+            inputs = {"numbers": [_numbers("x", [1, 3, args.image_size, args.image_size], rng)]}
+        elif name == "strings":
+            models.strings(path)
+            inputs = {"strings": [{"name": "text", "shape": [args.strings], "values": ["Hello World %d" % i for i in range(args.strings)]}]}
+        elif name == "large_output":
+            models.large_output(path, out_dim=args.output_width)
+            inputs = {"numbers": [_numbers("x", [1, 16], rng)]}
+        else:
+            raise ValueError("Unknown workload %s, expected one of %s" % (name, ", ".join(WORKLOADS)))
+        workloads[name] = (cid, json.dumps(inputs))
+    return workloads
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(directory: str, api_url: str, env: list) -> tuple:
+    """
+    Run server:app under uvicorn with directory as its working directory, so storage
+    starts empty, and with SERVER_WORKERS worker processes if set. Returns (process,
+    base URL).
+    """
+    port = _free_port()
+    server_env = dict(os.environ, IPFS_API_URL=api_url)
+    server_env.update(item.split("=", 1) for item in env)
+    workers = int(server_env.get("SERVER_WORKERS", "1"))
+    if workers > 1:
+        # As main.py starts them, less the nitriding handshake
+        server_env["PYTHONPATH"] = os.path.abspath(ROOT)
+        command = [sys.executable, "-c", "import server; server.serve(port=%d, log_level='warning')" % port]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "server:app", "--app-dir", os.path.abspath(ROOT),
+                   "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    process = subprocess.Popen(command, cwd=directory, env=server_env)
+    url = "http://127.0.0.1:%d" % port
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Server exited with %d" % process.returncode)
+        try:
+            if requests.get(url + "/metrics", timeout=1).ok:
+                return process, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Server didn't start within 60 seconds")
+
+def parse_server_timing(header: str) -> dict:
+    stages = {}
+    for entry in header.split(","):
+        name, _, duration = entry.strip().partition(";dur=")
+        if duration:
+            stages[name] = float(duration)
+    return stages
+
+def infer(session: requests.Session, url: str, cid: str, model_inputs: str) -> tuple:
+    """
+    One /infer request, returns (seconds, stage milliseconds).
+    """
+    start = time.perf_counter()
+    response = session.post(url + "/infer", json={"ipfs_hash": cid, "model_inputs": model_inputs},
+                            headers={"X-Request-Timing": "1"}, timeout=600)
+    seconds = time.perf_counter() - start
+    if response.status_code != 200:
+        raise RuntimeError("/infer returned %d: %s" % (response.status_code, response.text[:200]))
+    return seconds, parse_server_timing(response.headers.get("Server-Timing", ""))
+
+def percentiles(seconds: list) -> dict:
+    milliseconds = np.array(seconds) * 1000
+    return {"mean_ms": float(milliseconds.mean()),
+            "p50_ms": float(np.percentile(milliseconds, 50)),
+            "p90_ms": float(np.percentile(milliseconds, 90)),
+            "p99_ms": float(np.percentile(milliseconds, 99))}
+
+def throughput(url: str, cid: str, model_inputs: str, concurrency: int, duration: float) -> dict:
+    """
+    Requests per second with concurrency clients sending back to back for duration seconds.
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            try:
+                seconds, _ = infer(session, url, cid, model_inputs)
+            except (RuntimeError, requests.RequestException):
+                with lock:
+                    errors[0] += 1
+                continue
+            with lock:
+                latencies.append(seconds)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    result = {"requests_per_second": len(latencies) / elapsed, "requests": len(latencies), "errors": errors[0]}
+    if latencies:
+        result.update(percentiles(latencies))
+    return result
+
+def run_workload(url: str, cid: str, model_inputs: str, args) -> dict:
+    session = requests.Session()
+    cold_seconds, cold_stages = infer(session, url, cid, model_inputs)
+
+    warm = []
+    stages = {}
+    for _ in range(args.requests):
+        seconds, timings = infer(session, url, cid, model_inputs)
+        warm.append(seconds)
+        for name, milliseconds in timings.items():
+            stages[name] = stages.get(name, 0.0) + milliseconds
+
+    return {"input_bytes": len(model_inputs),
+            "cold_ms": cold_seconds * 1000,
+            "cold_stages_ms": cold_stages,
+            "warm": percentiles(warm),
+            "stages_ms": {name: total / args.requests for name, total in stages.items()},
+            "throughput": {str(concurrency): throughput(url, cid, model_inputs, concurrency, args.duration) for concurrency in args.concurrency}}
+
+def git_commit() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": dirty}
+
+def _flatten(report: dict, prefix: str = "") -> dict:
+    values = {}
+    for key, value in report.items():
+        if isinstance(value, dict):
+            values.update(_flatten(value, prefix + key + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[prefix + key] = value
+    return values
+
+def compare(baseline: dict, report: dict) -> None:
+    old = _flatten(baseline["workloads"])
+    new = _flatten(report["workloads"])
+    print("\n%-60s %12s %12s %9s" % ("vs %s" % (baseline.get("commit") or "baseline")[:12], "before", "after", "change"))
+    for key in sorted(set(old) & set(new)):
+        if old[key]:
+            print("%-60s %12.3f %12.3f %+8.1f%%" % (key, old[key], new[key], (new[key] - old[key]) / old[key] * 100))
+
+def print_report(report: dict) -> None:
+    for name, result in report["workloads"].items():
+        warm = result["warm"]
+        print("%-13s cold %9.1f ms   warm p50 %8.2f ms  p99 %8.2f ms" % (name, result["cold_ms"], warm["p50_ms"], warm["p99_ms"]))
+        print("%13s stages %s" % ("", "  ".join("%s %.2f" % item for item in result["stages_ms"].items())))
+        for concurrency, level in result["throughput"].items():
+            print("%13s x%-3s %8.1f req/s  p50 %8.2f ms  p99 %8.2f ms  errors %d" % (
+                "", concurrency, level["requests_per_second"], level.get("p50_ms", 0), level.get("p99_ms", 0), level["errors"]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the /infer pipeline end to end against a fake IPFS daemon")
+    parser.add_argument("--workloads", nargs="*", default=WORKLOADS, choices=WORKLOADS)
+    parser.add_argument("--requests", type=int, default=200, help="sequential warm requests per workload")
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 4, 16])
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per concurrency level")
+    parser.add_argument("--mlp-bytes", type=float, default=4e6)
+    parser.add_argument("--image-size", type=int, default=32)
+    parser.add_argument("--strings", type=int, default=256)
+    parser.add_argument("--output-width", type=int, default=1 << 18)
+    parser.add_argument("--bandwidth", type=float, default=None, help="fake IPFS bytes per second, unlimited by default")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="server environment, e.g. INFER_WORKERS=4 or SERVER_WORKERS=2")
+    parser.add_argument("--out", default="bench-report.json")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        ipfs_dir = os.path.join(directory, "ipfs")
+        node_dir = os.path.join(directory, "node")
+        os.makedirs(ipfs_dir)
+        os.makedirs(node_dir)
+        workloads = build_workloads(ipfs_dir, args)
+
+        daemon = fake_ipfs.serve(ipfs_dir, bandwidth=args.bandwidth)
+        process, url = start_server(node_dir, "http://127.0.0.1:%d/api/v0" % daemon.server_port, args.env)
+        try:
+            results = {name: run_workload(url, cid, model_inputs, args) for name, (cid, model_inputs) in workloads.items()}
+        finally:
+            process.terminate()
+            process.wait()
+            daemon.shutdown()
+
+    report = dict(git_commit(),
+                  created=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                  host={"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+                  config={key: value for key, value in vars(args).items() if key not in ("out", "compare")},
+                  workloads=results)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    print("Report written to %s" % args.out)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(json.load(f), report)
@@ -0,0 +1,163 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import asyncio
+import os
+import threading
+import time
+
+# Server processes sharing the node, see server.py
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", "1"))
+# Worker threads running inference, each session.run gets an equal share of the cores
+INFER_WORKERS = int(os.environ.get("INFER_WORKERS", "2"))
+# Requests allowed to wait for a worker before the node reports itself saturated
+INFER_QUEUE_DEPTH = int(os.environ.get("INFER_QUEUE_DEPTH", "32"))
+# Seconds a request may spend queued and running before it is abandoned
+INFER_TIMEOUT = float(os.environ.get("INFER_TIMEOUT", "60"))
+# Model loads, i.e. downloads and session builds, run at once per server process
+MODEL_LOAD_WORKERS = int(os.environ.get("MODEL_LOAD_WORKERS", "2"))
+# Model loads allowed to wait for a load worker before new ones are refused
+MODEL_LOAD_QUEUE_DEPTH = int(os.environ.get("MODEL_LOAD_QUEUE_DEPTH", "16"))
+# Retry-After seconds returned when saturated
+RETRY_AFTER = 1
+
+class Saturated(Exception):
+    pass
+
+class InferenceTimeout(Exception):
+    pass
+
+def intra_op_threads(workers: int = INFER_WORKERS, processes: int = SERVER_WORKERS) -> int:
+    """
+    onnxruntime intra-op threads per session so that all workers of all server
+    processes together use each core once.
+    """
+    return max(1, (os.cpu_count() or 1) // (workers * processes))
+
+class InferenceExecutor():
+    def __init__(self, workers: int = INFER_WORKERS, queue_depth: int = INFER_QUEUE_DEPTH, timeout: float = INFER_TIMEOUT, name: str = "inference"):
+        """
+        Bounded thread pool for the blocking stages of a request, with admission control
+
+        At most workers + queue_depth requests are admitted at once, further ones raise
+        Saturated immediately instead of queueing. A request is admitted once and all
+        of its stages share one deadline, timeout seconds after it started; a stage
+        still waiting at the deadline raises InferenceTimeout, and is cancelled if it
+        never left the queue. A stage that is already running keeps its request's
+        admission until it returns, so abandoned work still counts against the node's
+        capacity. name labels the pool's threads and errors.
+        """
+        self.workers = workers
+        self.limit = workers + queue_depth
+        self.timeout = timeout
+        self.name = name
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.pending = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.lock = threading.Lock()
+
+    def deadline(self) -> float:
+        """
+        Deadline, on the monotonic clock, of a request starting now.
+        """
+        return time.monotonic() + self.timeout
+
+    def admit(self, deadline: float = None) -> "Admission":
+        """
+        Admit a request, raising Saturated when the pool is full. Its stages run through
+        the returned Admission, used as a with block, until the deadline.
+        """
+        with self.lock:
+            if self.pending >= self.limit:
+                self.rejected += 1
+                raise Saturated("%s queue is full, %d pending" % (self.name.capitalize(), self.pending))
+            self.pending += 1
+        return Admission(self, deadline if deadline is not None else self.deadline())
+
+    async def run(self, fn, *args):
+        """
+        Run fn(*args) on the pool as a request of its own and await its result.
+        """
+        with self.admit() as admission:
+            return await admission.run(fn, *args)
+
+    def submit(self, fn, *args) -> Future:
+        """
+        Admit fn(*args) and queue it on the pool, returning its future. Raises Saturated
+        when the pool is full.
+        """
+        with self.admit() as admission:
+            return admission.submit(fn, *args)
+
+    async def wait(self, awaitable, deadline: float = None):
+        """
+        Await awaitable until the deadline, by default timeout seconds from now,
+        raising InferenceTimeout after it.
+        """
+        remaining = (deadline if deadline is not None else self.deadline()) - time.monotonic()
+        try:
+            return await asyncio.wait_for(awaitable, max(remaining, 0))
+        except asyncio.TimeoutError:
+            raise self._timedOut()
+
+    def _timedOut(self) -> InferenceTimeout:
+        with self.lock:
+            self.timed_out += 1
+        return InferenceTimeout("%s did not finish within %s seconds" % (self.name.capitalize(), self.timeout))
+
+    def _release(self) -> None:
+        with self.lock:
+            self.pending -= 1
+
+class Admission():
+    def __init__(self, executor: InferenceExecutor, deadline: float):
+        """
+        One request's admission on an InferenceExecutor and its deadline
+
+        Released once the with block exits and every stage submitted through it has
+        returned. Stages submitted after that no longer count against the pool.
+        """
+        self.executor = executor
+        self.deadline = deadline
+        self.holders = 1
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._done()
+
+    async def run(self, fn, *args):
+        """
+        Run fn(*args) on the pool and await its result until the deadline.
+        """
+        if self.deadline <= time.monotonic():
+            # Don't queue work nobody will wait for
+            raise self.executor._timedOut()
+        return await self.wait(asyncio.wrap_future(self.submit(fn, *args)))
+
+    def submit(self, fn, *args) -> Future:
+        """
+        Queue fn(*args) on the pool under this admission, returning its future.
+        """
+        with self.lock:
+            held = self.holders > 0
+            if held:
+                self.holders += 1
+        future = self.executor.pool.submit(fn, *args)
+        if held:
+            future.add_done_callback(self._done)
+        return future
+
+    async def wait(self, awaitable):
+        """
+        Await awaitable until the deadline, e.g. a stage run elsewhere.
+        """
+        return await self.executor.wait(awaitable, self.deadline)
+
+    def _done(self, future=None) -> None:
+        with self.lock:
+            self.holders -= 1
+            released = self.holders == 0
+        if released:
+            self.executor._release()
@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+
+import server
+
+"""
+Entry point of the enclave server, run by start.sh.
+
+Kept apart from server.py: uvicorn's worker processes re-run the main module before
+they import server:app, so were it server.py, every worker would build a second copy
+of its storage, pools and metrics.
+"""
+
+# Main entry point to start the server
+if __name__ == "__main__":
+    server.main()
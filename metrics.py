@@ -0,0 +1,165 @@
+from contextlib import contextmanager
+import bisect
+import contextvars
+import threading
+import time
+
+"""
+Minimal Prometheus-format metrics for the node: counters, gauges and histograms with
+at most one label, rendered by render() for the /metrics endpoint.
+"""
+
+PREFIX = "og_node_"
+
+# Latency buckets in seconds, from sub-millisecond decoding up to multi-minute downloads
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Metrics by name. One registered again under the same name, e.g. by a module imported
+# twice, replaces the earlier one, so each family is rendered once
+_registry = {}
+
+# Per-request stage timings, set by the request handler and filled in by stage()
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+class Counter():
+    def __init__(self, name: str, help: str, label: str = None):
+        self.name = PREFIX + name
+        self.help = help
+        self.label = label
+        # Unlabeled counters report 0 before their first increment
+        self.values = {} if label is not None else {None: 0}
+        self.lock = threading.Lock()
+        _registry[self.name] = self
+
+    def inc(self, amount: float = 1, label_value: str = None) -> None:
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def render(self) -> list:
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s counter" % self.name]
+        with self.lock:
+            for label_value, value in sorted(self.values.items(), key=lambda item: str(item[0])):
+                lines.append("%s%s %s" % (self.name, _labels(self.label, label_value), _number(value)))
+        return lines
+
+class Gauge():
+    def __init__(self, name: str, help: str, fn=None, type: str = "gauge"):
+        """
+        A value that goes up and down, or if fn is given, a value read from fn() at
+        scrape time. type can be "counter" for monotonically increasing callbacks.
+        """
+        self.name = PREFIX + name
+        self.help = help
+        self.fn = fn
+        self.type = type
+        self.value = 0
+        self.lock = threading.Lock()
+        _registry[self.name] = self
+
+    def inc(self, amount: float = 1) -> None:
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        with self.lock:
+            self.value -= amount
+
+    @contextmanager
+    def track(self):
+        """
+        Count the duration of a with block, e.g. requests in flight.
+        """
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def render(self) -> list:
+        value = self.fn() if self.fn is not None else self.value
+        return ["# HELP %s %s" % (self.name, self.help),
+                "# TYPE %s %s" % (self.name, self.type),
+                "%s %s" % (self.name, _number(value))]
+
+class Histogram():
+    def __init__(self, name: str, help: str, label: str = None, buckets: tuple = STAGE_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+        _registry[self.name] = self
+
+    def observe(self, value: float, label_value: str = None) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, totals = self.series.setdefault(label_value, ([0] * (len(self.buckets) + 1), [0, 0.0]))
+            counts[index] += 1
+            totals[0] += 1
+            totals[1] += value
+
+    def render(self) -> list:
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s histogram" % self.name]
+        with self.lock:
+            for label_value, (counts, totals) in sorted(self.series.items(), key=lambda item: str(item[0])):
+                cumulative = 0
+                for bound, count in zip(list(self.buckets) + ["+Inf"], counts):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else _number(bound)
+                    lines.append("%s_bucket%s %d" % (self.name, _labels(self.label, label_value, le=le), cumulative))
+                lines.append("%s_count%s %d" % (self.name, _labels(self.label, label_value), totals[0]))
+                lines.append("%s_sum%s %s" % (self.name, _labels(self.label, label_value), _number(totals[1])))
+        return lines
+
+def _labels(label: str, label_value: str, le: str = None) -> str:
+    pairs = []
+    if label is not None and label_value is not None:
+        pairs.append('%s="%s"' % (label, str(label_value).replace("\\", "\\\\").replace('"', '\\"')))
+    if le is not None:
+        pairs.append('le="%s"' % le)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render() -> str:
+    """
+    All registered metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in _registry.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+STAGE_SECONDS = Histogram("stage_duration_seconds", "Time spent in each stage of serving a request", label="stage")
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a with block into the stage histogram, and into the current request's timings
+    if it is being traced.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, name)
+        timings = request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+def trace_request() -> dict:
+    """
+    Start collecting stage timings for the current request, returns the timings dict.
+    """
+    timings = {}
+    request_timings.set(timings)
+    return timings
+
+def server_timing(timings: dict) -> str:
+    """
+    Format request timings as a Server-Timing header value, durations in milliseconds.
+    """
+    return ", ".join("%s;dur=%.3f" % (name, seconds * 1000) for name, seconds in timings.items())
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import os
+import utils
+import metrics
+import executor
+
+logger = logging.getLogger(__name__)
+
+# File listing IPFS hashes to fetch and warm at boot, one per line
+MODEL_PRELOAD_FILE = os.environ.get("MODEL_PRELOAD_FILE", "")
+
+LOADING = "loading"
+WARM = "warm"
+FAILED = "failed"
+
+def read_manifest(path: str) -> list:
+    """
+    IPFS hashes listed in a preload manifest, skipping blank lines and # comments.
+    """
+    with open(path, "r") as f:
+        lines = [line.split("#", 1)[0].strip() for line in f]
+    return [line for line in lines if line]
+
+def warm_up(entry) -> None:
+    """
+    Run a session once on zero-filled inputs so first-run allocations happen now.
+    """
+    with metrics.stage("warm_up"):
+        entry.session.run(entry.output_names, utils.zero_inputs(entry.inputs))
+
+class Prefetcher():
+    def __init__(self, load, concurrency: int = executor.MODEL_LOAD_WORKERS):
+        """
+        Fetches models into storage and builds warm sessions in the background
+
+        load is an async callable load(ipfs_hash) returning (model_hash, SessionEntry),
+        e.g. the server's single-flight model load, so prefetches and requests for the
+        same model share one download. At most concurrency prefetches load at once, so
+        a long manifest leaves the load queue to requests.
+
+        States are keyed by model hash:
+            key: model_hash
+            value: (state, error)
+        """
+        self.load = load
+        self.slots = asyncio.Semaphore(concurrency)
+        self.states = {}
+        self.tasks = set()
+
+    def schedule(self, ipfs_hashes: list) -> None:
+        """
+        Start prefetching each hash that isn't already loading.
+        """
+        for ipfs_hash in ipfs_hashes:
+            if self.states.get(ipfs_hash, (None, None))[0] == LOADING:
+                continue
+
+            self.states[ipfs_hash] = (LOADING, None)
+            task = asyncio.ensure_future(self._prefetch(ipfs_hash))
+            # Keep a reference so the task isn't garbage collected while running
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _prefetch(self, ipfs_hash: str) -> None:
+        try:
+            async with self.slots:
+                while True:
+                    try:
+                        _, entry = await self.load(ipfs_hash)
+                        break
+                    except executor.Saturated:
+                        # Requests filled the load queue, prefetches can wait their turn
+                        await asyncio.sleep(executor.RETRY_AFTER)
+        except Exception as e:
+            logger.warning("Prefetch of model %s failed: %s", ipfs_hash, e)
+            self.states[ipfs_hash] = (FAILED, str(e))
+            return
+
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, warm_up, entry)
+        except Exception as e:
+            # The session is usable, only the dummy run failed, e.g. on zero-valued inputs
+            logger.warning("Warm-up run of model %s failed: %s", ipfs_hash, e)
+
+        self.states[ipfs_hash] = (WARM, None)
+        logger.info("Prefetched model %s", ipfs_hash)
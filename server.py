@@ -1,28 +1,179 @@
-#!/usr/bin/env python3
-
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import onnxruntime as ort
+from contextlib import asynccontextmanager, contextmanager
 import urllib.request
+import inspect
+import socket
+from uvicorn.protocols.http.h11_impl import H11Protocol
+import base64
 import numpy as np
 import time
-from storage import storage
+from storage import storage, sessions, singleflight, ipfs
 import utils
+import wire
+import executor
+import logging
+import os
+import batching
+import metrics
+import asyncio
+import prefetch
+import attestation
 import requests
 
+logger = logging.getLogger(__name__)
+
 ### Nitriding testing ###
 nitriding_url = "http://127.0.0.1:8080/enclave/ready"
 
+class NoDelayH11Protocol(H11Protocol):
+    """
+    uvicorn binds the socket it shares with its worker processes without IPPROTO_TCP,
+    so asyncio never disables Nagle on their connections, and a response body written
+    after its headers waits out the client's delayed ACK, ~40ms.
+    """
+    def connection_made(self, transport):
+        sock = transport.get_extra_info("socket")
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().connection_made(transport)
+
 def signal_ready():
     r = urllib.request.urlopen(nitriding_url)
     if r.getcode() != 200:
         raise Exception("Expected status code %d but got %d" %
                         (requests.status_codes.codes.ok, r.status_code))
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Fetch and warm the models listed in the boot-time preload manifest
+    if prefetch.MODEL_PRELOAD_FILE:
+        ipfs_hashes = prefetch.read_manifest(prefetch.MODEL_PRELOAD_FILE)
+        logger.info("Preloading %d models from %s", len(ipfs_hashes), prefetch.MODEL_PRELOAD_FILE)
+        prefetcher.schedule(ipfs_hashes)
+    # Pinned models are kept hot, fetch and warm them too
+    if storage.pinned:
+        logger.info("Preloading %d pinned models", len(storage.pinned))
+        prefetcher.schedule(sorted(storage.pinned))
+    # Periodically sign the Merkle root of the responses attested since the last seal
+    sealer = asyncio.create_task(seal_batches()) if attestor.batches is not None else None
+    yield
+    if sealer is not None:
+        sealer.cancel()
+
+app = FastAPI(lifespan=lifespan)
+
+# Inititalize Storage Manager, its model directory shared by all server workers
+storage = storage.StorageManager(shared=executor.SERVER_WORKERS > 1)
+
+# Bounded pool for inference work, so one slow request can't stall the event loop
+inference_executor = executor.InferenceExecutor()
+
+# Opt-in micro-batching of concurrent requests to the same model
+micro_batcher = batching.MicroBatcher(inference_executor.run)
+
+# Initialize warm ONNX session pool, sharing the cores and memory with the other inference
+# workers and server workers
+session_pool = sessions.SessionPool(capacity=sessions.default_capacity(executor.SERVER_WORKERS),
+                                    config=sessions.node_config(intra_op_threads=executor.intra_op_threads(inference_executor.workers)),
+                                    model_configs=sessions.load_model_configs())
+
+# Sessions sharing weights with an evicted model file would keep its pages alive
+storage.on_evict = session_pool.unmap
+# Optimized graphs cached next to a model take storage space like the model itself
+session_pool.on_sidecar = storage.addSidecar
+
+# Bounded pool for model downloads and session builds, so cold loads can't hold up
+# warm requests or pile up without limit
+load_executor = executor.InferenceExecutor(workers=executor.MODEL_LOAD_WORKERS,
+                                           queue_depth=executor.MODEL_LOAD_QUEUE_DEPTH,
+                                           name="load")
+
+# Coalesces concurrent cold loads of the same model into one download and session build
+model_loads = singleflight.SingleFlight(submit=load_executor.submit)
+
+# Background model fetch and warm-up, sharing in-flight loads with requests
+prefetcher = prefetch.Prefetcher(lambda ipfs_hash: model_loads.do_async(ipfs_hash, load_model, ipfs_hash))
+
+# Signs or Merkle-batches a digest of each response's model hash, inputs and outputs
+attestor = attestation.Attestor(batch_directory=attestation.ATTESTATION_BATCH_DIR if executor.SERVER_WORKERS > 1 else None)
+
+# Rows of a /infer/batch request decoded, run and serialized together
+INFER_BATCH_CHUNK_ROWS = int(os.environ.get("INFER_BATCH_CHUNK_ROWS", "256"))
+
+# Clients send this header to get per-stage timings back in a Server-Timing header
+TIMING_REQUEST_HEADER = "X-Request-Timing"
+
+model_loads_total = metrics.Counter("model_loads_total", "Model loads that fetched the model or built its session")
+requests_in_flight = metrics.Gauge("requests_in_flight", "Inference requests currently being served")
+metrics.Gauge("storage_bytes", "Bytes of models held in storage", fn=lambda: storage.current_size)
+metrics.Gauge("session_pool_sessions", "Warm ONNX sessions in the pool", fn=lambda: len(session_pool.pool))
+metrics.Gauge("session_pool_bytes", "Estimated memory held by warm ONNX sessions", fn=lambda: session_pool.current_size)
+metrics.Gauge("model_loads_coalesced_total", "Requests that joined an in-flight model load", fn=lambda: model_loads.coalesced, type="counter")
+metrics.Gauge("executor_pending", "Requests admitted to the inference executor", fn=lambda: inference_executor.pending)
+metrics.Gauge("executor_rejected_total", "Requests rejected because the node was saturated", fn=lambda: inference_executor.rejected, type="counter")
+metrics.Gauge("executor_timeouts_total", "Requests that exceeded the request timeout", fn=lambda: inference_executor.timed_out, type="counter")
+metrics.Gauge("load_executor_pending", "Model loads queued or running on the load pool", fn=lambda: load_executor.pending)
+metrics.Gauge("load_executor_rejected_total", "Model loads rejected because the load pool was full", fn=lambda: load_executor.rejected, type="counter")
+metrics.Gauge("load_executor_timeouts_total", "Requests that gave up waiting for their model to load", fn=lambda: load_executor.timed_out, type="counter")
+metrics.Gauge("batches_total", "Micro-batches run with more than one request", fn=lambda: micro_batcher.batches, type="counter")
+metrics.Gauge("batched_requests_total", "Requests served as part of a micro-batch", fn=lambda: micro_batcher.batched_requests, type="counter")
 
-# Inititalize Storage Manager
-storage = storage.StorageManager()
+async def seal_batches():
+    while True:
+        await asyncio.sleep(attestation.ATTESTATION_BATCH_SECONDS)
+        await asyncio.to_thread(attestor.batches.seal)
+
+def load_model(ipfs_hash: str) -> tuple:
+    """
+    Fetch the model into storage and get its warm session. Returns (model_hash, SessionEntry).
+    """
+    # Only a download or a session build counts as a load, not finding both warm
+    if ipfs_hash not in storage.models() or session_pool.peek(ipfs_hash) is None:
+        model_loads_total.inc()
+    with metrics.stage("storage_get"):
+        model_path = storage.get(ipfs_hash)
+    model_hash = storage.digest(ipfs_hash)
+    return model_hash, session_pool.get(ipfs_hash, model_path, model_hash)
+
+async def get_model(ipfs_hash: str, deadline: float) -> tuple:
+    """
+    load_model for a request. A warm model is served on the event loop, anything else
+    goes through the single-flight load on the load pool, which the request waits on
+    until its deadline.
+    """
+    entry = session_pool.peek(ipfs_hash)
+    if entry is not None:
+        cached = storage.cached(ipfs_hash)
+        if cached is not None:
+            return cached[1], entry
+    return await load_executor.wait(model_loads.do_async(ipfs_hash, load_model, ipfs_hash), deadline)
+
+async def run_stage(name: str, stage):
+    """
+    Await a stage of the request, timing it and mapping its errors with http_errors.
+    """
+    with http_errors(), metrics.stage(name):
+        return await stage
+
+@contextmanager
+def http_errors():
+    """
+    Map overload, timeouts, unknown models and invalid inputs to HTTP errors.
+    """
+    try:
+        yield
+    except executor.Saturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(executor.RETRY_AFTER)})
+    except executor.InferenceTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ipfs.ModelNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ipfs.DaemonUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(executor.RETRY_AFTER)})
+    except utils.InvalidInput as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 class InferenceRequest(BaseModel):
     ipfs_hash: str
@@ -32,46 +183,359 @@ class InferenceResponse(BaseModel):
     output: list
     model_hash: str
 
-@app.post("/infer")
-async def infer(request: InferenceRequest):
-    # Get model from storage
-    model_path = storage.get(request.ipfs_hash)
+class BatchInferenceRequest(BaseModel):
+    ipfs_hash: str
+    model_inputs: list[str]
+
+class PrefetchRequest(BaseModel):
+    ipfs_hashes: list[str]
+
+class ModelStatus(BaseModel):
+    ipfs_hash: str
+    state: str
+    size: int | None = None
+    pinned: bool = False
+    error: str | None = None
 
-    # Create ONNX session
-    session = ort.InferenceSession(model_path)
+@app.post("/infer", response_model=InferenceResponse)
+async def infer(request: InferenceRequest, http_request: Request):
+    timings = metrics.trace_request()
+    with requests_in_flight.track(), metrics.stage("total"):
+        body, headers = await infer_json(request)
 
-    # Convert API inputs into ONNX inputs
-    input_names = session.get_inputs()
-    print("Model inputs: ", request.model_inputs)
+    if TIMING_REQUEST_HEADER in http_request.headers:
+        headers["Server-Timing"] = metrics.server_timing(timings)
 
-    onnx_inputs = utils.convert_to_onnx_input(input_names, request.model_inputs)
-    print("Onnx inputs: ", onnx_inputs)
+    # Body is an InferenceResponse already encoded, large outputs never become Python objects
+    return Response(content=body, media_type="application/json", headers=headers)
 
-    # Run inference
-    onnx_outputs = [output.name for output in session.get_outputs()]
-    print("Onnx outputs: ", onnx_outputs)
-    result = session.run(onnx_outputs, onnx_inputs)
-    print("Inference Result: ", result)
+def render_inference_response(session_outputs: list, results: list, model_hash: str) -> bytes:
+    """
+    InferenceResponse body, with number outputs written straight from the result arrays.
+    """
+    return utils.json_dumps({"output": utils.encode_onnx_output(session_outputs, results), "model_hash": model_hash})
 
-    # Serialize ONNX results for return JSON
-    infer_output = utils.serialize_onnx_output(session_outputs=session.get_outputs(), results=result)
-    print("Inference results: ", infer_output)
+def render_attested_response(session_outputs: list, results: list, model_hash: str, model_inputs: str) -> tuple:
+    """
+    (InferenceResponse body, attestation headers binding the model hash, inputs and body)
+    """
+    body = render_inference_response(session_outputs, results, model_hash)
+    if not attestor.enabled:
+        return body, {}
+    return body, attestation.headers(attestor.attest(model_hash, [model_inputs.encode("utf-8")], [body]))
 
-    # TODO (Kyle): Model hash should go into the attestation document that is returned as part of
-    #              any inference -- Along with model input, and model output.
-    # Get hash of model as checksum
-    model_hash = utils.hash_model(model_path)
+async def infer_json(request: InferenceRequest) -> tuple:
+    """
+    Serve a JSON inference request, returning the encoded InferenceResponse and its
+    attestation headers.
+    """
+    # Loading the model and every stage after it share one deadline
+    deadline = inference_executor.deadline()
 
-    return InferenceResponse(output=infer_output, 
-                             model_hash=model_hash)
+    # Lease the model so storage can't evict its file while this request uses it
+    with storage.lease(request.ipfs_hash):
+        # Get model from storage and its warm ONNX session, creating them on first use
+        model_hash, entry = await run_stage("load", get_model(request.ipfs_hash, deadline))
+
+        # Admitted once, so a request that got this far isn't turned away halfway
+        with http_errors():
+            admission = inference_executor.admit(deadline)
+        with admission:
+            # Convert API inputs into ONNX inputs
+            logger.debug("Model inputs: %s", request.model_inputs)
+            onnx_inputs = await run_stage("decode", admission.run(utils.convert_to_onnx_input, entry.plan, request.model_inputs))
+            logger.debug("Onnx inputs: %s", onnx_inputs)
+
+            # Run inference, batched with concurrent requests to the same model if enabled
+            logger.debug("Onnx outputs: %s", entry.output_names)
+            result = await run_stage("run", admission.wait(micro_batcher.run(request.ipfs_hash, entry, onnx_inputs, admission.run)))
+            logger.debug("Inference result: %s", result)
+
+            # Serialize ONNX results for return JSON, hash of model as checksum comes from storage
+            body, headers = await run_stage("serialize", admission.run(render_attested_response, entry.outputs, result, model_hash, request.model_inputs))
+            logger.debug("Inference response: %s", body)
+
+    return body, headers
     
-# Main entry point to start the server
-if __name__ == "__main__":
-    print("[py] Starting enclave server...")
+@app.post("/infer/binary")
+async def infer_binary(request: Request):
+    """
+    Same as /infer, but inputs and outputs use the binary tensor format in wire.py
+    """
+    timings = metrics.trace_request()
+    with requests_in_flight.track(), metrics.stage("total"):
+        chunks, headers = await infer_tensors(await request.body())
+
+    headers["Content-Length"] = str(sum(len(chunk) for chunk in chunks))
+    if TIMING_REQUEST_HEADER in request.headers:
+        headers["Server-Timing"] = metrics.server_timing(timings)
+
+    # Response body is streamed straight from the output arrays without joining them
+    return StreamingResponse(iter(chunks), media_type=wire.MEDIA_TYPE, headers=headers)
+
+async def infer_tensors(body: bytes) -> tuple:
+    """
+    Serve a binary inference request, returning the response message as a list of
+    buffers and its attestation headers.
+    """
+    try:
+        with metrics.stage("decode"):
+            ipfs_hash, tensors = wire.decode(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Loading the model and every stage after it share one deadline
+    deadline = inference_executor.deadline()
+
+    # Lease the model so storage can't evict its file while this request uses it
+    with storage.lease(ipfs_hash):
+        # Get model from storage and its warm ONNX session, creating them on first use
+        model_hash, entry = await run_stage("load", get_model(ipfs_hash, deadline))
+
+        try:
+            onnx_inputs = wire.match_inputs(entry.inputs, tensors)
+            utils.check_shapes(entry.plan, onnx_inputs)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        # Admitted once, so a request that got this far isn't turned away halfway
+        with http_errors():
+            admission = inference_executor.admit(deadline)
+        with admission:
+            # Run inference
+            result = await run_stage("run", admission.wait(micro_batcher.run(ipfs_hash, entry, onnx_inputs, admission.run)))
+
+            with metrics.stage("serialize"):
+                chunks = wire.encode(model_hash, list(zip(entry.output_names, result)))
+
+            if not attestor.enabled:
+                return chunks, {}
+            # The request body is hashed as received, and outputs straight from the result arrays
+            fields = await run_stage("attest", admission.run(attestor.attest, model_hash, [body], chunks))
+    return chunks, attestation.headers(fields)
+
+@app.post("/infer/batch")
+async def infer_batch(request: BatchInferenceRequest):
+    """
+    Run many input sets against one model. The response is NDJSON: a first line with the
+    model hash and row count, then one line per input set in order, holding either its
+    output or its error. With attestation on, a last line holds the attestation of all
+    the lines before it.
+    """
+    # Lease the model so storage can't evict its file while it loads
+    with storage.lease(request.ipfs_hash):
+        model_hash, entry = await run_stage("load", get_model(request.ipfs_hash, inference_executor.deadline()))
+
+    return StreamingResponse(stream_rows(entry, model_hash, request.model_inputs), media_type="application/x-ndjson")
+
+async def stream_rows(entry: sessions.SessionEntry, model_hash: str, rows: list):
+    """
+    Yield NDJSON lines for the rows a chunk at a time, so only one chunk of decoded
+    tensors and outputs is in memory at once.
+    """
+    digest = attestor.start(model_hash, [row.encode("utf-8") for row in rows]) if attestor.enabled else None
+    header = utils.json_dumps({"model_hash": model_hash, "rows": len(rows)}) + b"\n"
+    if digest is not None:
+        digest.update(header)
+    yield header
+
+    for start in range(0, len(rows), INFER_BATCH_CHUNK_ROWS):
+        chunk = rows[start:start + INFER_BATCH_CHUNK_ROWS]
+        while True:
+            try:
+                with requests_in_flight.track(), metrics.stage("batch_chunk"):
+                    lines = await inference_executor.run(infer_rows, entry, chunk, start)
+                break
+            except executor.Saturated:
+                # The response is already streaming, so wait for capacity instead of failing
+                await asyncio.sleep(executor.RETRY_AFTER)
+            except executor.InferenceTimeout as e:
+                lines = [utils.json_dumps({"index": start + i, "error": str(e)}) + b"\n" for i in range(len(chunk))]
+                break
+
+        block = b"".join(lines)
+        if digest is not None:
+            digest.update(block)
+        yield block
+
+    if digest is not None:
+        yield utils.json_dumps({"attestation": attestor.finish(digest)}) + b"\n"
+
+def infer_rows(entry: sessions.SessionEntry, rows: list, start: int) -> list:
+    """
+    Decode a chunk of JSON model inputs, run them in as few session.run calls as the
+    model's batch axis allows, and serialize one NDJSON line per row.
+    """
+    lines = [None] * len(rows)
+    decoded = []
+    for i, row in enumerate(rows):
+        try:
+            decoded.append((i, utils.convert_to_onnx_input(entry.plan, row)))
+        except Exception as e:
+            lines[i] = utils.json_dumps({"index": start + i, "error": str(e)}) + b"\n"
+
+    results = batching.run_stacked(entry, [onnx_inputs for _, onnx_inputs in decoded])
+    for (i, _), result in zip(decoded, results):
+        try:
+            if isinstance(result, Exception):
+                raise result
+            output = utils.encode_onnx_output(entry.outputs, result)
+            lines[i] = utils.json_dumps({"index": start + i, "output": output}) + b"\n"
+        except Exception as e:
+            lines[i] = utils.json_dumps({"index": start + i, "error": str(e)}) + b"\n"
+    return lines
+
+@app.post("/models/prefetch", status_code=202)
+async def prefetch_models(request: PrefetchRequest):
+    """
+    Fetch models into storage and build warm sessions in the background.
+    """
+    prefetcher.schedule(request.ipfs_hashes)
+    statuses = {status.ipfs_hash: status for status in await model_statuses()}
+    return [statuses[ipfs_hash] for ipfs_hash in dict.fromkeys(request.ipfs_hashes)]
+
+@app.post("/models/pin", status_code=202)
+async def pin_models(request: PrefetchRequest):
+    """
+    Keep models in storage regardless of recency, across restarts, and prefetch them.
+    """
+    for ipfs_hash in dict.fromkeys(request.ipfs_hashes):
+        await asyncio.to_thread(storage.pin, ipfs_hash)
+    return await prefetch_models(request)
+
+@app.post("/models/unpin")
+async def unpin_models(request: PrefetchRequest):
+    """
+    Let models be evicted again.
+    """
+    for ipfs_hash in dict.fromkeys(request.ipfs_hashes):
+        await asyncio.to_thread(storage.unpin, ipfs_hash)
+    statuses = {status.ipfs_hash: status for status in await model_statuses()}
+    return [statuses[ipfs_hash] for ipfs_hash in dict.fromkeys(request.ipfs_hashes) if ipfs_hash in statuses]
+
+@app.get("/models")
+async def list_models():
+    """
+    Models known to this node and their state, so schedulers can route to warm nodes:
+        loading: being fetched or warmed up
+        warm:    session ready in memory
+        cached:  on disk, a session will be built on first use
+        failed:  the last prefetch failed
+    """
+    return await model_statuses()
+
+async def model_statuses() -> list:
+    # Storage is shared by all workers, sessions and prefetches belong to this one
+    models = await asyncio.to_thread(storage.models, True)
+    warm = set(session_pool.hashes())
+
+    statuses = []
+    for ipfs_hash in dict.fromkeys(list(models) + list(warm) + list(prefetcher.states)):
+        state, error = prefetcher.states.get(ipfs_hash, (None, None))
+        if state == prefetch.LOADING:
+            pass
+        elif ipfs_hash in warm:
+            state = prefetch.WARM
+        elif ipfs_hash in models:
+            state = "cached"
+        elif state != prefetch.FAILED:
+            # Prefetched once, but evicted from both storage and the session pool since
+            continue
+
+        model = models.get(ipfs_hash)
+        statuses.append(ModelStatus(ipfs_hash=ipfs_hash,
+                                    state=state,
+                                    size=model.size if model is not None else None,
+                                    pinned=ipfs_hash in storage.pinned,
+                                    error=error if state == prefetch.FAILED else None))
+    return statuses
+
+@app.get("/attestation/key")
+async def attestation_key():
+    """
+    The app key responses are signed with. Its SHA-256 is the appKeyHash in the node's
+    attestation documents.
+    """
+    if not attestor.enabled:
+        raise HTTPException(status_code=404, detail="Response attestation is off")
+    return {"mode": attestor.mode,
+            "public_key": base64.b64encode(attestor.key.public_key).decode(),
+            "key_hash": base64.b64encode(attestor.key.key_hash).decode()}
+
+@app.get("/attestation/batches/{batch}")
+async def attestation_batch(batch: int, index: int | None = None):
+    """
+    A sealed Merkle batch: its size, root and the app key's signature over the root.
+    With index, also the inclusion proof of that response.
+    """
+    if attestor.batches is None:
+        raise HTTPException(status_code=404, detail="Merkle attestation is off")
+    sealed = attestor.batches.get(batch)
+    if sealed is None:
+        if not attestor.batches.dropped(batch):
+            raise HTTPException(status_code=404, detail="Batch %d is not sealed yet" % batch,
+                                headers={"Retry-After": str(int(attestation.ATTESTATION_BATCH_SECONDS))})
+        raise HTTPException(status_code=404, detail="Batch %d is no longer kept" % batch)
+
+    content = {"batch": sealed.batch,
+               "size": sealed.size,
+               "root": sealed.root.hex(),
+               "signature": base64.b64encode(sealed.signature).decode(),
+               "sealed_at": sealed.sealed_at}
+    if index is not None:
+        if not 0 <= index < sealed.size:
+            raise HTTPException(status_code=400, detail="Index %d out of range for batch of %d" % (index, sealed.size))
+        content["index"] = index
+        content["proof"] = [node.hex() for node in attestation.merkle_proof(sealed.levels, index)]
+    return content
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def serve(port: int = 8000, workers: int = executor.SERVER_WORKERS, **kwargs) -> None:
+    """
+    Serve the app on localhost, from workers processes sharing the node if more than
+    one. kwargs are uvicorn settings, as for uvicorn.run.
+    """
+    import uvicorn
+    from uvicorn.supervisors import Multiprocess
+    if workers <= 1:
+        uvicorn.run(app, host="127.0.0.1", port=port, **kwargs)
+        return
+    # Each worker imports this module afresh and builds its own pools. As uvicorn.run
+    # would, but the config pickled into the workers carries the key registered with
+    # nitriding, so they all sign with it
+    config = uvicorn.Config("server:app", host="127.0.0.1", port=port, workers=workers, http=NoDelayH11Protocol, **kwargs)
+    if attestor.enabled:
+        config.attestation_key = attestor.key.handover()
+    sock = config.bind_socket()
+    supervisor = {"config": config, "sockets": [sock]}
+    if "target" in inspect.signature(Multiprocess).parameters:
+        # Older uvicorn versions, e.g. the pinned one, take the worker's entry point
+        supervisor["target"] = uvicorn.Server(config=config).run
+    try:
+        Multiprocess(**supervisor).run()
+    except KeyboardInterrupt:
+        pass
+
+def main() -> None:
+    """
+    Start the enclave server, see main.py.
+    """
+    # Inputs and outputs are only logged at DEBUG, keep them out of the enclave console by default
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+                        format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    logger.info("[py] Starting enclave server...")
+
+    # Have attestation documents vouch for the key responses are signed with
+    if attestor.enabled:
+        attestor.key.register()
+        logger.info("[py] Registered the %s attestation app key with nitriding.", attestor.mode)
 
     # Signal to nitriding that the enclave has finished bootstrapping and is ready.
     signal_ready()
-    print("[py] Signalled to nitriding that we're ready.")
+    logger.info("[py] Signalled to nitriding that we're ready.")
 
-    import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    serve()
@@ -14,5 +14,5 @@ echo "[sh] Test ipfs"
 ipfs version
 ipfs swarm peers
 
-server.py
+main.py
 echo "[sh] Ran Python script."
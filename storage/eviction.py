@@ -0,0 +1,211 @@
+from collections import OrderedDict
+import os
+import random
+
+"""
+Eviction policies for model storage
+
+A policy tracks every model in storage and picks which evictable model to remove when
+space is needed. StorageManager calls insert() when a model lands in storage, with the
+seconds its download took as the cost of fetching it again, access() on every hit,
+victim() to choose among the evictable ones without changing any state, evicted()
+once a victim is actually gone, and remove() when a model leaves storage otherwise.
+Callers serialize all calls, policies do no locking of their own.
+"""
+
+# lru, gdsf or tinylfu
+STORAGE_EVICTION_POLICY = os.environ.get("STORAGE_EVICTION_POLICY", "lru")
+
+# Download throughput assumed for models whose download time was never measured, e.g.
+# models found on disk at boot, until measured downloads give a better estimate
+DEFAULT_SECONDS_PER_BYTE = 1 / 50e6
+
+class LRU():
+    def __init__(self, capacity: float):
+        """
+        Least recently used first, ignoring size and fetch cost.
+        """
+        self.order = OrderedDict()
+
+    def insert(self, modelHash: str, size: int, cost: float = None) -> None:
+        self.order[modelHash] = None
+        self.order.move_to_end(modelHash)
+
+    def access(self, modelHash: str) -> None:
+        if modelHash in self.order:
+            self.order.move_to_end(modelHash)
+
+    def remove(self, modelHash: str) -> None:
+        self.order.pop(modelHash, None)
+
+    def evicted(self, modelHash: str) -> None:
+        self.remove(modelHash)
+
+    def victim(self, candidates) -> str:
+        # Held models are few, so the first evictable one is found near the front
+        for modelHash in self.order:
+            if modelHash in candidates:
+                return modelHash
+        return None
+
+class GreedyDualSizeFrequency():
+    def __init__(self, capacity: float):
+        """
+        GreedyDual-Size with frequency (GDSF). Each model's priority is
+
+            inflation + frequency * cost / size
+
+        so small models that are slow to fetch and often used are kept longest, and the
+        lowest priority model is evicted. The inflation rises to each evicted model's
+        priority, which ages out models that were popular once but are no longer used.
+        """
+        self.inflation = 0.0
+        # model_hash -> [priority, frequency, cost, size]
+        self.entries = {}
+        self.fetch_seconds = 0.0
+        self.fetch_bytes = 0
+
+    def insert(self, modelHash: str, size: int, cost: float = None) -> None:
+        if cost is None:
+            cost = size * self._secondsPerByte()
+        else:
+            self.fetch_seconds += cost
+            self.fetch_bytes += size
+        self.entries[modelHash] = [self.inflation + cost / max(size, 1), 1, cost, size]
+
+    def access(self, modelHash: str) -> None:
+        entry = self.entries.get(modelHash)
+        if entry is not None:
+            entry[1] += 1
+            entry[0] = self.inflation + entry[1] * entry[2] / max(entry[3], 1)
+
+    def remove(self, modelHash: str) -> None:
+        self.entries.pop(modelHash, None)
+
+    def evicted(self, modelHash: str) -> None:
+        entry = self.entries.pop(modelHash, None)
+        if entry is not None:
+            self.inflation = max(self.inflation, entry[0])
+
+    def victim(self, candidates) -> str:
+        tracked = [modelHash for modelHash in candidates if modelHash in self.entries]
+        if not tracked:
+            return next(iter(candidates), None)
+        return min(tracked, key=lambda modelHash: self.entries[modelHash][0])
+
+    def _secondsPerByte(self) -> float:
+        if self.fetch_bytes == 0:
+            return DEFAULT_SECONDS_PER_BYTE
+        return self.fetch_seconds / self.fetch_bytes
+
+class FrequencySketch():
+    def __init__(self, width: int = 4096, depth: int = 4):
+        """
+        Count-min sketch of access frequencies with 4-bit saturating counters. Every
+        counter is halved after 10 x width increments, so old popularity fades.
+        """
+        self.width = width
+        self.rows = [[0] * width for _ in range(depth)]
+        self.seeds = [random.getrandbits(64) for _ in range(depth)]
+        self.increments = 0
+        self.sample_size = 10 * width
+
+    def increment(self, key: str) -> None:
+        for row, seed in zip(self.rows, self.seeds):
+            index = hash((seed, key)) % self.width
+            if row[index] < 15:
+                row[index] += 1
+
+        self.increments += 1
+        if self.increments >= self.sample_size:
+            self.increments //= 2
+            for row in self.rows:
+                for index in range(self.width):
+                    row[index] >>= 1
+
+    def estimate(self, key: str) -> int:
+        return min(row[hash((seed, key)) % self.width] for row, seed in zip(self.rows, self.seeds))
+
+class TinyLFU():
+    def __init__(self, capacity: float, window: float = 0.01, protected: float = 0.8):
+        """
+        Size-aware W-TinyLFU. New models enter a small LRU window holding a share of the
+        capacity. Models pushed out of the window land at the new end of the probation
+        LRU, and models hit again in probation move to the protected LRU, which holds a
+        share of the rest of the capacity.
+
+        Eviction weighs the model waiting to be admitted, the oldest in the window or
+        else the latest out of it at the new end of probation, against the oldest model
+        in probation, or in protected once probation is empty. The one requested less
+        often according to the frequency sketch is evicted. The sketch also counts
+        requests for models that were already evicted, so a large model requested once
+        can't flush frequently used ones.
+        """
+        self.window = OrderedDict()
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+        self.window_capacity = capacity * window
+        self.protected_capacity = (capacity - self.window_capacity) * protected
+        self.window_size = 0
+        self.protected_size = 0
+        self.sketch = FrequencySketch()
+
+    def insert(self, modelHash: str, size: int, cost: float = None) -> None:
+        self.remove(modelHash)
+        self.sketch.increment(modelHash)
+        self.window[modelHash] = size
+        self.window_size += size
+        while self.window_size > self.window_capacity and len(self.window) > 1:
+            oldest, oldest_size = self.window.popitem(last=False)
+            self.window_size -= oldest_size
+            self.probation[oldest] = oldest_size
+
+    def access(self, modelHash: str) -> None:
+        self.sketch.increment(modelHash)
+        if modelHash in self.window:
+            self.window.move_to_end(modelHash)
+        elif modelHash in self.protected:
+            self.protected.move_to_end(modelHash)
+        elif modelHash in self.probation:
+            size = self.probation.pop(modelHash)
+            self.protected[modelHash] = size
+            self.protected_size += size
+            while self.protected_size > self.protected_capacity and len(self.protected) > 1:
+                oldest, oldest_size = self.protected.popitem(last=False)
+                self.protected_size -= oldest_size
+                self.probation[oldest] = oldest_size
+
+    def remove(self, modelHash: str) -> None:
+        if modelHash in self.window:
+            self.window_size -= self.window.pop(modelHash)
+        elif modelHash in self.protected:
+            self.protected_size -= self.protected.pop(modelHash)
+        else:
+            self.probation.pop(modelHash, None)
+
+    def evicted(self, modelHash: str) -> None:
+        self.remove(modelHash)
+
+    def victim(self, candidates) -> str:
+        oldest = self._oldest(self.probation, candidates) or self._oldest(self.protected, candidates)
+        newest = self._oldest(self.window, candidates) or self._oldest(reversed(self.probation), candidates)
+        if oldest is None or newest is None:
+            return oldest or newest or next(iter(candidates), None)
+        if newest != oldest and self.sketch.estimate(newest) <= self.sketch.estimate(oldest):
+            return newest
+        return oldest
+
+    @staticmethod
+    def _oldest(segment, candidates) -> str:
+        return next((modelHash for modelHash in segment if modelHash in candidates), None)
+
+POLICIES = {
+    "lru": LRU,
+    "gdsf": GreedyDualSizeFrequency,
+    "tinylfu": TinyLFU,
+}
+
+def create(name: str, capacity: float):
+    if name not in POLICIES:
+        raise ValueError("Unknown eviction policy %s, expected one of %s" % (name, ", ".join(sorted(POLICIES))))
+    return POLICIES[name](capacity)
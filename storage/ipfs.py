@@ -0,0 +1,203 @@
+from collections import OrderedDict, namedtuple
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+logger = logging.getLogger(__name__)
+
+"""
+Client for the local IPFS daemon's HTTP API, and a persistent cache of what it told us
+about each CID so repeated lookups never reach the daemon.
+"""
+
+CIDInfo = namedtuple("CIDInfo", ["size", "blocks", "digest"])
+
+# Local IPFS daemon HTTP API
+IPFS_API_URL = os.environ.get("IPFS_API_URL", "http://127.0.0.1:5001/api/v0")
+
+# Seconds to remember that the daemon couldn't resolve a CID, 0 disables negative caching
+IPFS_NEGATIVE_TTL = float(os.environ.get("IPFS_NEGATIVE_TTL", "60"))
+
+# Most CIDs kept in the metadata cache, oldest dropped first
+METADATA_CACHE_ENTRIES = 10000
+
+# Connections kept open to the daemon, one per concurrent download or stat
+IPFS_POOL_SIZE = 16
+
+# Daemon error messages meaning the CID can't be resolved at all. Anything else, e.g.
+# "context deadline exceeded" or a resource limit, is the daemon failing for now.
+NOT_FOUND_ERRORS = ("not found", "invalid path", "invalid cid", "failed to decode", "selected encoding not supported",
+                    "no link named", "could not find", "is a directory", "not a file")
+TRANSIENT_ERRORS = ("context deadline exceeded", "context canceled", "timeout", "timed out", "resource", "too many")
+
+METADATA_HITS = metrics.Counter("ipfs_metadata_hits_total", "CID size lookups served from the metadata cache")
+NEGATIVE_HITS = metrics.Counter("ipfs_negative_hits_total", "Requests for unresolvable CIDs rejected from the negative cache")
+
+class ModelNotFound(Exception):
+    """
+    The IPFS daemon couldn't resolve the CID.
+    """
+
+class DaemonUnavailable(Exception):
+    """
+    The IPFS daemon failed to serve the CID for now, e.g. it timed out finding providers.
+    """
+
+class IPFSClient():
+    def __init__(self, api_url: str = IPFS_API_URL, pool_size: int = IPFS_POOL_SIZE):
+        """
+        Calls to the daemon's HTTP API over a pool of kept-alive connections, instead
+        of forking the ipfs binary for every lookup.
+        """
+        self.api_url = api_url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def stat(self, cid: str) -> CIDInfo:
+        response = self.session.post(f"{self.api_url}/files/stat", params={"arg": f"/ipfs/{cid}"}, timeout=60)
+        self._raiseForStatus(cid, response)
+        body = response.json()
+        return CIDInfo(size=int(body["Size"]), blocks=body.get("Blocks"), digest=None)
+
+    def cat(self, cid: str, offset: int = 0) -> requests.Response:
+        """
+        Open a stream of the CID's content from offset. The daemon sends the length of
+        the stream in the X-Content-Length header, so the caller learns the size from
+        the same call. The caller closes the response.
+        """
+        response = self.session.post(f"{self.api_url}/cat", params={"arg": cid, "offset": offset}, stream=True, timeout=60)
+        try:
+            self._raiseForStatus(cid, response)
+        except BaseException:
+            response.close()
+            raise
+        return response
+
+    def _raiseForStatus(self, cid: str, response: requests.Response) -> None:
+        if response.ok:
+            return
+        # The daemon answers requests it can't serve with a JSON error, e.g. an unknown CID
+        try:
+            error = response.json()
+        except ValueError:
+            error = None
+        if isinstance(error, dict) and error.get("Type") == "error":
+            message = str(error.get("Message"))
+            if not_found(message):
+                raise ModelNotFound("IPFS could not resolve %s: %s" % (cid, message))
+            raise DaemonUnavailable("IPFS failed to serve %s: %s" % (cid, message))
+        response.raise_for_status()
+
+def not_found(message: str) -> bool:
+    """
+    Whether a daemon error message says the CID can't be resolved, as opposed to a
+    failure that a retry may not hit.
+    """
+    message = message.lower()
+    if any(marker in message for marker in TRANSIENT_ERRORS):
+        return False
+    return any(marker in message for marker in NOT_FOUND_ERRORS)
+
+class MetadataCache():
+    def __init__(self, path: str, negative_ttl: float = IPFS_NEGATIVE_TTL, max_entries: int = METADATA_CACHE_ENTRIES, shared: bool = False):
+        """
+        Thread-safe cache of CID -> CIDInfo(size, blocks, digest), persisted as JSON at
+        path so it survives restarts and outlives the models evicted from storage.
+
+        CIDs the daemon couldn't resolve are remembered in memory for negative_ttl
+        seconds, and requests for them fail fast with ModelNotFound.
+
+        With shared, other processes persist to the same path, and each save merges in
+        the entries they wrote under an flock.
+        """
+        self.path = path
+        self.shared = shared
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.missing = {}
+        self.lock = threading.Lock()
+        self._load()
+
+    def get(self, cid: str):
+        """
+        Cached info for a CID, None if unknown. Raises ModelNotFound if the daemon
+        recently failed to resolve it.
+        """
+        with self.lock:
+            failure = self.missing.get(cid)
+            if failure is not None:
+                expires, message = failure
+                if time.monotonic() < expires:
+                    NEGATIVE_HITS.inc()
+                    raise ModelNotFound(message)
+                del self.missing[cid]
+            return self.entries.get(cid)
+
+    def put(self, cid: str, info: CIDInfo) -> None:
+        with self.lock:
+            self.missing.pop(cid, None)
+            if self.entries.get(cid) == info:
+                return
+            self.entries[cid] = info
+            self.entries.move_to_end(cid)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self._save()
+
+    def notFound(self, cid: str, error: ModelNotFound) -> None:
+        if self.negative_ttl <= 0:
+            return
+        with self.lock:
+            self.missing[cid] = (time.monotonic() + self.negative_ttl, str(error))
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r") as f:
+                records = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable IPFS metadata cache %s: %s", self.path, e)
+            return
+
+        for cid, record in records.items():
+            self.entries[cid] = CIDInfo(record.get("size"), record.get("blocks"), record.get("sha256"))
+
+    def _save(self) -> None:
+        # Caller holds the lock
+        if not self.shared:
+            return self._write()
+        try:
+            with open(self.path + ".lock", "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                # Entries only another process knows go in as the least recently used
+                entries = self.entries
+                self.entries = OrderedDict()
+                self._load()
+                for cid in entries:
+                    self.entries.pop(cid, None)
+                self.entries.update(entries)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                self._write()
+        except OSError as e:
+            logger.warning("Could not lock IPFS metadata cache %s: %s", self.path, e)
+
+    def _write(self) -> None:
+        records = {cid: {"size": info.size, "blocks": info.blocks, "sha256": info.digest} for cid, info in self.entries.items()}
+        partial_path = self.path + ".part"
+        try:
+            with open(partial_path, "w") as f:
+                json.dump(records, f)
+            os.replace(partial_path, self.path)
+        except OSError as e:
+            logger.warning("Could not persist IPFS metadata cache %s: %s", self.path, e)
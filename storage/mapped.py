@@ -0,0 +1,255 @@
+import mmap
+import os
+import numpy as np
+import onnxruntime as ort
+import wire
+
+"""
+Memory-mapped model loading
+
+A model's weights are normally read into onnxruntime's own buffers, so a warm model
+sits in memory twice: once in the tmpfs-backed model storage and once in the session.
+MappedModel maps the model file instead and hands its large initializers to
+onnxruntime as external initializers backed by the mapping, so the session reads the
+weights straight from the storage pages.
+
+The graph itself is rewritten without those initializers' data by walking the
+protobuf wire format directly, the node doesn't depend on the onnx package.
+"""
+
+# Initializers smaller than this stay inline in the rewritten graph
+MIN_MAPPED_BYTES = 1024
+
+# Sidecar file next to a model holding its rewritten graph
+MAPPED_SUFFIX = ".mapped.onnx"
+
+# ModelProto.graph and GraphProto.initializer field numbers
+_MODEL_GRAPH = 7
+_GRAPH_INITIALIZER = 5
+
+# TensorProto field numbers
+_TENSOR_DIMS = 1
+_TENSOR_DATA_TYPE = 2
+_TENSOR_NAME = 8
+_TENSOR_RAW_DATA = 9
+_TENSOR_EXTERNAL_DATA = 13
+_TENSOR_DATA_LOCATION = 14
+
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH = 2
+_FIXED32 = 5
+
+_EXTERNAL = 1
+
+def _varint(buffer, pos: int) -> tuple:
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(buffer):
+            raise ValueError("Truncated model file")
+        byte = buffer[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+def _fields(buffer, start: int, end: int):
+    """
+    Walk the fields of a protobuf message in buffer[start:end], yielding
+    (number, wire_type, key_start, value_start, value_end) for each.
+    """
+    pos = start
+    while pos < end:
+        key_start = pos
+        key, pos = _varint(buffer, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == _VARINT:
+            _, value_end = _varint(buffer, pos)
+        elif wire_type == _FIXED64:
+            value_end = pos + 8
+        elif wire_type == _FIXED32:
+            value_end = pos + 4
+        elif wire_type == _LENGTH:
+            length, pos = _varint(buffer, pos)
+            value_end = pos + length
+        else:
+            raise ValueError("Unsupported protobuf wire type %d" % wire_type)
+        if value_end > end:
+            raise ValueError("Truncated model file")
+        yield number, wire_type, key_start, pos, value_end
+        pos = value_end
+
+def _encodeVarint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def _encodeField(number: int, wire_type: int, payload: bytes) -> bytes:
+    if wire_type == _LENGTH:
+        return _encodeVarint(number << 3 | _LENGTH) + _encodeVarint(len(payload)) + payload
+    return _encodeVarint(number << 3 | wire_type) + payload
+
+def _stubTensor(name: bytes, data_type: int, dims: list, location: str, offset: int, length: int) -> bytes:
+    """
+    TensorProto carrying only an initializer's name, type and shape, with its data
+    referenced as external data at offset in the file at location.
+    """
+    external = [_encodeField(1, _LENGTH, key) + _encodeField(2, _LENGTH, value.encode("utf-8"))
+                for key, value in ((b"location", location), (b"offset", str(offset)), (b"length", str(length)))]
+    return b"".join([_encodeField(_TENSOR_DIMS, _VARINT, _encodeVarint(dim)) for dim in dims] + [
+        _encodeField(_TENSOR_DATA_TYPE, _VARINT, _encodeVarint(data_type)),
+        _encodeField(_TENSOR_NAME, _LENGTH, name),
+    ] + [_encodeField(_TENSOR_EXTERNAL_DATA, _LENGTH, entry) for entry in external] + [
+        _encodeField(_TENSOR_DATA_LOCATION, _VARINT, _encodeVarint(_EXTERNAL)),
+    ])
+
+class MappedModel():
+    def __init__(self, modelPath: str):
+        """
+        An ONNX model file mapped into memory
+
+        model_bytes is the graph with every large initializer replaced by a stub that
+        references its data in place as external data, and names / values the matching
+        OrtValues backed by the mapping, which options() registers as shared initializers.
+        Initializers already stored as external data next to the model are mapped from
+        their own files the same way.
+
+        The mappings stay open for as long as this object lives, so it must be kept
+        alive together with the session built from it.
+        """
+        self.modelPath = os.path.abspath(modelPath)
+        self.modelDir = os.path.dirname(self.modelPath)
+        self.maps = {}
+        self.names = []
+        self.values = []
+        self.mapped_bytes = 0
+
+        buffer = self._map(self.modelPath)
+        parts = []
+        for number, wire_type, key_start, value_start, value_end in _fields(buffer, 0, len(buffer)):
+            if number == _MODEL_GRAPH and wire_type == _LENGTH:
+                parts.append(_encodeField(_MODEL_GRAPH, _LENGTH, self._rewriteGraph(buffer, value_start, value_end)))
+            else:
+                parts.append(buffer[key_start:value_end])
+        self.model_bytes = b"".join(parts)
+
+    def write(self) -> str:
+        """
+        Save the rewritten graph next to the model, returns its path. onnxruntime only
+        resolves the stubs' external data relative to a model loaded from a file.
+        """
+        path = self.modelPath + MAPPED_SUFFIX
+        if not os.path.exists(path):
+            # Server workers may be writing the same graph, each writes its own part file
+            partial_path = "%s.%d.part" % (path, os.getpid())
+            with open(partial_path, "wb") as f:
+                f.write(self.model_bytes)
+            os.replace(partial_path, path)
+        return path
+
+    def options(self, options: ort.SessionOptions) -> ort.SessionOptions:
+        """
+        Register the mapped initializers with session options, returns the options.
+        Prepacking is disabled, it copies weights into kernel-specific layouts, which
+        would undo the sharing.
+        """
+        options.add_session_config_entry("session.disable_prepacking", "1")
+        if self.names:
+            for name, value in zip(self.names, self.values):
+                options.add_initializer(name, value)
+        return options
+
+    def _map(self, path: str) -> memoryview:
+        if path not in self.maps:
+            with open(path, "rb") as f:
+                self.maps[path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self.maps[path])
+
+    def _rewriteGraph(self, buffer, start: int, end: int) -> bytes:
+        parts = []
+        for number, wire_type, key_start, value_start, value_end in _fields(buffer, start, end):
+            stub = None
+            if number == _GRAPH_INITIALIZER and wire_type == _LENGTH:
+                stub = self._mapTensor(buffer, value_start, value_end)
+            if stub is not None:
+                parts.append(_encodeField(_GRAPH_INITIALIZER, _LENGTH, stub))
+            else:
+                parts.append(buffer[key_start:value_end])
+        return b"".join(parts)
+
+    def _mapTensor(self, buffer, start: int, end: int):
+        """
+        Map one initializer, returns its stub TensorProto or None to keep it inline.
+        """
+        dims = []
+        data_type = None
+        name = None
+        raw = None
+        external = {}
+        location = 0
+        for number, wire_type, _, value_start, value_end in _fields(buffer, start, end):
+            if number == _TENSOR_DIMS and wire_type == _VARINT:
+                dims.append(_varint(buffer, value_start)[0])
+            elif number == _TENSOR_DIMS and wire_type == _LENGTH:
+                pos = value_start
+                while pos < value_end:
+                    dim, pos = _varint(buffer, pos)
+                    dims.append(dim)
+            elif number == _TENSOR_DATA_TYPE:
+                data_type = _varint(buffer, value_start)[0]
+            elif number == _TENSOR_NAME:
+                name = bytes(buffer[value_start:value_end])
+            elif number == _TENSOR_RAW_DATA:
+                raw = (value_start, value_end)
+            elif number == _TENSOR_EXTERNAL_DATA:
+                entry = {key: bytes(buffer[s:e]).decode("utf-8") for key, _, _, s, e in _fields(buffer, value_start, value_end)}
+                external[entry.get(1, "")] = entry.get(2, "")
+            elif number == _TENSOR_DATA_LOCATION:
+                location = _varint(buffer, value_start)[0]
+
+        if name is None or data_type not in wire._onnx_dtypes or any(dim >= 1 << 63 for dim in dims):
+            return None
+        dtype = wire._onnx_dtypes[data_type]
+        count = int(np.prod(dims, dtype=np.int64)) if dims else 1
+
+        if location == _EXTERNAL:
+            path = self._externalPath(external.get("location", ""))
+            if path is None:
+                return None
+            source = self._map(path)
+            offset = int(external.get("offset", 0))
+        elif raw is not None:
+            path = self.modelPath
+            source = buffer
+            offset = raw[0]
+            if raw[1] - raw[0] != count * dtype.itemsize:
+                return None
+        else:
+            # Typed fields (float_data, int64_data, ...) are varint or packed, not mappable
+            return None
+
+        if count * dtype.itemsize < MIN_MAPPED_BYTES or offset + count * dtype.itemsize > len(source):
+            return None
+
+        array = np.frombuffer(source, dtype=dtype, count=count, offset=offset).reshape(dims)
+        self.names.append(name.decode("utf-8"))
+        self.values.append(ort.OrtValue.ortvalue_from_numpy(array))
+        self.mapped_bytes += array.nbytes
+        return _stubTensor(name, data_type, dims, os.path.basename(path), offset, array.nbytes)
+
+    def _externalPath(self, location: str):
+        """
+        External data file of an initializer, which must sit in the model's directory.
+        """
+        path = os.path.normpath(os.path.join(self.modelDir, location))
+        if not location or os.path.dirname(path) != self.modelDir or not os.path.isfile(path):
+            return None
+        return path
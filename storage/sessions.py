@@ -0,0 +1,336 @@
+from collections import OrderedDict, namedtuple
+import json
+import os
+import logging
+import threading
+import onnxruntime as ort
+import batching
+import metrics
+import utils
+from storage import mapped
+
+logger = logging.getLogger(__name__)
+
+# mapped is the MappedModel the session reads its weights from, None if they were copied,
+# plan the inputs compiled by utils.compile_inputs, and batch_axis whether requests may
+# be stacked along the leading dimension, see batching.batch_axis
+SessionEntry = namedtuple("SessionEntry", ["session", "inputs", "outputs", "output_names", "size", "mapped", "plan", "batch_axis"], defaults=(None, None, False))
+
+SessionConfig = namedtuple("SessionConfig", [
+    "graph_optimization_level",     # disable, basic, extended or all
+    "intra_op_threads",             # None for the onnxruntime default
+    "inter_op_threads",             # None for the onnxruntime default
+    "execution_mode",               # sequential or parallel
+    "enable_cpu_mem_arena",
+    "enable_mem_pattern",
+    "cache_optimized_model",        # save the optimized graph next to the model and reuse it
+    "mmap_weights",                 # share weights with the model file in storage instead of copying them
+    "batch_axis",                   # stack requests along the leading dimension, None to go by its name
+], defaults=(None,))
+
+_optimization_levels = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+_execution_modes = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+# Per-model overrides of the node config, a JSON object of model_hash -> {field: value}
+ORT_MODEL_CONFIG_FILE = os.environ.get("ORT_MODEL_CONFIG_FILE", "")
+
+def _env_int(name: str):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    return default if not value else value.lower() in ("1", "true", "yes", "on")
+
+def node_config(intra_op_threads: int = None) -> SessionConfig:
+    """
+    Session config for every model on this node, from ORT_* environment variables.
+    intra_op_threads is the default when ORT_INTRA_OP_THREADS isn't set.
+    """
+    env_intra_op_threads = _env_int("ORT_INTRA_OP_THREADS")
+    return SessionConfig(graph_optimization_level=os.environ.get("ORT_GRAPH_OPTIMIZATION", "all"),
+                         intra_op_threads=env_intra_op_threads if env_intra_op_threads is not None else intra_op_threads,
+                         inter_op_threads=_env_int("ORT_INTER_OP_THREADS"),
+                         execution_mode=os.environ.get("ORT_EXECUTION_MODE", "sequential"),
+                         enable_cpu_mem_arena=_env_bool("ORT_ENABLE_CPU_MEM_ARENA", True),
+                         enable_mem_pattern=_env_bool("ORT_ENABLE_MEM_PATTERN", True),
+                         cache_optimized_model=_env_bool("ORT_CACHE_OPTIMIZED_MODEL", True),
+                         mmap_weights=_env_bool("ORT_MMAP_WEIGHTS", False))
+
+def load_model_configs(path: str = ORT_MODEL_CONFIG_FILE) -> dict:
+    """
+    Per-model overrides read from path, model_hash -> {field: value}. Unknown fields are rejected.
+    """
+    if not path:
+        return {}
+    with open(path, "r") as f:
+        overrides = json.load(f)
+
+    for modelHash, fields in overrides.items():
+        unknown = set(fields) - set(SessionConfig._fields)
+        if unknown:
+            raise ValueError("Unknown session config fields for %s: %s" % (modelHash, ", ".join(sorted(unknown))))
+    return overrides
+
+def session_options(config: SessionConfig) -> ort.SessionOptions:
+    if config.graph_optimization_level not in _optimization_levels:
+        raise ValueError("Unknown graph optimization level: %s" % config.graph_optimization_level)
+    if config.execution_mode not in _execution_modes:
+        raise ValueError("Unknown execution mode: %s" % config.execution_mode)
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = _optimization_levels[config.graph_optimization_level]
+    options.execution_mode = _execution_modes[config.execution_mode]
+    options.enable_cpu_mem_arena = config.enable_cpu_mem_arena
+    options.enable_mem_pattern = config.enable_mem_pattern
+    if config.intra_op_threads is not None:
+        options.intra_op_num_threads = config.intra_op_threads
+    if config.inter_op_threads is not None:
+        options.inter_op_num_threads = config.inter_op_threads
+    return options
+
+def cached_optimization_level(level: str) -> str:
+    """
+    Level the optimized graph is cached at for a session optimized at level. The passes
+    only "all" runs, e.g. NCHWc layouts, depend on the CPU, so they aren't cached but
+    run again on every load.
+    """
+    return "extended" if level == "all" else level
+
+def optimized_model_path(modelPath: str, digest: str, level: str) -> str:
+    """
+    Where the optimized graph of a model is cached. The name starts with the model's own
+    path so it is removed along with the model, and is keyed by content digest, onnxruntime
+    version and optimization level since the optimized graph depends on all three.
+    """
+    return "%s.opt-%s-ort%s-%s.onnx" % (modelPath, digest[:16], ort.__version__, level)
+
+def _resident_bytes() -> int:
+    """
+    Current resident set size of this process in bytes, 0 if it can't be read.
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def _private_bytes() -> int:
+    """
+    Resident memory of this process not backed by files, 0 if it can't be read. Unlike
+    the resident set size it excludes pages mapped from model files in storage.
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            fields = f.read().split()
+        return (int(fields[1]) - int(fields[2])) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def default_capacity(processes: int = 1) -> int:
+    """
+    Half of the enclave's physical memory; the other half is left for the
+    tmpfs-backed model storage and per-request tensors. Split evenly between
+    the pools of processes server workers.
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2 // processes
+    except (OSError, ValueError):
+        return int(8e9) // processes
+
+class SessionPool():
+    def __init__(self, capacity: int = None, config: SessionConfig = None, model_configs: dict = None):
+        """
+        Thread-safe LRU pool of ONNX inference sessions
+
+        Pool is an ordered dict:
+            key: model_hash
+            value: SessionEntry(session, inputs, outputs, output_names, size, mapped, plan, batch_axis)
+
+        Eviction is bounded by the estimated resident memory of the sessions
+        rather than by the number of entries. Sessions are built with the node's
+        SessionConfig, overridden per model hash by model_configs.
+        """
+        self.capacity = capacity if capacity is not None else default_capacity()
+        self.config = config if config is not None else node_config()
+        self.model_configs = model_configs if model_configs is not None else {}
+        self.current_size = 0
+        self.pool = OrderedDict()
+        self.lock = threading.Lock()
+        # Called with the model hash and path of each file written next to the model in
+        # storage, e.g. the cached optimized graph, so storage can count it
+        self.on_sidecar = None
+
+    def get(self, modelHash: str, modelPath: str, digest: str = None) -> SessionEntry:
+        """
+        Gets the warm session for a model hash. If not present, build one from the model path.
+        The model's content digest enables the optimized model cache.
+        """
+        with self.lock:
+            if modelHash in self.pool:
+                self.pool.move_to_end(modelHash)
+                return self.pool[modelHash]
+
+        entry = self._createSession(modelHash, modelPath, digest)
+        if entry.size > self.capacity:
+            # Too large to keep around, serve this request without caching
+            logger.warning("Session for %s of size %d exceeds pool capacity, not caching", modelHash, entry.size)
+            return entry
+
+        with self.lock:
+            # Another request may have built the same session concurrently
+            if modelHash in self.pool:
+                self.pool.move_to_end(modelHash)
+                return self.pool[modelHash]
+
+            while entry.size + self.current_size > self.capacity:
+                evictedHash, evicted = self.pool.popitem(last=False)
+                self.current_size -= evicted.size
+                logger.info("Evicted session %s of size %d", evictedHash, evicted.size)
+
+            self.pool[modelHash] = entry
+            self.current_size += entry.size
+            return entry
+
+    def peek(self, modelHash: str):
+        """
+        The warm session for a model hash, or None without building one.
+        """
+        with self.lock:
+            if modelHash not in self.pool:
+                return None
+            self.pool.move_to_end(modelHash)
+            return self.pool[modelHash]
+
+    def hashes(self) -> list:
+        """
+        Model hashes with a warm session, least recently used first.
+        """
+        with self.lock:
+            return list(self.pool)
+
+    def unmap(self, modelHash: str) -> None:
+        """
+        Drop the session for a model hash if it reads its weights from the model file,
+        e.g. when storage removes that file, so the file's pages can be freed.
+        """
+        with self.lock:
+            entry = self.pool.get(modelHash)
+            if entry is not None and entry.mapped is not None:
+                del self.pool[modelHash]
+                self.current_size -= entry.size
+
+    def configFor(self, modelHash: str) -> SessionConfig:
+        return self.config._replace(**self.model_configs.get(modelHash, {}))
+
+    def _cacheOptimized(self, modelHash: str, modelPath: str, cachePath: str, level: str) -> bool:
+        """
+        Write the model's graph optimized at level to cachePath, with a session that is
+        dropped right after. False if that failed, the model is then loaded as usual.
+        """
+        options = ort.SessionOptions()
+        options.graph_optimization_level = _optimization_levels[level]
+        options.optimized_model_filepath = "%s.%d.part" % (cachePath, os.getpid())
+        try:
+            with metrics.stage("graph_optimize"):
+                ort.InferenceSession(modelPath, sess_options=options)
+            os.replace(options.optimized_model_filepath, cachePath)
+            return True
+        except Exception as e:
+            logger.warning("Could not cache optimized model for %s: %s", modelHash, e)
+            try:
+                os.remove(options.optimized_model_filepath)
+            except FileNotFoundError:
+                pass
+            return False
+
+    def _createSession(self, modelHash: str, modelPath: str, digest: str = None) -> SessionEntry:
+        """
+        Build an inference session and precompute its input / output metadata.
+
+        The memory charged to the pool is the larger of the RSS growth observed
+        while loading and the model file size, since concurrent loads make the
+        RSS delta unreliable on its own. With mmap_weights the weights stay in the
+        model file's pages and only the memory not shared with it is charged.
+        """
+        config = self.configFor(modelHash)
+        options = session_options(config)
+        loadPath = modelPath
+
+        cachePath = None
+        sidecars = []
+        if config.cache_optimized_model and digest is not None and config.graph_optimization_level != "disable":
+            level = cached_optimization_level(config.graph_optimization_level)
+            cachePath = optimized_model_path(modelPath, digest, level)
+            if not os.path.exists(cachePath) and level != config.graph_optimization_level:
+                # Optimize up to the cached level on its own, the session then only runs
+                # the remaining passes
+                if self._cacheOptimized(modelHash, modelPath, cachePath, level):
+                    sidecars.append(cachePath)
+                else:
+                    cachePath = None
+            if cachePath is not None and os.path.exists(cachePath):
+                # Graph is already optimized, skip straight to building the session
+                loadPath = cachePath
+                if level == config.graph_optimization_level:
+                    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+                cachePath = None
+            elif cachePath is not None:
+                # Server workers may be optimizing the same model, each writes its own part file
+                options.optimized_model_filepath = "%s.%d.part" % (cachePath, os.getpid())
+
+        with metrics.stage("session_create"):
+            rss_before = _resident_bytes()
+            private_before = _private_bytes()
+            mapped_model = None
+            if config.mmap_weights:
+                mapped_model = mapped.MappedModel(loadPath)
+                if mapped_model.names:
+                    loadPath = mapped_model.write()
+                    mapped_model.options(options)
+                else:
+                    # Nothing large enough to share, load the model as usual
+                    mapped_model = None
+            session = ort.InferenceSession(loadPath, sess_options=options)
+            rss_delta = _resident_bytes() - rss_before
+            private_delta = _private_bytes() - private_before
+
+        if mapped_model is not None:
+            sidecars.append(loadPath)
+        if cachePath is not None:
+            try:
+                os.replace(options.optimized_model_filepath, cachePath)
+                sidecars.append(cachePath)
+            except OSError as e:
+                logger.warning("Could not cache optimized model for %s: %s", modelHash, e)
+        if self.on_sidecar is not None:
+            for path in sidecars:
+                self.on_sidecar(modelHash, path)
+
+        if mapped_model is not None:
+            size = max(private_delta, os.path.getsize(modelPath) - mapped_model.mapped_bytes)
+            logger.info("Loaded session for %s, %d bytes resident, %d bytes of weights mapped from storage",
+                        modelHash, private_delta, mapped_model.mapped_bytes)
+        else:
+            size = max(rss_delta, os.path.getsize(modelPath))
+            logger.info("Loaded session for %s, %d bytes resident", modelHash, rss_delta)
+
+        inputs = session.get_inputs()
+        outputs = session.get_outputs()
+        return SessionEntry(session=session,
+                            inputs=inputs,
+                            outputs=outputs,
+                            output_names=[output.name for output in outputs],
+                            size=size,
+                            mapped=mapped_model,
+                            plan=utils.compile_inputs(inputs),
+                            batch_axis=batching.batch_axis(inputs, outputs, config.batch_axis))
@@ -0,0 +1,89 @@
+from concurrent.futures import Future
+import asyncio
+import contextvars
+import threading
+
+class SingleFlight():
+    def __init__(self, submit=None):
+        """
+        Coalesces concurrent calls for the same key into one execution
+
+        The first caller for a key runs the function, every caller that arrives while
+        it is in flight waits on the same future and gets its result or its exception.
+        submit(fn, *args) queues do_async's runs on a thread pool and returns a
+        concurrent Future, e.g. InferenceExecutor.submit, by default the loop's default
+        executor. If it raises, e.g. when the pool is full, the callers get its error.
+
+        Metrics:
+            executions: number of times a function actually ran
+            coalesced:  number of callers that joined an in-flight execution
+        """
+        self.submit = submit
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args):
+        """
+        Run fn(*args) for key on the calling thread, or wait for the in-flight run.
+        """
+        future, leader = self._join(key)
+        if leader:
+            self._run(key, future, fn, *args)
+        return future.result()
+
+    async def do_async(self, key, fn, *args):
+        """
+        Same as do, but the leader runs fn on the submit pool and every caller awaits
+        the shared future without blocking the event loop. A cancelled caller, e.g. a
+        dropped connection or one past its timeout, doesn't cancel the run for the others.
+        The leader's context variables, e.g. request tracing, carry over to fn.
+        """
+        future, leader = self._join(key)
+        if leader:
+            context = contextvars.copy_context()
+            try:
+                if self.submit is not None:
+                    self.submit(context.run, self._run, key, future, fn, *args)
+                else:
+                    asyncio.get_running_loop().run_in_executor(None, context.run, self._run, key, future, fn, *args)
+            except Exception as e:
+                self._finish(key, future, e)
+        waiter = asyncio.wrap_future(future)
+        # Every caller may have given up before an error arrives, don't log it as unretrieved
+        waiter.add_done_callback(_retrieve)
+        return await asyncio.shield(waiter)
+
+    def _join(self, key) -> tuple:
+        with self.lock:
+            if key in self.in_flight:
+                self.coalesced += 1
+                return self.in_flight[key], False
+
+            future = Future()
+            self.in_flight[key] = future
+            return future, True
+
+    def _run(self, key, future: Future, fn, *args) -> None:
+        with self.lock:
+            self.executions += 1
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self._finish(key, future, e)
+        else:
+            self._finish(key, future, result=result)
+
+    def _finish(self, key, future: Future, exception: BaseException = None, result=None) -> None:
+        # Later callers start a fresh execution, e.g. to retry after an error
+        with self.lock:
+            del self.in_flight[key]
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+def _retrieve(future) -> None:
+    if not future.cancelled():
+        future.exception()
@@ -1,92 +1,817 @@
-from collections import OrderedDict, namedtuple
+from collections import namedtuple
+from contextlib import contextmanager
+import fcntl
+import glob
+import hashlib
+import json
+import logging
 import os
 # import diskcache
-import subprocess
+import threading
+import time
+import requests
+import utils
+import metrics
+from storage import eviction, ipfs
 
-ModelEntry = namedtuple("ModelEntry", ["path", "size"])
+logger = logging.getLogger(__name__)
+
+# size is the model file's, sidecars the bytes of the files stored next to it, e.g. its
+# digest and cached optimized graph, which are removed along with it
+ModelEntry = namedtuple("ModelEntry", ["path", "size", "mtime", "digest", "sidecars"], defaults=(0,))
+
+# Bytes read per chunk when streaming a model from IPFS or re-hashing a partial file
+CHUNK_SIZE = 1 << 20
+
+CACHE_HITS = metrics.Counter("model_cache_hits_total", "Model lookups served from storage")
+CACHE_MISSES = metrics.Counter("model_cache_misses_total", "Model lookups that had to fetch from IPFS")
+CACHE_EVICTIONS = metrics.Counter("model_cache_evictions_total", "Models evicted from storage")
+BYTES_DOWNLOADED = metrics.Counter("model_bytes_downloaded_total", "Model bytes streamed from IPFS")
+
+# Sidecar file next to each model recording its SHA-256 digest
+DIGEST_SUFFIX = ".sha256"
+
+# IPFS metadata cache in the model directory, skipped by the index scan like every dotted name
+METADATA_FILE = ".ipfs-metadata.json"
+
+# Pinned model hashes, kept across restarts and shared with the other server workers
+PINNED_FILE = ".pinned.json"
+
+# Shared mode: lock file serializing index changes between the server workers
+INDEX_LOCK_FILE = ".index.lock"
+
+# Shared mode: bytes each worker process has reserved for downloads, pid -> bytes
+RESERVATIONS_FILE = ".reservations.json"
+
+# Shared mode: directory of per-model lock files held while a model downloads
+DOWNLOAD_LOCKS_DIR = ".downloads"
+
+# Suffix of a model's partial download, kept after a failed download to resume from
+PARTIAL_SUFFIX = ".part"
+
+# Seconds a failed download's partial file is kept for a retry to resume from
+STORAGE_PARTIAL_TTL = float(os.environ.get("STORAGE_PARTIAL_TTL", "3600"))
 
 class StorageManager():
-    def __init__(self):
+    def __init__(self, api_url: str = ipfs.IPFS_API_URL, shared: bool = False):
         """
-        Simple single-threade LRU Storage system
+        Thread-safe Storage system with a pluggable eviction policy, LRU by default
 
-        Cache is an ordered dict:
+        Evictable models live in a dict:
             key: model_hash
-            value: (model_path, model_size)
+            value: ModelEntry(model_path, model_size, model_mtime_ns, sha256_digest, sidecar_bytes)
+
+        Models that are pinned or leased by an active request are moved to a separate
+        dict, so the eviction policy only ever picks among the evictable ones and never
+        deletes a file that is in use. The policy is told how long each download took,
+        as the cost of fetching that model again. The index is rebuilt from a scan of the
+        model directory at startup, with file access times (touched on every hit) as recency.
+
+        The SHA-256 of each model is persisted next to it in "<hash>.sha256" and only
+        recomputed when the model's size or mtime no longer match the recorded ones.
+
+        Sizes, block counts and digests the IPFS daemon reported are kept in a metadata
+        cache that outlives eviction, so a model fetched again needs no stat call and
+        its content is checked against the digest recorded the first time.
+
+        With shared, several server processes use the same model directory. The
+        directory itself is the index: before reserving space each process takes an
+        flock on INDEX_LOCK_FILE and rescans it for models the others added or evicted,
+        and for their reservations in RESERVATIONS_FILE. A leased model's file is held
+        with a shared flock, and eviction skips files it can't lock exclusively. A
+        per-model flock makes sure only one process downloads a model.
         """
         self.model_dir = "./storage/models"
         self.capacity = 40e9   # 40 GB
         self.current_size = 0
-        self.cache = OrderedDict()
+        self.reserved_size = 0
+        self.cache = {}
+        self.held = {}
+        self.refs = {}
+        self.pinned = set()
+        self.lock = threading.RLock()
+        self.shared = shared
+        # Shared mode: this process's turn at the index lock. Taken before the flock and
+        # never while holding self.lock, so waiting on other workers doesn't hold up
+        # lookups of models already indexed
+        self.index_lock = threading.Lock()
+        # Shared mode: bytes the other processes have reserved, the flocked lease of each
+        # leased model's file, and the access time of each model when last seen
+        self.others_reserved = 0
+        self.lease_fds = {}
+        self.atimes = {}
+        self.ipfs = ipfs.IPFSClient(api_url)
+        self.policy = eviction.create(eviction.STORAGE_EVICTION_POLICY, self.capacity)
+        # Called with the model hash after an evicted model's files are removed
+        self.on_evict = None
+
+        # One lock per model hash so a model is never streamed into the same partial file twice
+        self.download_locks = {}
+        self.download_locks_lock = threading.Lock()
 
-        if not os.path.exists(self.model_dir):
-            os.makedirs(self.model_dir)
+        os.makedirs(self.model_dir, exist_ok=True)
+        if self.shared:
+            os.makedirs(os.path.join(self.model_dir, DOWNLOAD_LOCKS_DIR), exist_ok=True)
+            self.index_lock_fd = os.open(os.path.join(self.model_dir, INDEX_LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+
+        self.metadata = ipfs.MetadataCache(os.path.join(self.model_dir, METADATA_FILE), shared=shared)
+        self._loadIndex()
 
     def get(self, modelHash: str):
         """
         Gets model hash path if in cache. If not, then download the model and return its path.
         """
+        with self.lock:
+            known = self._lookup(modelHash) is not None
+        # Another worker may have fetched it since this one last looked
+        with self.lock if known else self._indexLock():
+            model = self._lookup(modelHash)
+            if model is not None:
+                if os.path.exists(model.path) and self._leaseFile(modelHash, model.path):
+                    self._touch(modelHash, model)
+                    CACHE_HITS.inc()
+                    logger.debug("Model hash %s found in cache, returning path %s", modelHash, model.path)
+                    return model.path
+
+                # File vanished from under the index, drop it and fetch again
+                self._remove(modelHash)
+
+        CACHE_MISSES.inc()
+
+        # Raises ModelNotFound right away for hashes IPFS recently failed to resolve
+        info = self.metadata.get(modelHash)
+        reserved = []
+
+        def reserve(size: int) -> None:
+            if self._reserve(modelHash, size):
+                reserved.append(size)
+
+        try:
+            # With a known size, make room before downloading, otherwise once the
+            # download's response tells the size
+            if info is not None:
+                ipfs.METADATA_HITS.inc()
+                reserve(info.size)
+            start = time.perf_counter()
+            with metrics.stage("download"):
+                path = self._downloadModel(modelHash, info, reserve if info is None else None)
+            cost = time.perf_counter() - start
+        finally:
+            if reserved:
+                self._unreserve(sum(reserved))
+
+        with self.lock:
+            model = self._lookup(modelHash)
+            if model is None:
+                # Account for the bytes actually on disk rather than the IPFS-reported size
+                model = self._entry(path, os.stat(path))
+                self.current_size += model.size + model.sidecars
+                self._place(modelHash, model, cost)
+            if self._leaseFile(modelHash, model.path):
+                return model.path
+            self._remove(modelHash)
+
+        # Another worker evicted it before this request's lease took hold, fetch it again
+        return self.get(modelHash)
+
+    def cached(self, modelHash: str):
+        """
+        (path, digest) of a model this worker already indexed with a current digest,
+        recording the hit, else None. Never downloads, hashes or waits on other workers'
+        index, so it is cheap enough for the event loop.
+        """
+        with self.lock:
+            model = self._lookup(modelHash)
+            if model is None or model.digest is None:
+                return None
+            try:
+                stat = os.stat(model.path)
+            except FileNotFoundError:
+                return None
+            if stat.st_size != model.size or stat.st_mtime_ns != model.mtime or not self._leaseFile(modelHash, model.path):
+                return None
+            self._touch(modelHash, model)
+            CACHE_HITS.inc()
+            return model.path, model.digest
+
+    def digest(self, modelHash: str) -> str:
+        """
+        SHA-256 hex digest of a cached model. Served from the index while the file's size
+        and mtime are unchanged, otherwise the file is re-hashed and the sidecar rewritten.
+        """
+        with self.lock:
+            model = self._lookup(modelHash)
+        if model is None:
+            raise KeyError("Model %s is not in storage" % modelHash)
+
+        stat = os.stat(model.path)
+        if model.digest is not None and stat.st_size == model.size and stat.st_mtime_ns == model.mtime:
+            return model.digest
+
+        with metrics.stage("hash"):
+            digest = utils.hash_model(model.path)
+        self._writeDigest(model.path, digest, stat)
+        with self.lock:
+            if self._lookup(modelHash) is model:
+                self.current_size += stat.st_size - model.size
+                self._replace(modelHash, model._replace(size=stat.st_size, mtime=stat.st_mtime_ns, digest=digest))
+        return digest
+
+    def addSidecar(self, modelHash: str, path: str) -> bool:
+        """
+        Count a file written next to a model, e.g. its cached optimized graph, against
+        capacity, evicting other models to make room. If there is no room, or the model
+        is gone, the file is removed and False returned.
+        """
+        # Leased so the model itself isn't what makes room
+        with self.lease(modelHash), self._indexLock():
+            model = self._lookup(modelHash)
+            if model is not None:
+                sidecars = self._sidecarBytes(model.path)
+                self.current_size += sidecars - model.sidecars
+                model = model._replace(sidecars=sidecars)
+                self._replace(modelHash, model)
+                try:
+                    self._evict(0)
+                    return True
+                except RuntimeError as e:
+                    logger.warning("No room for %s next to model %s: %s", path, modelHash, e)
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            if model is not None:
+                self.current_size -= model.sidecars
+                model = model._replace(sidecars=self._sidecarBytes(model.path))
+                self.current_size += model.sidecars
+                self._replace(modelHash, model)
+            return False
+
+    def models(self, sync: bool = False) -> dict:
+        """
+        Snapshot of the models in storage, model_hash -> ModelEntry. With sync, in shared
+        mode, first picks up the models other workers added or evicted.
+        """
+        with self._indexLock() if sync else self.lock:
+            models = dict(self.cache)
+            models.update(self.held)
+            return models
+
+    def acquire(self, modelHash: str) -> None:
+        """
+        Mark a model as in use so it can't be evicted until the matching release.
+        """
+        with self.lock:
+            self.refs[modelHash] = self.refs.get(modelHash, 0) + 1
+            if modelHash in self.cache:
+                self.held[modelHash] = self.cache.pop(modelHash)
+            model = self._lookup(modelHash)
+            if model is not None:
+                # If the file is already gone, get() finds out and fetches it again
+                self._leaseFile(modelHash, model.path)
+
+    def release(self, modelHash: str) -> None:
+        with self.lock:
+            self.refs[modelHash] -= 1
+            if self.refs[modelHash] == 0:
+                del self.refs[modelHash]
+                self._unhold(modelHash)
+
+    @contextmanager
+    def lease(self, modelHash: str):
+        """
+        Hold a model in storage for the duration of a with block.
+        """
+        self.acquire(modelHash)
+        try:
+            yield
+        finally:
+            self.release(modelHash)
+
+    def pin(self, modelHash: str) -> None:
+        """
+        Keep a hot model in storage regardless of recency, once it is fetched if it
+        isn't yet. Pins are recorded in PINNED_FILE, so they outlast restarts and apply
+        to every worker.
+        """
+        with self._indexLock():
+            self._pin(modelHash)
+            self._writePins()
+
+    def unpin(self, modelHash: str) -> None:
+        with self._indexLock():
+            self._unpin(modelHash)
+            self._writePins()
+
+    def _pin(self, modelHash: str) -> None:
+        self.pinned.add(modelHash)
         if modelHash in self.cache:
-            # Move accessed item to most recently used
-            self.cache.move_to_end(modelHash)
+            self.held[modelHash] = self.cache.pop(modelHash)
+        model = self._lookup(modelHash)
+        if model is not None:
+            self._leaseFile(modelHash, model.path)
+
+    def _unpin(self, modelHash: str) -> None:
+        self.pinned.discard(modelHash)
+        if modelHash not in self.refs:
+            self._unhold(modelHash)
 
+    def _readPins(self) -> set:
+        try:
+            with open(os.path.join(self.model_dir, PINNED_FILE), "r") as f:
+                return set(json.load(f))
+        except (OSError, ValueError):
+            return set()
+
+    def _writePins(self) -> None:
+        # Caller holds the index lock
+        path = os.path.join(self.model_dir, PINNED_FILE)
+        with open(path + ".part", "w") as f:
+            json.dump(sorted(self.pinned), f)
+        os.replace(path + ".part", path)
+
+    def _lookup(self, modelHash: str):
+        if modelHash in self.cache:
+            return self.cache[modelHash]
+        return self.held.get(modelHash)
+
+    def _touch(self, modelHash: str, model: ModelEntry) -> None:
+        # Record the hit with the eviction policy, and persist recency for restarts in
+        # the access time. The mtime is left alone since it guards the recorded digest.
+        self.policy.access(modelHash)
+        atime = time.time_ns()
+        try:
+            os.utime(model.path, ns=(atime, model.mtime))
+            self.atimes[modelHash] = atime
+        except OSError:
+            pass
+
+    def _replace(self, modelHash: str, model: ModelEntry) -> None:
+        # Swap an entry in place without telling the eviction policy
+        if modelHash in self.cache:
+            self.cache[modelHash] = model
+        else:
+            self.held[modelHash] = model
+
+    def _place(self, modelHash: str, model: ModelEntry, cost: float = None) -> None:
+        # cost is the seconds the download took, None if unknown
+        self.policy.insert(modelHash, model.size, cost)
+        if modelHash in self.pinned or modelHash in self.refs:
+            self.held[modelHash] = model
+        else:
+            self.cache[modelHash] = model
+
+    def _unhold(self, modelHash: str) -> None:
+        if modelHash in self.pinned:
+            return
+        if modelHash in self.held:
+            self.cache[modelHash] = self.held.pop(modelHash)
+        fd = self.lease_fds.pop(modelHash, None)
+        if fd is not None:
+            os.close(fd)
+
+    def _remove(self, modelHash: str) -> None:
+        model = self.cache.pop(modelHash, None) or self.held.pop(modelHash, None)
+        if model is not None:
+            self.current_size -= model.size + model.sidecars
+            self.policy.remove(modelHash)
+        self.atimes.pop(modelHash, None)
+
+    def _evict(self, size: int) -> None:
+        """
+        Evict models chosen by the eviction policy until size more bytes fit. Caller holds the lock.
+        """
+        partials = self._partials()
+        partial_size = sum(partials.values())
+        candidates = self.cache
+        while size + self.current_size + self.reserved_size + self.others_reserved + partial_size > self.capacity:
+            if partials:
+                # Leftovers of failed downloads go before any complete model
+                modelHash = next(iter(partials))
+                partial_size -= partials.pop(modelHash)
+                self._removePartial(modelHash)
+                continue
+            if not candidates:
+                raise RuntimeError("Not enough evictable storage for %d bytes, all cached models are in use or pinned" % size)
+
+            modelHash = self.policy.victim(candidates)
             model = self.cache[modelHash]
-            if not os.path.exists(model.path):
-                self._downloadModel(modelHash)
-
-            print(f"Model hash {modelHash} found in cache, returning path {model.path}")
-            return model.path
-        
-        # Check IPFs if model fits within cache
-        size = self._getModelSize(modelHash)
+            fd = self._lockExclusive(model.path)
+            if fd is False:
+                # Leased by another worker, leave it to the policy's next choice
+                if candidates is self.cache:
+                    candidates = dict(self.cache)
+                del candidates[modelHash]
+                continue
+
+            del self.cache[modelHash]
+            if candidates is not self.cache:
+                del candidates[modelHash]
+            self.atimes.pop(modelHash, None)
+            try:
+                # Remove the model along with its sidecars, e.g. digest and cached optimized graph
+                for path in [model.path] + glob.glob(glob.escape(model.path) + ".*"):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            finally:
+                if fd is not None:
+                    os.close(fd)
+            self.current_size -= model.size + model.sidecars
+            self.policy.evicted(modelHash)
+            if self.on_evict is not None:
+                self.on_evict(modelHash)
+            CACHE_EVICTIONS.inc()
+            logger.info("Triggered cache eviction policy, removed file %s of size %d", model.path, model.size)
+
+    def _partials(self) -> dict:
+        """
+        Partial files of failed downloads, model_hash -> bytes, oldest first. Those of
+        downloads in progress are left out, their reservations already account for
+        them. Partials past STORAGE_PARTIAL_TTL are removed. Caller holds the lock.
+        """
+        partials = []
+        now = time.time()
+        with os.scandir(self.model_dir) as entries:
+            for entry in entries:
+                modelHash = entry.name[:-len(PARTIAL_SUFFIX)]
+                if not entry.name.endswith(PARTIAL_SUFFIX) or not modelHash or "." in modelHash:
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > STORAGE_PARTIAL_TTL:
+                    self._removePartial(modelHash)
+                else:
+                    partials.append((stat.st_mtime, modelHash, stat.st_size))
+
+        return {modelHash: size for _, modelHash, size in sorted(partials) if not self._downloading(modelHash)}
+
+    def _downloading(self, modelHash: str) -> bool:
+        """
+        Whether this or, in shared mode, another worker is downloading the model.
+        """
+        with self._downloadLock(modelHash, blocking=False) as acquired:
+            return not acquired
+
+    def _removePartial(self, modelHash: str) -> None:
+        # Skipped if a download picked the partial up meanwhile
+        with self._downloadLock(modelHash, blocking=False) as acquired:
+            if not acquired:
+                return
+            path = os.path.join(self.model_dir, modelHash + PARTIAL_SUFFIX)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return
+        logger.info("Removed partial download %s", path)
+
+    def _loadIndex(self) -> None:
+        """
+        Rebuild the index from the models already on disk, least recently accessed first.
+        """
+        if self.shared:
+            with self._indexLock():
+                # The budget may have shrunk since the last boot
+                self._evict(0)
+            logger.info("Loaded %d models from %s shared with other workers, %d bytes in use", len(self.cache), self.model_dir, self.current_size)
+            return
+
+        models = []
+        for name in os.listdir(self.model_dir):
+            # Partial downloads and sidecar files all carry an extension, CIDs never do
+            path = os.path.join(self.model_dir, name)
+            if "." in name or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            models.append((stat.st_atime_ns, name, self._entry(path, stat)))
+
+        with self.lock:
+            self.pinned = self._readPins()
+            for _, modelHash, model in sorted(models):
+                self._place(modelHash, model)
+                self.current_size += model.size + model.sidecars
+
+            # The budget may have shrunk since the last boot
+            self._evict(0)
+
+        logger.info("Loaded %d models from %s, %d bytes in use", len(self.cache), self.model_dir, self.current_size)
+
+    def _reserve(self, modelHash: str, size: int) -> bool:
+        """
+        Evict models based on the eviction policy until size more bytes fit, and hold them
+        for a download. The caller takes the reservation back once the download is done.
+        False if the model is already in storage and nothing was reserved.
+        """
         if size > self.capacity:
-            raise ValueError("Model size for %s greater than max capacity", modelHash)
-        
-        # Evict cache based on LRU policy until we have room to download new model
-        while size + self.current_size > self.capacity:
-            model = self.cache.popitem(last=False).size
-            os.remove(model.path)
-            self.current_size -= model.size
-            print(f"Triggered cache eviction policy, removed file {model.path} of size {model.size}")
-
-        # Download item from IPFS directly into OrderedDict
-        path = self._downloadModel(modelHash)
-        new_entry = ModelEntry(path, size)
-
-        # Insert into cache
-        self.cache[modelHash] = new_entry
-        self.cache.move_to_end(modelHash)
-        return new_entry.path
-
-    
-    def _downloadModel(self, modelHash):
-        """
-        Download and save the model data from IPFS. Returns the path to the saved data. 
-        """
-        # Check if file already exists
-        output_path = os.path.join(self.model_dir, modelHash)
-        if os.path.exists(output_path):
-            print("Model already exists, returning path ", output_path)
+            raise ValueError("Model size for %s greater than max capacity" % modelHash)
+        with self._indexLock():
+            if self._lookup(modelHash) is not None:
+                # Already on disk, e.g. fetched by another worker meanwhile
+                return False
+            self._evict(size)
+            self.reserved_size += size
+            self._publishReservation()
+        return True
+
+    def _unreserve(self, size: int) -> None:
+        with self._indexLock(sync=False):
+            self.reserved_size -= size
+            self._publishReservation()
+
+    @contextmanager
+    def _indexLock(self, sync: bool = True):
+        """
+        Hold the lock and, in shared mode, the index lock shared with the other workers,
+        taken first. With sync, the index is brought up to date with the model directory
+        before the with block. Caller must not hold the lock already.
+        """
+        if not self.shared:
+            with self.lock:
+                yield
+            return
+        with self.index_lock:
+            fcntl.flock(self.index_lock_fd, fcntl.LOCK_EX)
+            try:
+                with self.lock:
+                    if sync:
+                        self._syncIndex()
+                    yield
+            finally:
+                fcntl.flock(self.index_lock_fd, fcntl.LOCK_UN)
+
+    def _syncIndex(self) -> None:
+        """
+        Pick up models other workers added to or evicted from the model directory, hits
+        they recorded in access times, pins and their reservations. Caller holds both locks.
+        """
+        pinned = self._readPins()
+        for modelHash in self.pinned - pinned:
+            self._unpin(modelHash)
+        for modelHash in pinned - self.pinned:
+            self._pin(modelHash)
+
+        on_disk = {}
+        sidecars = {}
+        with os.scandir(self.model_dir) as entries:
+            for entry in entries:
+                # Partial downloads and sidecar files all carry an extension, CIDs never do
+                if not entry.is_file():
+                    continue
+                modelHash, dot, _ = entry.name.partition(".")
+                try:
+                    if not dot:
+                        on_disk[modelHash] = entry.stat()
+                    elif modelHash:
+                        sidecars[modelHash] = sidecars.get(modelHash, 0) + entry.stat().st_size
+                except FileNotFoundError:
+                    pass
+
+        for modelHash in list(self.cache) + list(self.held):
+            if modelHash not in on_disk:
+                self._remove(modelHash)
+                if self.on_evict is not None:
+                    self.on_evict(modelHash)
+
+        for modelHash, stat in sorted(on_disk.items(), key=lambda item: item[1].st_atime_ns):
+            model = self._lookup(modelHash)
+            if model is None:
+                path = os.path.join(self.model_dir, modelHash)
+                model = ModelEntry(path, stat.st_size, stat.st_mtime_ns, self._readDigest(path, stat), sidecars.get(modelHash, 0))
+                self.current_size += model.size + model.sidecars
+                self._place(modelHash, model)
+            else:
+                if stat.st_atime_ns > self.atimes.get(modelHash, stat.st_atime_ns):
+                    self.policy.access(modelHash)
+                # Sidecars other workers wrote, e.g. an optimized graph
+                if sidecars.get(modelHash, 0) != model.sidecars:
+                    self.current_size += sidecars.get(modelHash, 0) - model.sidecars
+                    self._replace(modelHash, model._replace(sidecars=sidecars.get(modelHash, 0)))
+            self.atimes[modelHash] = stat.st_atime_ns
+
+        self.others_reserved = sum(size for pid, size in self._readReservations().items() if pid != os.getpid())
+
+    def _readReservations(self) -> dict:
+        """
+        pid -> reserved bytes of the worker processes still alive.
+        """
+        try:
+            with open(os.path.join(self.model_dir, RESERVATIONS_FILE), "r") as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {int(pid): size for pid, size in records.items() if os.path.exists("/proc/%s" % pid)}
+
+    def _publishReservation(self) -> None:
+        # Caller holds the index lock
+        if not self.shared:
+            return
+        reservations = self._readReservations()
+        reservations[os.getpid()] = self.reserved_size
+        records = {str(pid): size for pid, size in reservations.items() if size}
+        path = os.path.join(self.model_dir, RESERVATIONS_FILE)
+        with open(path + ".part", "w") as f:
+            json.dump(records, f)
+        os.replace(path + ".part", path)
+
+    def _leaseFile(self, modelHash: str, path: str) -> bool:
+        """
+        In shared mode, hold a shared flock on the file of a leased or pinned model so
+        other workers can't evict it. False if the file was removed before the flock was
+        taken. Caller holds the lock.
+        """
+        if not self.shared or modelHash in self.lease_fds or (modelHash not in self.refs and modelHash not in self.pinned):
+            return True
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        # Only waits while another worker is deleting this very file
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        if os.fstat(fd).st_nlink == 0:
+            os.close(fd)
+            return False
+        self.lease_fds[modelHash] = fd
+        return True
+
+    def _lockExclusive(self, path: str):
+        """
+        In shared mode, an fd holding an exclusive flock on a model file about to be
+        evicted, or False if another worker has it leased. None when not shared or the
+        file is already gone.
+        """
+        if not self.shared:
+            return None
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        return fd
+
+    def _downloadModel(self, modelHash, info: ipfs.CIDInfo = None, reserve=None):
+        """
+        Stream the model data from the IPFS daemon into a partial file, then atomically
+        rename it into place. Returns the path to the saved data.
+
+        An interrupted download leaves its ".part" file behind and the next call resumes
+        from its end, so a truncated model is never visible under the final path. Until
+        then its bytes count against capacity, and it is removed once it is older than
+        STORAGE_PARTIAL_TTL or its space is needed. The
+        SHA-256 digest is computed while the bytes stream in and persisted next to the model.
+
+        info is what the metadata cache knew about the model, if anything; the digest is
+        checked against it. reserve, if given, is called with the model size as soon as
+        the response arrives, before any of the body is written.
+        """
+        with self._downloadLock(modelHash):
+            # Check if file already exists
+            output_path = os.path.join(self.model_dir, modelHash)
+            if os.path.exists(output_path):
+                logger.debug("Model already exists, returning path %s", output_path)
+                return output_path
+
+            partial_path = output_path + PARTIAL_SUFFIX
+            sha256_hash = hashlib.sha256()
+            offset = 0
+            if os.path.exists(partial_path):
+                # Resume: the bytes already on disk still need to go through the digest
+                with open(partial_path, "rb") as f:
+                    for byte_block in iter(lambda: f.read(CHUNK_SIZE), b""):
+                        sha256_hash.update(byte_block)
+                        offset += len(byte_block)
+                logger.info("Resuming download of model %s at byte %d", modelHash, offset)
+
+            blocks = info.blocks if info is not None else None
+            try:
+                with self.ipfs.cat(modelHash, offset) as response:
+                    if reserve is not None:
+                        length = response.headers.get("X-Content-Length")
+                        if length is not None:
+                            reserve(offset + int(length))
+                        else:
+                            # Older daemons don't send the length, fall back to a stat call
+                            stat_info = self._statModel(modelHash)
+                            blocks = stat_info.blocks
+                            reserve(stat_info.size)
+                    with open(partial_path, "ab") as f:
+                        for byte_block in response.iter_content(chunk_size=CHUNK_SIZE):
+                            f.write(byte_block)
+                            sha256_hash.update(byte_block)
+                            BYTES_DOWNLOADED.inc(len(byte_block))
+                        f.flush()
+                        os.fsync(f.fileno())
+            except ipfs.ModelNotFound as e:
+                self.metadata.notFound(modelHash, e)
+                raise
+            except (requests.RequestException, OSError) as e:
+                raise RuntimeError(f"Failed to download model {modelHash} from IPFS: {e}")
+
+            digest = sha256_hash.hexdigest()
+            if info is not None and info.digest is not None and info.digest != digest:
+                os.remove(partial_path)
+                raise RuntimeError("Model %s from IPFS has digest %s, expected %s as recorded before" % (modelHash, digest, info.digest))
+
+            os.replace(partial_path, output_path)
+            stat = os.stat(output_path)
+            self._writeDigest(output_path, digest, stat)
+            self._fsyncDir()
+            self.metadata.put(modelHash, ipfs.CIDInfo(size=stat.st_size, blocks=blocks, digest=digest))
+
+            logger.info("Model %s downloaded successfully.", modelHash)
             return output_path
 
-        # Download model from IPFS
-        # TODO (Kyle): Look into making this a streaming option
-        command = ["ipfs", "get", "--output", output_path, modelHash]
+    @contextmanager
+    def _downloadLock(self, modelHash, blocking: bool = True):
+        """
+        Hold the model's download lock, in shared mode across workers. Without blocking,
+        yields whether it was free instead of waiting for it.
+        """
+        with self.download_locks_lock:
+            lock = self.download_locks.setdefault(modelHash, threading.Lock())
+        if not lock.acquire(blocking):
+            yield False
+            return
+        try:
+            if not self.shared:
+                yield True
+                return
+            # Kept apart from the model's own files, which eviction removes
+            fd = os.open(os.path.join(self.model_dir, DOWNLOAD_LOCKS_DIR, modelHash), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+                yield True
+            finally:
+                os.close(fd)
+        finally:
+            lock.release()
+
+    def _fsyncDir(self):
+        """
+        Persist the rename of a finished download
+        """
+        fd = os.open(self.model_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _entry(self, path: str, stat: os.stat_result) -> ModelEntry:
+        return ModelEntry(path, stat.st_size, stat.st_mtime_ns, self._readDigest(path, stat), self._sidecarBytes(path))
+
+    def _sidecarBytes(self, path: str) -> int:
+        """
+        Bytes of the files next to a model, the ones eviction removes along with it.
+        """
+        size = 0
+        for sidecar in glob.glob(glob.escape(path) + ".*"):
+            try:
+                size += os.path.getsize(sidecar)
+            except FileNotFoundError:
+                pass
+        return size
 
+    def _readDigest(self, path: str, stat: os.stat_result):
+        """
+        Digest recorded in the sidecar file, None if missing or the model changed since.
+        """
+        try:
+            with open(path + DIGEST_SUFFIX, "r") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if record.get("size") != stat.st_size or record.get("mtime_ns") != stat.st_mtime_ns:
+            return None
+        return record.get("sha256")
+
+    def _writeDigest(self, path: str, digest: str, stat: os.stat_result) -> None:
+        record = {"sha256": digest, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        partial_path = path + DIGEST_SUFFIX + ".part"
+        with open(partial_path, "w") as f:
+            json.dump(record, f)
+        os.replace(partial_path, path + DIGEST_SUFFIX)
+
+    def _statModel(self, modelHash) -> ipfs.CIDInfo:
+        """
+        Get IPFS model size and block count, and remember them in the metadata cache
+        """
         try:
-            subprocess.run(command, check=True)
-            print(f"Model {modelHash} downloaded successfully.")
-        except subprocess.CalledProcessError as e:
-            # If there's any error, make sure to remove the model hash from the cache
-            print(f"Removed model hash {modelHash} from cache, failed to download from IPFS")
-            raise RuntimeError(f"Failed to download model {modelHash} from IPFS")
-        
-        return output_path
-    
-    def _getModelSize(self, modelHash):
-        """
-        Get IPFS model size
-        """
-        command = ["ipfs", "files", "stat", "--size", f"/ipfs/{modelHash}"]
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        return int(result.stdout.strip())
\ No newline at end of file
+            with metrics.stage("ipfs_stat"):
+                info = self.ipfs.stat(modelHash)
+        except ipfs.ModelNotFound as e:
+            self.metadata.notFound(modelHash, e)
+            raise
+        self.metadata.put(modelHash, info)
+        return info
\ No newline at end of file
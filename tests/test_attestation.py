@@ -0,0 +1,110 @@
+import hashlib
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import attestation
+
+"""
+The response digest and Merkle batch layouts clients reproduce to verify responses,
+checked against vectors built by hand from the module docstring.
+"""
+
+MODEL_HASH = "QmTest"
+INPUTS = [b'{"a": 1}', b""]
+OUTPUT = b'{"out": 2}'
+
+def test_digest_vector():
+    message = (b"opengradient-inference-response-v1\x00"
+               + b"\x06\x00\x00\x00\x00\x00\x00\x00" + b"QmTest"
+               + b"\x02\x00\x00\x00\x00\x00\x00\x00"
+               + b"\x08\x00\x00\x00\x00\x00\x00\x00" + b'{"a": 1}'
+               + b"\x00\x00\x00\x00\x00\x00\x00\x00"
+               + b'{"out": 2}'
+               + b"\x0a\x00\x00\x00\x00\x00\x00\x00")
+    expected = hashlib.sha256(message).digest()
+    assert expected.hex() == "086cfadaab07b02c5bf51235cf060cf55dd43475e5ea0ed2190780db44707606"
+    assert attestation.response_digest(MODEL_HASH, INPUTS, [OUTPUT]) == expected
+
+def test_digest_ignores_output_chunking():
+    expected = attestation.response_digest(MODEL_HASH, INPUTS, [OUTPUT])
+    digest = attestation.ResponseDigest(MODEL_HASH, INPUTS)
+    for i in range(len(OUTPUT)):
+        digest.update(OUTPUT[i:i + 1])
+    assert digest.digest() == expected
+    assert attestation.response_digest(MODEL_HASH, INPUTS, [OUTPUT[:3], b"", OUTPUT[3:]]) == expected
+
+def test_digest_separates_inputs():
+    # Length prefixes keep the split between model hash, inputs and output unambiguous
+    digests = {attestation.response_digest(MODEL_HASH, [b"ab", b"c"], [b"d"]),
+               attestation.response_digest(MODEL_HASH, [b"a", b"bc"], [b"d"]),
+               attestation.response_digest(MODEL_HASH, [b"abc"], [b"d"]),
+               attestation.response_digest(MODEL_HASH, [b"ab"], [b"cd"]),
+               attestation.response_digest(MODEL_HASH + "a", [b"b"], [b"cd"])}
+    assert len(digests) == 5
+
+def test_merkle_root_vector():
+    digests = [bytes([i]) * 32 for i in range(3)]
+    leaves = [hashlib.sha256(b"\x00" + digest).digest() for digest in digests]
+    left = hashlib.sha256(b"\x01" + leaves[0] + leaves[1]).digest()
+    # The odd leaf is carried up unchanged
+    root = hashlib.sha256(b"\x01" + left + leaves[2]).digest()
+    assert attestation.merkle_levels(digests)[-1] == [root]
+    assert attestation.merkle_levels(digests[:1])[-1] == [leaves[0]]
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 8])
+def test_proofs(size):
+    digests = [hashlib.sha256(b"response %d" % i).digest() for i in range(size)]
+    levels = attestation.merkle_levels(digests)
+    root = levels[-1][0]
+    for index, digest in enumerate(digests):
+        proof = attestation.merkle_proof(levels, index)
+        assert attestation.verify_proof(digest, index, size, proof, root)
+
+        # Any other index or root is rejected, the size is bound by the signed commitment
+        for other in range(-1, size + 1):
+            if other != index:
+                assert not attestation.verify_proof(digest, other, size, proof, root)
+        assert not attestation.verify_proof(digest, index, size, proof, hashlib.sha256(root).digest())
+        assert not attestation.verify_proof(hashlib.sha256(digest).digest(), index, size, proof, root)
+        if proof:
+            assert not attestation.verify_proof(digest, index, size, proof[:-1], root)
+        assert not attestation.verify_proof(digest, index, size, proof + [root], root)
+
+def test_seal_signs_commitment():
+    key = attestation.AppKey()
+    batches = attestation.MerkleBatches(key, batch_size=4)
+    digests = [hashlib.sha256(b"response %d" % i).digest() for i in range(5)]
+    places = [batches.append(digest) for digest in digests]
+
+    # The fourth response filled batch 0 and sealed it, the fifth opened batch 1
+    assert places == [(0, 0), (0, 1), (0, 2), (0, 3), (1, 0)]
+    assert batches.get(1) is None
+    sealed = batches.get(0)
+    assert sealed.size == 4
+    assert sealed.root == attestation.merkle_levels(digests[:4])[-1][0]
+    assert attestation.verify_signature(key.public_key, attestation.commitment(0, 4, sealed.root), sealed.signature)
+    assert not attestation.verify_signature(key.public_key, attestation.commitment(1, 4, sealed.root), sealed.signature)
+    assert not attestation.verify_signature(key.public_key, attestation.commitment(0, 5, sealed.root), sealed.signature)
+    for index, digest in enumerate(digests[:4]):
+        assert attestation.verify_proof(digest, index, sealed.size, attestation.merkle_proof(sealed.levels, index), sealed.root)
+
+    batches.seal()
+    sealed = batches.get(1)
+    assert sealed.size == 1 and sealed.root == attestation.merkle_levels(digests[4:])[-1][0]
+    assert attestation.verify_signature(key.public_key, attestation.commitment(1, 1, sealed.root), sealed.signature)
+
+def test_shared_batches(tmp_path):
+    key = attestation.AppKey()
+    workers = [attestation.MerkleBatches(key, directory=str(tmp_path)) for _ in range(2)]
+    digest = hashlib.sha256(b"response").digest()
+    places = [worker.append(digest) for worker in workers]
+    assert sorted(batch for batch, _ in places) == [0, 1]
+    workers[0].seal()
+
+    # Any worker serves a batch another one sealed
+    batch = places[0][0]
+    sealed = workers[1].get(batch)
+    assert sealed.root == workers[0].get(batch).root
+    assert attestation.verify_signature(key.public_key, attestation.commitment(batch, 1, sealed.root), sealed.signature)
@@ -0,0 +1,99 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import utils
+
+"""
+decode_fixed_point against convert_to_float, the per-element reference from the
+inference node: every value it decodes must come out identical, bit for bit.
+"""
+
+FLOAT_TYPES = ["tensor(float)", "tensor(double)"]
+INT_TYPES = ["tensor(int64)"]
+
+def reference(nums: list, input_type: str) -> np.ndarray:
+    dtype = utils._onnx_num_dtype(input_type)
+    return np.array([utils.convert_to_float(num, input_type) for num in nums]).astype(dtype)
+
+def check_parity(nums: list, input_type: str) -> None:
+    expected = reference(nums, input_type)
+    decoded = utils.decode_fixed_point(nums, input_type)
+    assert decoded.dtype == expected.dtype
+    assert decoded.tobytes() == expected.tobytes()
+
+def fixed(values: list, decimals) -> list:
+    if not isinstance(decimals, list):
+        decimals = [decimals] * len(values)
+    return [{"value": value, "decimals": decimal} for value, decimal in zip(values, decimals)]
+
+@pytest.mark.parametrize("input_type", FLOAT_TYPES + INT_TYPES)
+@pytest.mark.parametrize("decimals", [0, 1, 2, 7, 18])
+def test_uniform_decimals(input_type, decimals):
+    values = np.random.default_rng(decimals).integers(-10 ** 12, 10 ** 12, 257).tolist()
+    check_parity(fixed(values, decimals), input_type)
+
+@pytest.mark.parametrize("input_type", FLOAT_TYPES + INT_TYPES)
+def test_mixed_decimals(input_type):
+    rng = np.random.default_rng(1)
+    values = rng.integers(-10 ** 15, 10 ** 15, 500).tolist()
+    decimals = rng.integers(0, utils.DECIMAL_LIMIT + 1, 500).tolist()
+    check_parity(fixed(values, decimals), input_type)
+
+@pytest.mark.parametrize("input_type", INT_TYPES)
+def test_negative_values_truncate_toward_zero(input_type):
+    nums = fixed([-15, -10, -19, -1, -999, 15, 19], [1, 1, 1, 1, 2, 1, 1])
+    check_parity(nums, input_type)
+    assert utils.decode_fixed_point(nums, input_type).tolist() == [-1, -1, -1, 0, -9, 1, 1]
+
+@pytest.mark.parametrize("input_type", FLOAT_TYPES)
+def test_values_past_float64_mantissa(input_type):
+    # Past 2**53 the vectorized float path would round before scaling
+    values = [2 ** 53 + 1, -(2 ** 53 + 1), 2 ** 63 - 1, -(2 ** 63), 123456789012345678]
+    check_parity(fixed(values, [0, 3, 9, 18, 5]), input_type)
+
+@pytest.mark.parametrize("input_type", FLOAT_TYPES)
+def test_values_past_int64(input_type):
+    values = [2 ** 64 + 7, -(2 ** 70), 10 ** 30, 1]
+    check_parity(fixed(values, [0, 18, 12, 0]), input_type)
+
+def test_int64_overflow():
+    nums = fixed([10 ** 20, 1], [0, 0])
+    with pytest.raises(OverflowError):
+        utils.convert_to_float(nums[0], "tensor(int64)")
+    with pytest.raises(OverflowError):
+        utils.decode_fixed_point(nums, "tensor(int64)")
+
+@pytest.mark.parametrize("input_type", FLOAT_TYPES + INT_TYPES)
+def test_string_values(input_type):
+    values = ["12345", "-678", "0", "9007199254740993", "-42"]
+    check_parity(fixed(values, ["2", "0", "5", "3", "1"]), input_type)
+    assert utils.decode_fixed_point(fixed(values, 1), input_type).tobytes() == \
+        utils.decode_fixed_point(fixed([int(value) for value in values], 1), input_type).tobytes()
+
+@pytest.mark.parametrize("input_type", FLOAT_TYPES + INT_TYPES)
+@pytest.mark.parametrize("decimals", [utils.DECIMAL_LIMIT + 1, str(utils.DECIMAL_LIMIT + 1), 10 ** 20])
+def test_decimal_limit(input_type, decimals):
+    nums = fixed([1, 2], [0, decimals])
+    with pytest.raises(ValueError, match="precision limit"):
+        utils.convert_to_float(nums[1], input_type)
+    with pytest.raises(ValueError, match="precision limit"):
+        utils.decode_fixed_point(nums, input_type)
+
+@pytest.mark.parametrize("input_type,low,high", [("tensor(int8)", -128, 127),
+                                                 ("tensor(uint8)", 0, 255),
+                                                 ("tensor(int16)", -32768, 32767),
+                                                 ("tensor(int32)", -2 ** 31, 2 ** 31 - 1),
+                                                 ("tensor(uint32)", 0, 2 ** 32 - 1)])
+def test_narrow_int_range(input_type, low, high):
+    check_parity(fixed([low, high, low * 10, high * 10], [0, 0, 1, 1]), input_type)
+    # convert_to_float leaves narrowing to the caller, decode_fixed_point refuses to wrap
+    for value in (low - 1, high + 1):
+        with pytest.raises(OverflowError):
+            utils.decode_fixed_point(fixed([0, value], 0), input_type)
+
+def test_empty():
+    for input_type in FLOAT_TYPES + INT_TYPES:
+        assert utils.decode_fixed_point([], input_type).dtype == utils._onnx_num_dtype(input_type)
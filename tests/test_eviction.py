@@ -0,0 +1,119 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import eviction
+
+"""
+Victim order of the eviction policies, driven the way StorageManager drives them: a
+miss evicts victims until the model fits, then inserts it.
+"""
+
+class Storage():
+    def __init__(self, name: str, capacity: float):
+        self.policy = eviction.create(name, capacity)
+        self.capacity = capacity
+        self.models = {}
+        self.evicted = []
+
+    def request(self, modelHash: str, size: int, cost: float = 1.0) -> None:
+        if modelHash in self.models:
+            self.policy.access(modelHash)
+            return
+        while sum(self.models.values()) + size > self.capacity:
+            victim = self.policy.victim(self.models)
+            del self.models[victim]
+            self.policy.evicted(victim)
+            self.evicted.append(victim)
+        self.models[modelHash] = size
+        self.policy.insert(modelHash, size, cost)
+
+def test_lru_order():
+    storage = Storage("lru", 30)
+    for modelHash in ("QmA", "QmB", "QmC", "QmA"):
+        storage.request(modelHash, 10)
+    storage.request("QmD", 10)
+    storage.request("QmE", 10)
+    assert storage.evicted == ["QmB", "QmC"]
+
+    # Models that aren't candidates, e.g. leased ones, are passed over
+    assert storage.policy.victim({"QmA": 10, "QmE": 10}) == "QmA"
+
+def test_gdsf_keeps_small_costly_and_frequent_models():
+    storage = Storage("gdsf", 100)
+    storage.request("QmCheap", 40, cost=1.0)
+    storage.request("QmCostly", 40, cost=10.0)
+    storage.request("QmSmall", 10, cost=1.0)
+    storage.request("QmNew", 30)
+    assert storage.evicted == ["QmCheap"]
+
+    # Hits raise a model's priority above costlier ones per byte
+    for _ in range(20):
+        storage.request("QmNew", 30)
+    storage.request("QmNext", 60)
+    assert storage.evicted == ["QmCheap", "QmSmall", "QmCostly"]
+    assert "QmNew" in storage.models
+
+@pytest.mark.parametrize("name", sorted(eviction.POLICIES))
+def test_victim_has_no_side_effects(name):
+    storage = Storage(name, 100)
+    for i, size in enumerate([10, 20, 30, 10]):
+        storage.request("Qm%d" % i, size, cost=i + 1.0)
+    storage.request("Qm0", 10)
+    state = repr(vars(storage.policy))
+
+    # Asking again, e.g. after another worker turned the first choice down, changes nothing
+    first = storage.policy.victim(storage.models)
+    assert storage.policy.victim(storage.models) == first
+    others = {modelHash: size for modelHash, size in storage.models.items() if modelHash != first}
+    storage.policy.victim(others)
+    assert repr(vars(storage.policy)) == state
+
+def test_gdsf_inflation_rises_on_eviction_only():
+    storage = Storage("gdsf", 100)
+    storage.request("QmA", 50, cost=1.0)
+    storage.request("QmB", 50, cost=5.0)
+    policy = storage.policy
+
+    first = policy.victim(storage.models)
+    policy.victim({"QmB": 50})
+    assert first == "QmA" and policy.inflation == 0.0
+
+    priority = policy.entries["QmB"][0]
+    policy.evicted("QmB")
+    assert policy.inflation == priority
+    policy.remove("QmA")
+    assert policy.inflation == priority
+
+def test_tinylfu_one_off_large_models_do_not_flush_hot_ones():
+    hot = ["QmHot%d" % i for i in range(6)]
+    storages = {name: Storage(name, 120) for name in ("lru", "tinylfu")}
+    for storage in storages.values():
+        for i in range(10):
+            for modelHash in hot:
+                storage.request(modelHash, 10)
+            # A scan of large models, each requested once
+            storage.request("QmLarge%d" % (2 * i), 50)
+            storage.request("QmLarge%d" % (2 * i + 1), 50)
+
+    assert set(hot) & set(storages["lru"].evicted)
+    assert not set(hot) & set(storages["tinylfu"].evicted)
+    assert set(hot) <= set(storages["tinylfu"].models)
+
+def test_tinylfu_admits_models_requested_again():
+    storage = Storage("tinylfu", 100)
+    for modelHash in ("QmA", "QmB", "QmC", "QmD"):
+        for _ in range(3):
+            storage.request(modelHash, 25)
+    # A new model requested once loses to the hot ones, once it is as popular it stays
+    storage.request("QmNew", 25)
+    storage.request("QmOther", 25)
+    assert "QmNew" in storage.evicted
+    for _ in range(4):
+        storage.request("QmNew", 25)
+    assert "QmNew" in storage.models
+
+def test_unknown_policy():
+    with pytest.raises(ValueError, match="Unknown eviction policy"):
+        eviction.create("fifo", 100)
@@ -0,0 +1,50 @@
+import json
+import os
+import sys
+import pytest
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import ipfs
+
+"""
+How IPFSClient classifies the daemon's JSON errors: only failures to resolve the CID
+are ModelNotFound, and so negatively cached; the rest are transient.
+"""
+
+def daemon_error(message: str, status: int = 500) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps({"Message": message, "Code": 0, "Type": "error"}).encode("utf-8")
+    return response
+
+@pytest.mark.parametrize("message", [
+    "block was not found locally (offline): bafybeigdyrzt5sfp7udm7hu76uh7y26nf3efuylqabf3oclgtqy55fbzdi",
+    "invalid path \"QmNope\": invalid cid: selected encoding not supported",
+    "failed to decode CID",
+    "merkledag: not found",
+    "no link named \"model.onnx\" under QmA",
+    "this dag node is a directory",
+])
+def test_resolution_failures_are_not_found(message):
+    with pytest.raises(ipfs.ModelNotFound):
+        ipfs.IPFSClient()._raiseForStatus("QmA", daemon_error(message))
+
+@pytest.mark.parametrize("message", [
+    "context deadline exceeded",
+    "failed to fetch block: context canceled",
+    "routing: not found: context deadline exceeded",
+    "system: cannot reserve inbound stream: resource limit exceeded",
+    "too many open files",
+    "unexpected daemon failure",
+])
+def test_transient_failures_are_not_not_found(message):
+    with pytest.raises(ipfs.DaemonUnavailable):
+        ipfs.IPFSClient()._raiseForStatus("QmA", daemon_error(message))
+
+def test_non_json_error_raises_http_error():
+    response = requests.Response()
+    response.status_code = 502
+    response._content = b"Bad Gateway"
+    with pytest.raises(requests.HTTPError):
+        ipfs.IPFSClient()._raiseForStatus("QmA", response)
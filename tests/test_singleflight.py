@@ -0,0 +1,123 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import executor
+from storage.singleflight import SingleFlight
+
+"""
+SingleFlight with a stubbed downloader that takes a while, so every caller arrives
+while the first one's download is still in flight.
+"""
+
+CALLERS = 16
+
+class StubDownloader():
+    def __init__(self, delay: float = 0.2, error: Exception = None):
+        self.delay = delay
+        self.error = error
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def download(self, ipfs_hash: str) -> object:
+        with self.lock:
+            self.calls.append(ipfs_hash)
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        # A fresh object per download, so sharing shows up as identity
+        return object()
+
+def test_threads_share_one_execution():
+    flight = SingleFlight()
+    downloader = StubDownloader()
+    with ThreadPoolExecutor(max_workers=CALLERS) as pool:
+        futures = [pool.submit(flight.do, "QmA", downloader.download, "QmA") for _ in range(CALLERS)]
+        results = [future.result() for future in futures]
+
+    assert downloader.calls == ["QmA"]
+    assert all(result is results[0] for result in results)
+    assert flight.executions == 1
+    assert flight.coalesced == CALLERS - 1
+    assert flight.in_flight == {}
+
+def test_async_callers_share_one_execution():
+    flight = SingleFlight()
+    downloader = StubDownloader()
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async("QmA", downloader.download, "QmA") for _ in range(CALLERS)))
+
+    results = asyncio.run(main())
+    assert downloader.calls == ["QmA"]
+    assert all(result is results[0] for result in results)
+    assert flight.executions == 1
+    assert flight.coalesced == CALLERS - 1
+
+def test_callers_share_the_exception_and_retry_after_it():
+    flight = SingleFlight()
+    downloader = StubDownloader(error=RuntimeError("daemon unreachable"))
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async("QmA", downloader.download, "QmA") for _ in range(CALLERS)),
+                                    return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert downloader.calls == ["QmA"]
+    assert all(error is downloader.error for error in errors)
+
+    # The failure isn't cached, the next caller starts a fresh download
+    downloader.error = None
+    assert flight.do("QmA", downloader.download, "QmA") is not None
+    assert downloader.calls == ["QmA", "QmA"]
+    assert flight.executions == 2
+
+def test_different_keys_run_concurrently():
+    flight = SingleFlight()
+    downloader = StubDownloader()
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async(key, downloader.download, key) for key in ["QmA", "QmB", "QmA", "QmB"]))
+
+    start = time.perf_counter()
+    results = asyncio.run(main())
+    assert sorted(downloader.calls) == ["QmA", "QmB"]
+    assert results[0] is results[2] and results[1] is results[3]
+    assert time.perf_counter() - start < 2 * downloader.delay
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    flight = SingleFlight()
+    downloader = StubDownloader()
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do_async("QmA", downloader.download, "QmA"))
+        follower = asyncio.ensure_future(flight.do_async("QmA", downloader.download, "QmA"))
+        await asyncio.sleep(downloader.delay / 4)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(main()) is not None
+    assert downloader.calls == ["QmA"]
+
+def test_full_load_pool_fails_every_caller():
+    pool = executor.InferenceExecutor(workers=1, queue_depth=0, name="load")
+    flight = SingleFlight(submit=pool.submit)
+    downloader = StubDownloader()
+
+    async def main():
+        busy = asyncio.ensure_future(flight.do_async("QmA", downloader.download, "QmA"))
+        await asyncio.sleep(0)
+        rejected = await asyncio.gather(*(flight.do_async("QmB", downloader.download, "QmB") for _ in range(3)),
+                                        return_exceptions=True)
+        return await busy, rejected
+
+    result, rejected = asyncio.run(main())
+    assert result is not None
+    assert all(isinstance(error, executor.Saturated) for error in rejected)
+    assert downloader.calls == ["QmA"]
+    assert flight.executions == 1
+    assert flight.in_flight == {}
@@ -0,0 +1,188 @@
+import fcntl
+import hashlib
+import os
+import sys
+import threading
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bench"))
+import fake_ipfs
+from storage import storage
+
+"""
+StorageManager downloads against the stand-in IPFS daemon, in a fresh model directory
+per test.
+"""
+
+MODEL_SIZE = 3 << 20
+
+@pytest.fixture
+def daemon(tmp_path, monkeypatch):
+    ipfs_dir = tmp_path / "ipfs"
+    ipfs_dir.mkdir()
+    for name in ("QmA", "QmB"):
+        (ipfs_dir / name).write_bytes(os.urandom(MODEL_SIZE))
+    monkeypatch.chdir(tmp_path)
+    server = fake_ipfs.serve(str(ipfs_dir))
+    yield server
+    server.shutdown()
+
+def manager(daemon, shared: bool = False) -> storage.StorageManager:
+    return storage.StorageManager(api_url="http://127.0.0.1:%d/api/v0" % daemon.server_port, shared=shared)
+
+def partial_path(modelHash: str) -> str:
+    return os.path.join("storage", "models", modelHash + storage.PARTIAL_SUFFIX)
+
+def test_dropped_download_resumes_from_partial(daemon):
+    sm = manager(daemon)
+    daemon.drop_after = MODEL_SIZE // 3
+    with pytest.raises(RuntimeError):
+        sm.get("QmA")
+    assert not os.path.exists(os.path.join("storage", "models", "QmA"))
+    assert os.path.getsize(partial_path("QmA")) == MODEL_SIZE // 3
+
+    daemon.drop_after = None
+    downloaded = storage.BYTES_DOWNLOADED.values[None]
+    path = sm.get("QmA")
+
+    # Only the missing bytes were fetched, and the digest covers the whole file
+    assert storage.BYTES_DOWNLOADED.values[None] - downloaded == MODEL_SIZE - MODEL_SIZE // 3
+    with open(os.path.join(daemon.directory, "QmA"), "rb") as f:
+        expected = f.read()
+    with open(path, "rb") as f:
+        assert f.read() == expected
+    assert sm.digest("QmA") == hashlib.sha256(expected).hexdigest()
+    assert not os.path.exists(partial_path("QmA"))
+
+def test_partial_counts_against_capacity(daemon):
+    sm = manager(daemon)
+    sm.capacity = MODEL_SIZE + MODEL_SIZE // 4
+    daemon.drop_after = MODEL_SIZE // 3
+    with pytest.raises(RuntimeError):
+        sm.get("QmA")
+    assert sm._partials() == {"QmA": MODEL_SIZE // 3}
+
+    # QmB fits only once the partial is gone
+    daemon.drop_after = None
+    sm.get("QmB")
+    assert not os.path.exists(partial_path("QmA"))
+    assert sm.models().keys() == {"QmB"}
+
+def test_partial_expires(daemon, monkeypatch):
+    sm = manager(daemon)
+    daemon.drop_after = MODEL_SIZE // 3
+    with pytest.raises(RuntimeError):
+        sm.get("QmA")
+
+    monkeypatch.setattr(storage, "STORAGE_PARTIAL_TTL", 0)
+    assert sm._partials() == {}
+    assert not os.path.exists(partial_path("QmA"))
+
+def test_partial_in_progress_is_not_removed(daemon):
+    sm = manager(daemon)
+    daemon.drop_after = MODEL_SIZE // 3
+    with pytest.raises(RuntimeError):
+        sm.get("QmA")
+
+    with sm._downloadLock("QmA"):
+        assert sm._partials() == {}
+        sm._removePartial("QmA")
+    assert os.path.exists(partial_path("QmA"))
+
+def test_sidecar_counts_against_capacity(daemon):
+    sm = manager(daemon)
+    sm.capacity = 2 * MODEL_SIZE + MODEL_SIZE // 2
+    sm.get("QmA")
+    path_b = sm.get("QmB")
+    used = sm.current_size
+    model_a = sm.models()["QmA"]
+
+    # An optimized graph next to QmB makes room by evicting QmA, never QmB itself
+    sidecar = path_b + ".opt-test.onnx"
+    with open(sidecar, "wb") as f:
+        f.write(os.urandom(MODEL_SIZE // 2 + 1))
+    assert sm.addSidecar("QmB", sidecar)
+    assert sm.models().keys() == {"QmB"}
+    assert sm.current_size == used - model_a.size - model_a.sidecars + MODEL_SIZE // 2 + 1
+
+    # The sidecar's bytes are still counted after a restart, and go with the model
+    restarted = manager(daemon)
+    assert restarted.current_size == sm.current_size
+    restarted.capacity = MODEL_SIZE // 2
+    restarted._evict(0)
+    assert not os.path.exists(sidecar)
+    assert restarted.current_size == 0
+
+def test_sidecar_without_room_is_removed(daemon):
+    sm = manager(daemon)
+    sm.capacity = MODEL_SIZE + MODEL_SIZE // 2
+    path = sm.get("QmA")
+    used = sm.current_size
+
+    sidecar = path + ".opt-test.onnx"
+    with open(sidecar, "wb") as f:
+        f.write(os.urandom(MODEL_SIZE))
+    assert not sm.addSidecar("QmA", sidecar)
+    assert not os.path.exists(sidecar)
+    assert sm.current_size == used
+    assert sm.models().keys() == {"QmA"}
+
+def test_warm_lookups_do_not_wait_on_other_workers(daemon):
+    sm = manager(daemon, shared=True)
+    sm.get("QmA")
+    sm.digest("QmA")
+
+    # Another worker holds the index lock, so this one's cold miss waits on it
+    other = os.open(os.path.join("storage", "models", storage.INDEX_LOCK_FILE), os.O_RDWR)
+    fcntl.flock(other, fcntl.LOCK_EX)
+    try:
+        cold = threading.Thread(target=sm.get, args=("QmB",))
+        cold.start()
+        cold.join(0.2)
+        assert cold.is_alive()
+
+        assert sm.cached("QmA") is not None
+        with sm.lease("QmA"):
+            assert sm.get("QmA") is not None
+    finally:
+        fcntl.flock(other, fcntl.LOCK_UN)
+        os.close(other)
+    cold.join(10)
+    assert sm.models().keys() == {"QmA", "QmB"}
+
+def test_pinned_model_survives_eviction_and_restart(daemon):
+    sm = manager(daemon)
+    sm.capacity = MODEL_SIZE + MODEL_SIZE // 2
+    sm.get("QmA")
+    sm.pin("QmA")
+    with pytest.raises(RuntimeError, match="in use or pinned"):
+        sm.get("QmB")
+    assert sm.models().keys() == {"QmA"}
+
+    restarted = manager(daemon)
+    restarted.capacity = sm.capacity
+    assert restarted.pinned == {"QmA"}
+    with pytest.raises(RuntimeError, match="in use or pinned"):
+        restarted.get("QmB")
+
+    restarted.unpin("QmA")
+    restarted.get("QmB")
+    assert restarted.models().keys() == {"QmB"}
+    assert manager(daemon).pinned == set()
+
+def test_pins_apply_to_every_worker(daemon):
+    workers = [manager(daemon, shared=True) for _ in range(2)]
+    for worker in workers:
+        worker.capacity = MODEL_SIZE + MODEL_SIZE // 2
+    workers[0].get("QmA")
+    workers[1].pin("QmA")
+
+    with pytest.raises(RuntimeError, match="in use or pinned"):
+        workers[0].get("QmB")
+    assert workers[0].pinned == {"QmA"}
+
+    workers[1].unpin("QmA")
+    workers[0].get("QmB")
+    assert workers[0].models().keys() == {"QmB"}
+    assert workers[0].pinned == set()
@@ -0,0 +1,120 @@
+import os
+import struct
+import sys
+from collections import namedtuple
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import wire
+
+"""
+The /infer/binary tensor format: every dtype round-trips, and malformed messages are
+rejected before anything is allocated for them.
+"""
+
+NodeArg = namedtuple("NodeArg", ["name", "type"])
+
+def message(*tensors, hash_str: str = "QmTest") -> bytes:
+    return b"".join(bytes(chunk) for chunk in wire.encode(hash_str, list(tensors)))
+
+def header(name: str, dtype_code: int, shape: tuple, nbytes: int) -> bytes:
+    encoded = name.encode("utf-8")
+    return (struct.pack("<H", len(encoded)) + encoded + struct.pack("<BB", dtype_code, len(shape))
+            + b"".join(struct.pack("<Q", dim) for dim in shape) + struct.pack("<Q", nbytes))
+
+def raw(*tensors: bytes) -> bytes:
+    return wire.MAGIC + struct.pack("<H", 6) + b"QmTest" + struct.pack("<I", len(tensors)) + b"".join(tensors)
+
+@pytest.mark.parametrize("dtype_code", sorted(wire._onnx_dtypes))
+def test_round_trip(dtype_code):
+    dtype = wire._onnx_dtypes[dtype_code]
+    values = np.arange(24).reshape(2, 3, 4).astype(dtype)
+    scalar = np.asarray(values.flat[5], dtype=dtype)
+    empty = np.zeros((0, 3), dtype=dtype)
+
+    hash_str, tensors = wire.decode(message(("x", values), ("s", scalar), ("e", empty)))
+    assert hash_str == "QmTest"
+    for name, expected in (("x", values), ("s", scalar), ("e", empty)):
+        assert tensors[name].dtype == dtype
+        assert tensors[name].shape == expected.shape
+        assert tensors[name].tobytes() == expected.tobytes()
+
+def test_round_trip_big_endian_and_strided():
+    values = np.arange(12, dtype=">i4").reshape(3, 4)
+    _, tensors = wire.decode(message(("x", values), ("t", values.T)))
+    assert tensors["x"].dtype == np.dtype("<i4")
+    assert (tensors["x"] == values).all() and (tensors["t"] == values.T).all()
+
+def test_round_trip_strings():
+    values = np.array([["a", ""], ["héllo", "x" * 70000]], dtype=object)
+    _, tensors = wire.decode(message(("s", values), ("u", np.array(["one", "two"]))))
+    assert tensors["s"].dtype == np.object_ and tensors["s"].shape == (2, 2)
+    assert tensors["s"].tolist() == values.tolist()
+    assert tensors["u"].tolist() == ["one", "two"]
+
+def test_encoding_is_deterministic():
+    values = np.arange(6, dtype=np.float32).reshape(2, 3)
+    assert message(("x", values)) == message(("x", values.copy()))
+
+def test_bad_magic():
+    with pytest.raises(ValueError, match="bad magic"):
+        wire.decode(b"OGT2" + message(("x", np.zeros(1)))[4:])
+
+def test_truncated():
+    full = message(("x", np.arange(4, dtype=np.int64)), ("s", np.array(["ab"], dtype=object)))
+    for size in range(len(full)):
+        with pytest.raises(ValueError):
+            wire.decode(full[:size])
+
+def test_trailing_bytes():
+    with pytest.raises(ValueError, match="Trailing bytes"):
+        wire.decode(message(("x", np.zeros(2))) + b"\x00")
+    # Bytes past the string elements but within the tensor's nbytes
+    strings = struct.pack("<I", 1) + b"a" + b"\x00"
+    with pytest.raises(ValueError, match="trailing bytes"):
+        wire.decode(raw(header("s", wire.STRING_DTYPE, (1,), len(strings)) + strings))
+
+def test_duplicate_names():
+    with pytest.raises(ValueError, match="Duplicate tensor name"):
+        wire.decode(message(("x", np.zeros(1)), ("x", np.ones(1))))
+
+def test_nbytes_shape_mismatch():
+    data = np.zeros(4, dtype=np.float32).tobytes()
+    with pytest.raises(ValueError, match="expected shape"):
+        wire.decode(raw(header("x", 1, (5,), len(data)) + data))
+    with pytest.raises(ValueError, match="expected shape"):
+        wire.decode(raw(header("x", 1, (2, 1), len(data)) + data))
+
+def test_unsupported_dtype():
+    with pytest.raises(ValueError, match="Unsupported tensor dtype"):
+        wire.decode(raw(header("x", 16, (1,), 2) + b"\x00\x00"))
+    with pytest.raises(ValueError, match="Unsupported output dtype"):
+        wire.encode("QmTest", [("x", np.zeros(1, dtype=np.complex64))])
+
+def test_oversized_string_count():
+    # A shape claiming far more elements than the message holds fails before any allocation
+    strings = struct.pack("<I", 1) + b"a"
+    for shape in [(1 << 40,), (wire.MAX_STRING_ELEMENTS + 1,), (1 << 32, 1 << 32)]:
+        with pytest.raises(ValueError, match="more than"):
+            wire.decode(raw(header("s", wire.STRING_DTYPE, shape, len(strings)) + strings))
+    with pytest.raises(ValueError, match="needs at least"):
+        wire.decode(raw(header("s", wire.STRING_DTYPE, (1000,), len(strings)) + strings))
+
+def test_match_inputs():
+    _, tensors = wire.decode(message(("x", np.zeros((1, 2), dtype=np.float32)),
+                                     ("s", np.array(["a"], dtype=object)),
+                                     ("extra", np.zeros(1))))
+    inputs = wire.match_inputs([NodeArg("x", "tensor(float)"), NodeArg("s", "tensor(string)")], tensors)
+    assert list(inputs) == ["x", "s"]
+
+    with pytest.raises(ValueError, match="Input not found: y"):
+        wire.match_inputs([NodeArg("y", "tensor(float)")], tensors)
+    with pytest.raises(ValueError, match="model expects tensor\\(double\\)"):
+        wire.match_inputs([NodeArg("x", "tensor(double)")], tensors)
+    with pytest.raises(ValueError, match="model expects tensor\\(float\\)"):
+        wire.match_inputs([NodeArg("s", "tensor(float)")], tensors)
+    with pytest.raises(ValueError, match="model expects tensor\\(string\\)"):
+        wire.match_inputs([NodeArg("x", "tensor(string)")], tensors)
+    with pytest.raises(ValueError, match="model expects tensor\\(bfloat16\\)"):
+        wire.match_inputs([NodeArg("x", "tensor(bfloat16)")], tensors)
@@ -1,18 +1,33 @@
 import hashlib
+import logging
+import math
 import numpy as np
 import json
+import orjson
+from collections import namedtuple
+from functools import partial
 from typing import Union
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
+
+logger = logging.getLogger(__name__)
+
+class InvalidInput(ValueError):
+    pass
+
+# Read size for hashing model files
+HASH_BLOCK_SIZE = 4 << 20
 
 """
 Hash the ONNX model to serve as checksum 
 """
 def hash_model(filename: str) -> str:
     sha256_hash = hashlib.sha256()
-    with open(filename, "rb") as f:
-        # Read and update hash string value in blocks of 4K
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
+    buffer = bytearray(HASH_BLOCK_SIZE)
+    view = memoryview(buffer)
+    with open(filename, "rb", buffering=0) as f:
+        # Read into one reused buffer in large blocks, avoiding a bytes object per read
+        for size in iter(lambda: f.readinto(buffer), 0):
+            sha256_hash.update(view[:size])
     return sha256_hash.hexdigest()
 
 ### Copied from inference node ###
@@ -42,93 +57,271 @@ def convert_to_float(fixed_point_num: dict, input_type) -> Union[np.integer, np.
 Converts a fixed-point number to float64
 """
 def _convert_to_float64(fixed_point_num: dict) -> np.float64:
-    print("Convert to float64 value: ", fixed_point_num["value"])
-    print("Convert to float64 decimal: ", fixed_point_num["decimals"])
     return np.float64(Decimal(fixed_point_num["value"]) / Decimal(10 ** int(fixed_point_num["decimals"])))
 
 """
 Converts a fixed-point number to float32
 """
 def _convert_to_float32(fixed_point_num: dict) -> np.float32:
-    print("Convert to float32 value: ", fixed_point_num["value"])
-    print("Convert to float32 decimal: ", fixed_point_num["decimals"])
     return np.float32(Decimal(fixed_point_num["value"]) / Decimal(10 ** int(fixed_point_num["decimals"])))
 
 """
 Converts to fixed-point number to an int
 """
 def _convert_to_int(fixed_point_num: dict) -> np.integer:
-    print("Convert to int value: ", fixed_point_num["value"])
-    print("Convert to int decimal: ", fixed_point_num["decimals"])
     return np.int_(Decimal(fixed_point_num["value"]) / Decimal(10 ** int(fixed_point_num["decimals"])))
 
-supported_input_types_num = {
-    'tensor(float)',
-    'tensor(float64)',
-    'tensor(double)',
-}
+# Power-of-ten tables used to scale whole tensors at once. Float64 holds 10**d exactly
+# for every d up to DECIMAL_LIMIT, so dividing an exactly representable value by it
+# gives the same correctly rounded result as the Decimal path.
+_POW10_DECIMAL = [Decimal(10 ** d) for d in range(DECIMAL_LIMIT + 1)]
+_POW10_FLOAT64 = np.array([10.0 ** d for d in range(DECIMAL_LIMIT + 1)], dtype=np.float64)
+_POW10_INT64 = np.array([10 ** d for d in range(DECIMAL_LIMIT + 1)], dtype=np.int64)
+
+# Largest magnitude an int64 fixed-point value can have to convert to float64 exactly
+_FLOAT64_EXACT_LIMIT = 2 ** 53
 
-supported_input_types_string = {
-    'tensor(string)'
+_onnx_num_dtypes = {
+    'tensor(float)': np.float32,
+    'tensor(double)': np.float64,
+    'tensor(float64)': np.float64,
+    'tensor(int8)': np.int8,
+    'tensor(int16)': np.int16,
+    'tensor(int32)': np.int32,
+    'tensor(int64)': np.int64,
+    'tensor(uint8)': np.uint8,
+    'tensor(uint16)': np.uint16,
+    'tensor(uint32)': np.uint32,
+    'tensor(uint64)': np.uint64,
 }
 
 """
-Converts number and string input lists into dictionary usable as ONNX input
+Returns the NumPy dtype a fixed-point tensor decodes to for the given ONNX input type
 """
-def convert_to_onnx_input(session_inputs: list, model_input: str) -> dict:
-    inputs = {}
+def _onnx_num_dtype(input_type: str) -> np.dtype:
+    if input_type in _onnx_num_dtypes:
+        return np.dtype(_onnx_num_dtypes[input_type])
+    elif input_type.startswith('tensor(int') or input_type.startswith('tensor(uint'):
+        return np.dtype(np.int_)
+    raise TypeError("Unsupported input type: %s " % input_type)
 
-    # Convert model input into JSON dict
-    model_input_dict = json.loads(model_input)
-    print("JSON inputs: ", model_input_dict)
-
-    # Convert number inputs to dict based on name
-    num_inputs = {}
-    if "numbers" in model_input_dict:
-        num_inputs = {
-            number_tensor["name"]: number_tensor
-            for number_tensor in model_input_dict["numbers"]
-        }
-    print("Num inputs: ", num_inputs)
-
-    # Convert string inputs to dict based on name
-    string_inputs = {}
-    if "strings" in model_input_dict:
-        string_inputs = {
-            string_input["name"]: string_input
-            for string_input in model_input_dict["strings"]
-        }
-    print("string inputs: ", string_inputs)
+"""
+Parses a list of JSON integers / integer strings into an int64 array, None if any
+entry is not an integer that fits in int64.
+"""
+def _parse_int64(items: list) -> Union[np.ndarray, None]:
+    try:
+        parsed = np.array(items)
+        if parsed.dtype.kind == 'U':
+            return parsed.astype(np.int64)
+        elif parsed.dtype.kind == 'i':
+            return parsed.astype(np.int64, copy=False)
+    except (ValueError, OverflowError):
+        pass
+    return None
 
-    inputs = {}
+"""
+Decodes a flat list of fixed-point numbers into an array of the ONNX input's dtype.
+
+Produces the same values as calling convert_to_float on each element, but scales the
+whole tensor with NumPy when every value fits in int64 (and in the float64 mantissa for
+float targets). Anything else falls back to exact Decimal arithmetic per element.
+"""
+def decode_fixed_point(fixed_point_nums: list, input_type: str) -> np.ndarray:
+    return _decode_fixed_point(fixed_point_nums, _onnx_num_dtype(input_type))
+
+def _decode_fixed_point(fixed_point_nums: list, dtype: np.dtype) -> np.ndarray:
+    raw_values = [num["value"] for num in fixed_point_nums]
+    raw_decimals = [num["decimals"] for num in fixed_point_nums]
+
+    decimals = _parse_int64(raw_decimals)
+    if decimals is None:
+        decimals = np.array([int(d) for d in raw_decimals], dtype=object)
+
+    # Check limit for decimal based on float64 precision
+    over_limit = np.flatnonzero(decimals > DECIMAL_LIMIT)
+    if over_limit.size > 0:
+        raise ValueError("Decimal value greater than precision limit: %s" % raw_decimals[over_limit[0]])
+
+    if len(fixed_point_nums) == 0:
+        return np.array([], dtype=dtype)
+
+    values = _parse_int64(raw_values)
+    if values is not None and decimals.dtype == np.int64 and decimals.min() >= 0:
+        # Uniform decimals scale by a single power of ten, otherwise index the table
+        scale = decimals[0] if np.all(decimals == decimals[0]) else decimals
+
+        if dtype.kind == 'f':
+            if np.abs(values).max() <= _FLOAT64_EXACT_LIMIT:
+                scaled = values.astype(np.float64) / _POW10_FLOAT64[scale]
+                return scaled.astype(dtype, copy=False)
+        else:
+            # Integer division truncating toward zero, as int(Decimal) does
+            divisor = _POW10_INT64[scale]
+            scaled = values // divisor
+            scaled += (values < 0) & (values % divisor != 0)
+            return _cast_int(scaled, dtype)
+
+    return _decode_exact(raw_values, decimals, dtype)
+
+"""
+Per-element Decimal decoding for values that don't fit the vectorized fast path
+"""
+def _decode_exact(raw_values: list, decimals: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    scaled = np.empty(len(raw_values), dtype=object)
+    for i, (value, decimal) in enumerate(zip(raw_values, decimals.tolist())):
+        divisor = _POW10_DECIMAL[decimal] if decimal >= 0 else Decimal(10 ** decimal)
+        scaled[i] = Decimal(value) / divisor
+
+    if dtype.kind == 'f':
+        return np.array([float(number) for number in scaled], dtype=np.float64).astype(dtype, copy=False)
+    return _cast_int(np.array([int(number) for number in scaled], dtype=object), dtype)
+
+"""
+Casts decoded integers to the target dtype, rejecting values that would wrap around
+"""
+def _cast_int(scaled: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    limits = np.iinfo(dtype)
+    if scaled.min() < limits.min or scaled.max() > limits.max:
+        raise OverflowError("Input value out of range for %s" % dtype)
+    return scaled.astype(dtype)
+
+# ONNX session type string -> NumPy dtype, for building tensors from model metadata
+onnx_dtypes = dict(_onnx_num_dtypes, **{
+    'tensor(bool)': np.bool_,
+    'tensor(float16)': np.float16,
+    'tensor(string)': np.object_,
+})
+
+"""
+Decodes a flat list of JSON strings into a string tensor
+"""
+def decode_strings(values: list) -> np.ndarray:
+    array = np.array(values)
+    if array.size == 0:
+        return array.astype(np.str_)
+    if array.ndim != 1 or array.dtype.kind != 'U':
+        raise ValueError("String values must be a flat list of strings")
+    return array
+
+# One model input as compiled at session load: its ONNX type, the NumPy dtype it is
+# built as (None if unknown), its dims as declared by the model (ints are static,
+# strings or None symbolic, None for all of them if the rank is unknown), and the
+# function decoding the flat JSON values into that dtype (None if JSON can't carry it)
+InputSpec = namedtuple("InputSpec", ["name", "type", "dtype", "dims", "decode"])
+
+"""
+Compiles session inputs into the plan convert_to_onnx_input checks and decodes requests
+with, so the per-type decisions are made once per model rather than once per request.
+"""
+def compile_inputs(session_inputs: list) -> tuple:
+    plan = []
     for session_input in session_inputs:
-        print("Session Input: ", session_input)
-        
-        if session_input.name in num_inputs:
-            # Check if we support this input type for number tensor
-            if session_input.type not in supported_input_types_num and not session_input.type.startswith('tensor(int') and not not session_input.type.startswith('tensor(uint'):
-                print("Unexpected input type provided: ", session_input.type)
+        if session_input.type == 'tensor(string)':
+            decode = decode_strings
+        elif session_input.type in _onnx_num_dtypes or session_input.type.startswith(('tensor(int', 'tensor(uint')):
+            decode = partial(_decode_fixed_point, dtype=_onnx_num_dtype(session_input.type))
+        else:
+            logger.warning("Input %s has type %s, which JSON requests can't provide", session_input.name, session_input.type)
+            decode = None
 
-            num_input = num_inputs[session_input.name]
-            flattened_input = np.array([convert_to_float(num, session_input.type) for num in num_input["values"]])
-            input_tensor = flattened_input.reshape(num_input["shape"])
+        dtype = onnx_dtypes.get(session_input.type)
+        # onnxruntime reports an input of unknown rank with an empty shape, same as a scalar
+        dims = tuple(session_input.shape) if session_input.shape else None
+        plan.append(InputSpec(session_input.name, session_input.type, np.dtype(dtype) if dtype is not None else None, dims, decode))
+    return tuple(plan)
 
-        elif session_input.name in string_inputs:
-            # Check if we support this input type for string tensor
-            if session_input.type not in supported_input_types_string:
-                print("Unexpected input type provided: ", session_input.type)
+def _format_dims(dims: tuple) -> str:
+    return "[%s]" % ", ".join("?" if dim is None else str(dim) for dim in dims)
 
-            str_input = string_inputs[session_input.name]
-            flattened_input = np.array(str_input["values"])
-            input_tensor = flattened_input.reshape(str_input["shape"])
+"""
+Rejects a request shape that isn't a list of sizes matching the rank and static dims
+the model declares for the input
+"""
+def check_shape(spec: InputSpec, shape) -> None:
+    if not isinstance(shape, (list, tuple)) or not all(type(size) is int and size >= 0 for size in shape):
+        raise InvalidInput("Input %s shape must be a list of non-negative integers, got %s" % (spec.name, shape))
+    if spec.dims is None:
+        return
+    if len(shape) != len(spec.dims) or any(type(dim) is int and 0 <= dim != size for dim, size in zip(spec.dims, shape)):
+        raise InvalidInput("Input %s has shape %s, model expects %s" % (spec.name, list(shape), _format_dims(spec.dims)))
 
+"""
+Checks the shapes of already decoded input tensors, e.g. from the binary format
+"""
+def check_shapes(plan: tuple, tensors: dict) -> None:
+    for spec in plan:
+        if spec.name in tensors:
+            check_shape(spec, tensors[spec.name].shape)
+
+"""
+Converts number and string input lists into dictionary usable as ONNX input, following
+the model's compiled input plan. Requests with missing inputs, shapes the model doesn't
+accept or values that don't decode are rejected with InvalidInput before any tensor is
+built for onnxruntime.
+"""
+def convert_to_onnx_input(plan: tuple, model_input: str) -> dict:
+    # Convert model input into JSON dict
+    try:
+        model_input_dict = json.loads(model_input)
+    except ValueError as e:
+        raise InvalidInput("Model inputs are not valid JSON: %s" % e)
+    logger.debug("JSON inputs: %s", model_input_dict)
+
+    try:
+        # Number and string inputs by name
+        num_inputs = {number_tensor["name"]: number_tensor for number_tensor in model_input_dict.get("numbers", ())}
+        string_inputs = {string_input["name"]: string_input for string_input in model_input_dict.get("strings", ())}
+    except (AttributeError, KeyError, TypeError):
+        raise InvalidInput("Model inputs must be an object of named \"numbers\" and \"strings\" tensors")
+
+    inputs = {}
+    for spec in plan:
+        if spec.name in num_inputs:
+            tensor, strings = num_inputs[spec.name], False
+        elif spec.name in string_inputs:
+            tensor, strings = string_inputs[spec.name], True
         else:
-            raise RuntimeError("Input not found: %s" % session_input.name)
-        
-        print("Input Tensor: ", input_tensor)
-        inputs[session_input.name] = input_tensor
+            raise InvalidInput("Input not found: %s" % spec.name)
+
+        if spec.decode is None:
+            raise InvalidInput("Input %s has unsupported type %s" % (spec.name, spec.type))
+        if strings != (spec.decode is decode_strings):
+            raise InvalidInput("Input %s of type %s given as %s" % (spec.name, spec.type, "strings" if strings else "numbers"))
+
+        try:
+            shape, values = tensor["shape"], tensor["values"]
+        except (KeyError, TypeError):
+            raise InvalidInput("Input %s needs a shape and values" % spec.name)
+        check_shape(spec, shape)
+        if not isinstance(values, list) or len(values) != math.prod(shape):
+            raise InvalidInput("Input %s has %s values, shape %s needs %d" % (spec.name, len(values) if isinstance(values, list) else "no list of", shape, math.prod(shape)))
 
-    print("Model input: ", inputs)
+        try:
+            inputs[spec.name] = spec.decode(values).reshape(shape)
+        except InvalidOperation:
+            raise InvalidInput("Input %s has values that aren't fixed-point numbers" % spec.name)
+        except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+            raise InvalidInput("Input %s: %s" % (spec.name, e))
+
+    logger.debug("Model input: %s", inputs)
+    return inputs
+
+"""
+Builds zero-filled ONNX inputs shaped from the session inputs, with symbolic dimensions
+set to 1. Used to warm up a session before its first real request.
+"""
+def zero_inputs(session_inputs: list) -> dict:
+    inputs = {}
+    for session_input in session_inputs:
+        if session_input.type not in onnx_dtypes:
+            raise TypeError("Unsupported input type: %s " % session_input.type)
+
+        shape = [dim if isinstance(dim, int) and dim >= 0 else 1 for dim in session_input.shape]
+        if session_input.type == 'tensor(string)':
+            inputs[session_input.name] = np.full(shape, "", dtype=np.object_)
+        else:
+            inputs[session_input.name] = np.zeros(shape, dtype=onnx_dtypes[session_input.type])
     return inputs
 
 """
@@ -138,7 +331,7 @@ def serialize_onnx_output(session_outputs: list, results: list) -> list:
     output = []
 
     for i, session_output in enumerate(session_outputs):
-        print("Processing session output: ", session_output)
+        logger.debug("Processing session output: %s", session_output)
         output_dict = {}
         result = results[i]
 
@@ -156,16 +349,59 @@ def serialize_onnx_output(session_outputs: list, results: list) -> list:
             
         # Type is simply whether or not it's a number or string tensor. Inference node will
         # convert to fixed point afterwards.
-        if issubclass(result.dtype.type, np.floating) or issubclass(result.dtype.type, np.integer):
-            output_dict["type"] = "number"
-        elif result.dtype == np.object_ and isinstance(result.flatten()[0], str):
-            output_dict["type"] = "string"
-        else:
-            raise RuntimeError("Output type not found: %s" % session_output.type)
+        output_dict["type"] = _output_type(session_output, result)
         
-        print("Adding output dict: ", output_dict)
+        logger.debug("Adding output dict: %s", output_dict)
         output.append(output_dict)
     
-    print("Returning inference output: ", output_dict)
+    logger.debug("Returning inference output: %s", output)
     return output
-    
+
+"""
+Whether an output is a number or string tensor, from its dtype and the session's declared
+type. Only looks at the first element, never copies the result.
+"""
+def _output_type(session_output, result: np.ndarray) -> str:
+    if issubclass(result.dtype.type, np.floating) or issubclass(result.dtype.type, np.integer):
+        return "number"
+    if result.dtype == np.object_:
+        if result.size > 0 and isinstance(result.flat[0], str):
+            return "string"
+        if result.size == 0 and session_output.type == 'tensor(string)':
+            return "string"
+    raise RuntimeError("Output type not found: %s" % session_output.type)
+
+"""
+Same outputs as serialize_onnx_output, but number results stay C-contiguous arrays that
+json_dumps writes straight from their buffers instead of expanding them into Python lists.
+Floats are widened to float64 so they print the same values as the list path does.
+"""
+def encode_onnx_output(session_outputs: list, results: list) -> list:
+    output = []
+
+    for session_output, result in zip(session_outputs, results):
+        if not isinstance(result, np.ndarray):
+            try:
+                result = np.array(result)
+            except Exception as e:
+                raise RuntimeError("Failed to convert output to numpy array: %s" % e)
+
+        output_type = _output_type(session_output, result)
+        if output_type == "string" or result.ndim == 0:
+            values = result.tolist()
+        elif issubclass(result.dtype.type, np.floating):
+            values = np.ascontiguousarray(result, dtype=np.float64)
+            if not np.isfinite(values).all():
+                # Same as the standard JSON encoder, NaN and infinity aren't valid JSON
+                raise ValueError("Out of range float values are not JSON compliant")
+        else:
+            values = np.ascontiguousarray(result)
+
+        output.append({"name": session_output.name, "shape": result.shape, "result": values, "type": output_type})
+    return output
+
+"""
+Encode to compact JSON bytes with orjson, writing NumPy arrays from their buffers.
+"""
+def json_dumps(content) -> bytes:
+    return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
@@ -1,15 +1,20 @@
 import base64
 import cbor2
-import cose
+import hashlib
 import json
 import logging
+import threading
+import time
 from collections import namedtuple
-import subprocess
-import sys
-import hashlib
-
-from cose import EC2, CoseAlgorithms, CoseEllipticCurves
-from Crypto.Util.number import long_to_bytes
+from concurrent.futures import ProcessPoolExecutor
+
+import requests
+import urllib3
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
 from OpenSSL import crypto
 
 measurement_path = "measurements.txt"					# Fill this with path to PCR measurements
@@ -17,99 +22,86 @@ root_cert_path = "aws_root_cert.pem" 					# Root Cert given by AWS
 enclave_url = "https://<INSERT_TEE_IP_HERE>/enclave/attestation"	# Enclave attestation URl
 nonce = "0123456789abcdef0123456789abcdef01234567"  			# User set Nonce
 
-logging.basicConfig(
-    filename='verification_logs.log',
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+logger = logging.getLogger(__name__)
 
 PCR_tuple = namedtuple("PCRs", ["PCR0", "PCR1", "PCR2"])
 
-# This library is based on richardfan1126: nitro-enclave-python-demo 
+# What a verified attestation document says about the enclave
+Attestation = namedtuple("Attestation", ["pcrs", "nonce", "timestamp", "user_data", "tls_key_hash", "app_key_hash", "public_key"])
+
+# COSE algorithm id of ECDSA with SHA-384, the only one the Nitro Secure Module signs with
+COSE_ES384 = -35
+
+# Most validated certificate chains remembered by a verifier, expired ones dropped first
+CHAIN_CACHE_ENTRIES = 1024
+
+# Documents sent to a pool worker at a time by verify_many
+VERIFY_CHUNK_SIZE = 16
+
+class AttestationError(Exception):
+    """
+    The attestation document is malformed, or doesn't prove what it should.
+    """
+
+# This library is based on richardfan1126: nitro-enclave-python-demo
 # (https://github.com/richardfan1126/nitro-enclave-python-demo/tree/master)
-def get_pcrs() -> PCR_tuple:
+def get_pcrs(path: str = None) -> PCR_tuple:
     """
     Gets expected PCR values from enclave measurements JSON, returns a tuple of the PCR values.
     """
-    with open(measurement_path, 'r') as file:
+    with open(path or measurement_path, 'r') as file:
         json_measurement_data = file.read()
 
     try:
         measurement_data = json.loads(json_measurement_data)
+        # nitro-cli describe-enclaves prints a list with one entry per enclave
+        if isinstance(measurement_data, list):
+            measurement_data = measurement_data[0]
         PCRs = PCR_tuple(measurement_data["Measurements"]["PCR0"],
                          measurement_data["Measurements"]["PCR1"],
                          measurement_data["Measurements"]["PCR2"])
-        logging.debug("Given PCR measurements:\n"
-                      "PCR0 %s\n"
-                      "PCR1 %s\n"
-                      "PCR2 %s\n",
-                      PCRs.PCR0,
-                      PCRs.PCR1,
-                      PCRs.PCR2)
+        logger.debug("Given PCR measurements:\n"
+                     "PCR0 %s\n"
+                     "PCR1 %s\n"
+                     "PCR2 %s\n",
+                     PCRs.PCR0,
+                     PCRs.PCR1,
+                     PCRs.PCR2)
     except json.JSONDecodeError as e:
         raise ValueError("Error reading measurement file for PCRs: %s" % e)
-    
+
     return PCRs
 
-def get_root_cert_pem() -> str:
-    with open(root_cert_path, 'r') as file:
+def get_root_cert_pem(path: str = None) -> str:
+    with open(path or root_cert_path, 'r') as file:
         return file.read()
 
+_session = None
+
 def get_attestation(url: str, nonce: str) -> str:
-    # Construct curl command
-    curl_command = [
-        "curl",
-        "-k",
-        "-G",
-        url,
-        "--data-urlencode",
-        f"nonce={nonce}"
-    ]
-
-    # Run the curl command and capture the output
-    result = subprocess.run(curl_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-
-    # Check if the command was successful
-    if result.returncode != 0:
-        print(f"Error: {result.stderr}")
-        return None
+    """
+    Fetch an attestation document from a node over a kept-alive HTTPS connection.
+    Nitriding serves a self-signed certificate, so it isn't checked, the same as curl -k.
+    """
+    global _session
+    if _session is None:
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        _session = requests.Session()
+        _session.verify = False
 
-    # Return the output of the curl command
-    if result.stdout == None:
-        print(f"Curl command result was None")
+    try:
+        response = _session.get(url, params={"nonce": nonce}, timeout=30)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        print(f"Error: {e}")
+        return None
 
-    return result.stdout
+    return response.text
 
-def verify_attestation_doc(attestation_string: str) -> None:
+def parse_user_data(user_data: bytes) -> tuple:
     """
-    Verify the attestation document
-
-    This uses the expected PCR values stored in measurements.txt,
-    and the root_cert_pem provided by AWS Nitro Attestation PKI.
-
-    If invalid, raise an exception
+    (tlsKeyHash, appKeyHash) from nitriding's user data, two SHA-256 multihashes.
     """
-    # Load in PCR and root cert pem
-    logging.debug("Loading expected PCR values and root cert pem")
-    expected_pcrs = get_pcrs()
-    root_cert_pem = get_root_cert_pem()
-
-    # Decode CBOR attestation document
-    decoded_data = base64.b64decode(attestation_string)
-    data = cbor2.loads(decoded_data)
-
-    # Load and decode document payload
-    doc = data[2]
-    doc_obj = cbor2.loads(doc)
-    logging.debug("Loaded an attestation document")
-
-    # Get PCRs from attestation document
-    document_pcrs_arr = doc_obj['pcrs']
-
-    # Expose user data
-    user_data = doc_obj['user_data']
-    logging.debug("Enclave generated user data: %s", user_data)
     prefix_length = 2  # Taken from Nitriding documentation
     hash_length = hashlib.sha256().digest_size  # 32 bytes for a SHA256 hash
 
@@ -123,112 +115,221 @@ def verify_attestation_doc(attestation_string: str) -> None:
     app_key_end = app_key_start + hash_length
     app_key_hash = user_data[app_key_start:app_key_end]
 
-    logging.info("Enclave returned TLS key: %s", base64.b64encode(tls_key_hash).decode('utf-8'))
-    logging.info("Enclave returned app key: %s", base64.b64encode(app_key_hash).decode('utf-8'))
-
-    # Expose public key
-    # TODO (kyle):  Write API to expose public key to inference node
-    #               This will be needed for the sequencer to encrypt
-    #               input data.
-    public_key = doc_obj['public_key']
-    logging.debug("Enclave generated public key: %s", public_key)
-
-    ## Validating Attestation document ##
-    # 1. Validate PCRs and Nonce
-    logging.debug("Validating PCRs")
-    for index, expected_pcr in enumerate(expected_pcrs):
-        # Attestation document doesn't have specified PCR, raise exception
-        if index not in document_pcrs_arr or document_pcrs_arr[index] is None:
-            raise Exception("PCR%s not found" % index)
-
-        # Get PCR hexcode
-        doc_pcr = document_pcrs_arr[index].hex()
-        logging.debug("PCR%s:\n"
-                      "Attestation value: %s\n"
-                      "Expected PCR: %s",
-                      index,
-                      doc_pcr,
-                      expected_pcr)
-
-        # Check if PCR match
-        if expected_pcr != doc_pcr:
-            logging.warn("PCRs do not match:\n"
-                         "Attestation PCR%s: %s\n"
-                         "Expected PCR%s: %s",
-                         index, doc_pcr,
-                         index, expected_pcr)
-            raise Exception("PCR%s does not match" % index)
-
-    logging.debug("Validating nonce")
-    # Check that nonce matches
-    attestation_nonce = doc_obj['nonce'].hex()
-    logging.info("Received nonce is %s", attestation_nonce)
-    logging.info("Given nonce is %s", nonce)
-    if attestation_nonce != nonce:
-        raise Exception(f"Attestation nonce: {attestation_nonce}, did not match given nonce: {nonce}")
-
-    # 2. Validate Signature 
-    logging.debug("Validating signature of attestation document")
-    # Get signing certificate from attestation document
-    logging.debug("Getting signing certificate from attestation document:\n %s", doc_obj['certificate'])
-    cert = crypto.load_certificate(crypto.FILETYPE_ASN1, doc_obj['certificate'])
-
-    # Get the key parameters from the cert public key
-    logging.debug("Creating EC2 key from the signing certificates public key")
-    cert_public_numbers = cert.get_pubkey().to_cryptography_key().public_numbers()
-    x = cert_public_numbers.x
-    y = cert_public_numbers.y
-    curve = cert_public_numbers.curve
-
-    x = long_to_bytes(x)
-    y = long_to_bytes(y)
-
-    # Create the EC2 key from public key parameters
-    key = EC2(alg = CoseAlgorithms.ES384, x = x, y = y, crv = CoseEllipticCurves.P_384)
-
-    # Get the protected header from attestation document
-    phdr = cbor2.loads(data[0])
-
-    # Construct the Sign1 message
-    logging.debug("Constructing Sign1 message from the attestation document")
-    msg = cose.Sign1Message(phdr = phdr, uhdr = data[1], payload = doc)
-    msg.signature = data[3]
-
-    # Verify the signature using the EC2 key
-    logging.debug("Comparing EC2 key against the Sign1")
-    if not msg.verify_signature(key):
-        raise Exception("Wrong signature")
-    logging.debug("Signature of attestation document verified")
-
-    # 3. Validate signing certificate PKI
-    logging.debug("Verifying the certificate of the attestation document "
-                  "is signed by the root certificate of the AWS Nitro Attestation PKI")
-    if root_cert_pem is not None:
-        # Create an X509Store object for the CA bundles
-        store = crypto.X509Store()
-
-        # Create the CA cert object from PEM string, and store into X509Store
-        _cert = crypto.load_certificate(crypto.FILETYPE_PEM, root_cert_pem)
-        store.add_cert(_cert)
-
-        # Get the CA bundle from attestation document and store into X509Store
-        # Except the first certificate, which is the root certificate
-        for _cert_binary in doc_obj['cabundle'][1:]:
-            _cert = crypto.load_certificate(crypto.FILETYPE_ASN1, _cert_binary)
-            store.add_cert(_cert)
-
-        # Get the X509Store context
-        store_ctx = crypto.X509StoreContext(store, cert)
-        
-        # Validate the certificate
-        # If the cert is invalid, it will raise exception
-        store_ctx.verify_certificate()
-        logging.debug("Certificate verified by AWS Nitro Attestation PKI")
+    return tls_key_hash, app_key_hash
+
+class AttestationVerifier():
+    def __init__(self, measurement_path: str = measurement_path, root_cert_path: str = root_cert_path, max_chains: int = CHAIN_CACHE_ENTRIES):
+        """
+        Verifies attestation documents against the expected PCRs and the AWS Nitro root
+        certificate, both loaded once.
+
+        Nodes sign with short-lived certificates issued by intermediates that many
+        documents share. Once an intermediate chain has been validated up to the root,
+        the certificate that issues signing certificates is remembered until the first
+        certificate in the chain expires. Documents with a known chain only check their
+        signing certificate against that issuer, without parsing the cabundle or
+        building an X509Store, and signing certificates already checked are remembered
+        too, leaving the document's own signature as the only check per document.
+
+        Thread-safe. verify_many spreads documents over a process pool, which is
+        started on first use and kept until close().
+        """
+        self.measurement_path = measurement_path
+        self.root_cert_path = root_cert_path
+        self.max_chains = max_chains
+        self.expected_pcrs = [bytes.fromhex(pcr) for pcr in get_pcrs(measurement_path)]
+        root_cert_pem = get_root_cert_pem(root_cert_path)
+        self.root = crypto.load_certificate(crypto.FILETYPE_PEM, root_cert_pem)
+        self.root_expires = x509.load_pem_x509_certificate(root_cert_pem.encode()).not_valid_after_utc.timestamp()
+        self.store = crypto.X509Store()
+        self.store.add_cert(self.root)
+        # sha256 of the intermediates' DER -> (issuing certificate, expiry timestamp)
+        self.chains = {}
+        # sha256 of the chain key and signing certificate's DER -> (signing certificate, expiry timestamp)
+        self.signers = {}
+        self.lock = threading.Lock()
+        self.pool = None
+        self.processes = None
+
+    def verify(self, attestation_string: str, nonce: str = None) -> Attestation:
+        """
+        Verify a base64 attestation document and return what it attests. If nonce is
+        given, it must match the document's nonce, hex encoded.
+
+        If invalid, raise AttestationError
+        """
+        # Decode CBOR attestation document
+        try:
+            data = cbor2.loads(base64.b64decode(attestation_string))
+            phdr, _uhdr, doc, signature = data
+            doc_obj = cbor2.loads(doc)
+            document_pcrs_arr = doc_obj['pcrs']
+            user_data = doc_obj.get('user_data') or b""
+            attestation_nonce = (doc_obj.get('nonce') or b"").hex()
+            cert_der = doc_obj['certificate']
+            cabundle = doc_obj['cabundle']
+        except (ValueError, TypeError, KeyError, cbor2.CBORDecodeError) as e:
+            raise AttestationError("Malformed attestation document: %s" % e)
+
+        ## Validating Attestation document ##
+        # 1. Validate PCRs and Nonce
+        for index, expected_pcr in enumerate(self.expected_pcrs):
+            # Attestation document doesn't have specified PCR, raise exception
+            if index not in document_pcrs_arr or document_pcrs_arr[index] is None:
+                raise AttestationError("PCR%s not found" % index)
+
+            # Check if PCR match
+            if expected_pcr != document_pcrs_arr[index]:
+                logger.warning("PCRs do not match:\n"
+                               "Attestation PCR%s: %s\n"
+                               "Expected PCR%s: %s",
+                               index, document_pcrs_arr[index].hex(),
+                               index, expected_pcr.hex())
+                raise AttestationError("PCR%s does not match" % index)
+
+        if nonce is not None and attestation_nonce != nonce:
+            raise AttestationError(f"Attestation nonce: {attestation_nonce}, did not match given nonce: {nonce}")
+
+        # 2. Validate signing certificate PKI
+        try:
+            cert = x509.load_der_x509_certificate(cert_der)
+        except ValueError as e:
+            raise AttestationError("Invalid signing certificate: %s" % e)
+        self._verifyCertificate(cert, cert_der, cabundle)
+
+        # 3. Validate Signature
+        try:
+            if cbor2.loads(phdr).get(1) != COSE_ES384:
+                raise AttestationError("Attestation document is not signed with ES384")
+        except (ValueError, AttributeError, cbor2.CBORDecodeError) as e:
+            raise AttestationError("Malformed protected header: %s" % e)
+
+        # COSE_Sign1 signs the Sig_structure, and the signature is r || s, not DER
+        sig_structure = cbor2.dumps(["Signature1", phdr, b"", doc])
+        half = len(signature) // 2
+        der_signature = encode_dss_signature(int.from_bytes(signature[:half], "big"), int.from_bytes(signature[half:], "big"))
+        try:
+            cert.public_key().verify(der_signature, sig_structure, ec.ECDSA(hashes.SHA384()))
+        except (InvalidSignature, TypeError):
+            raise AttestationError("Wrong signature")
+
+        tls_key_hash, app_key_hash = parse_user_data(user_data)
+        return Attestation(pcrs=document_pcrs_arr, nonce=attestation_nonce, timestamp=doc_obj.get('timestamp'),
+                           user_data=user_data, tls_key_hash=tls_key_hash, app_key_hash=app_key_hash,
+                           public_key=doc_obj.get('public_key'))
+
+    def verify_many(self, attestations: list, nonces: list = None, processes: int = None) -> list:
+        """
+        Verify many documents in parallel over a process pool, nonces optionally giving
+        each document's expected nonce. Returns, in order, the Attestation for each
+        valid document and the AttestationError for each invalid one.
+        """
+        if nonces is None:
+            nonces = [None] * len(attestations)
+        if self.pool is None or (processes is not None and processes != self.processes):
+            self.close()
+            self.pool = ProcessPoolExecutor(max_workers=processes, initializer=_initWorker,
+                                            initargs=(self.measurement_path, self.root_cert_path, self.max_chains))
+            self.processes = processes
+        return list(self.pool.map(_verifyInWorker, attestations, nonces, chunksize=VERIFY_CHUNK_SIZE))
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def _verifyCertificate(self, cert: x509.Certificate, cert_der: bytes, cabundle: list) -> None:
+        now = time.time()
+        if not cert.not_valid_before_utc.timestamp() <= now <= cert.not_valid_after_utc.timestamp():
+            raise AttestationError("Signing certificate is not valid now")
+
+        # The first certificate of the bundle is the root, which is pinned instead
+        intermediates = cabundle[1:]
+        if not intermediates:
+            raise AttestationError("Attestation document has no intermediate certificates")
+        chain_key = hashlib.sha256(b"".join(intermediates)).digest()
+        # An enclave signs all its documents with the same certificate
+        signer_key = hashlib.sha256(chain_key + cert_der).digest()
+        with self.lock:
+            signer = self.signers.get(signer_key)
+            chain = self.chains.get(chain_key)
+        if signer is not None and now < signer[1]:
+            return
+
+        if chain is not None and now < chain[1]:
+            try:
+                cert.verify_directly_issued_by(chain[0])
+            except (ValueError, TypeError, InvalidSignature) as e:
+                raise AttestationError("Signing certificate was not issued by its cabundle: %s" % e)
+            expires = chain[1]
+        else:
+            # Unknown or expired chain, validate it in full up to the root
+            try:
+                chain_certs = [crypto.load_certificate(crypto.FILETYPE_ASN1, _cert_binary) for _cert_binary in intermediates]
+                store_ctx = crypto.X509StoreContext(self.store, crypto.load_certificate(crypto.FILETYPE_ASN1, cert_der), chain=chain_certs)
+                # If the cert is invalid, it will raise exception
+                store_ctx.verify_certificate()
+            except (crypto.Error, crypto.X509StoreContextError) as e:
+                raise AttestationError("Certificate not verified by AWS Nitro Attestation PKI: %s" % e)
+
+            issuers = [x509.load_der_x509_certificate(_cert_binary) for _cert_binary in intermediates]
+            expires = min([self.root_expires] + [issuer.not_valid_after_utc.timestamp() for issuer in issuers])
+            self._remember(self.chains, chain_key, (issuers[-1], expires), now)
+            logger.debug("Verified certificate chain %s, valid until %s", chain_key.hex(), expires)
+
+        self._remember(self.signers, signer_key, (cert, min(expires, cert.not_valid_after_utc.timestamp())), now)
+
+    def _remember(self, cache: dict, key: bytes, value, now: float) -> None:
+        with self.lock:
+            if len(cache) >= self.max_chains:
+                expired = [k for k, (_, expires) in cache.items() if expires <= now]
+                for stale in expired or [next(iter(cache))]:
+                    del cache[stale]
+            cache[key] = value
+
+_worker_verifier = None
+
+def _initWorker(measurement_path: str, root_cert_path: str, max_chains: int) -> None:
+    global _worker_verifier
+    _worker_verifier = AttestationVerifier(measurement_path, root_cert_path, max_chains)
+
+def _verifyInWorker(attestation_string: str, nonce: str):
+    try:
+        return _worker_verifier.verify(attestation_string, nonce)
+    except AttestationError as e:
+        return e
+
+_default_verifier = None
+
+def verify_attestation_doc(attestation_string: str) -> Attestation:
+    """
+    Verify the attestation document
+
+    This uses the expected PCR values stored in measurements.txt,
+    and the root_cert_pem provided by AWS Nitro Attestation PKI,
+    both loaded on the first call.
+
+    If invalid, raise an exception
+    """
+    global _default_verifier
+    if _default_verifier is None:
+        logger.debug("Loading expected PCR values and root cert pem")
+        _default_verifier = AttestationVerifier()
+
+    attestation = _default_verifier.verify(attestation_string, nonce)
+    logger.info("Enclave returned TLS key: %s", base64.b64encode(attestation.tls_key_hash).decode('utf-8'))
+    logger.info("Enclave returned app key: %s", base64.b64encode(attestation.app_key_hash).decode('utf-8'))
 
     print("Verification successful")
-    return
+    return attestation
 
 if __name__ == "__main__":
+    logging.basicConfig(
+        filename='verification_logs.log',
+        level=logging.DEBUG,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
     print("Starting verification")
 
     attestation_str = get_attestation(enclave_url, nonce)
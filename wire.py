@@ -0,0 +1,213 @@
+import math
+import struct
+import numpy as np
+
+"""
+Binary tensor wire format for /infer/binary
+
+All integers are little-endian. A message is laid out as
+
+    magic        4 bytes   b"OGT1"
+    hash_len     u16
+    hash         hash_len bytes, utf-8 (ipfs hash in requests, model hash in responses)
+    count        u32       number of tensors
+    tensor       repeated count times
+
+and every tensor as
+
+    name_len     u16
+    name         name_len bytes, utf-8
+    dtype        u8        ONNX TensorProto data type
+    ndim         u8
+    dims         ndim x u64
+    nbytes       u64
+    data         nbytes bytes, C-order little-endian elements
+
+String tensors store each element as a u32 byte length followed by its utf-8 bytes.
+There is no padding or optional field, so the same tensors always encode to the same
+bytes and a message can be hashed as-is.
+"""
+
+MEDIA_TYPE = "application/vnd.opengradient.tensors"
+MAGIC = b"OGT1"
+
+# Most elements a string tensor may declare, its values are decoded into Python objects
+MAX_STRING_ELEMENTS = 1 << 24
+
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+_DTYPE_NDIM = struct.Struct("<BB")
+
+# ONNX TensorProto data type -> little-endian NumPy dtype
+STRING_DTYPE = 8
+_onnx_dtypes = {
+    1: np.dtype("<f4"),
+    2: np.dtype("u1"),
+    3: np.dtype("i1"),
+    4: np.dtype("<u2"),
+    5: np.dtype("<i2"),
+    6: np.dtype("<i4"),
+    7: np.dtype("<i8"),
+    9: np.dtype("?"),
+    10: np.dtype("<f2"),
+    11: np.dtype("<f8"),
+    12: np.dtype("<u4"),
+    13: np.dtype("<u8"),
+}
+_numpy_dtypes = {dtype.newbyteorder("="): code for code, dtype in _onnx_dtypes.items()}
+
+# ONNX session type string -> TensorProto data type
+onnx_type_codes = {
+    'tensor(float)': 1,
+    'tensor(uint8)': 2,
+    'tensor(int8)': 3,
+    'tensor(uint16)': 4,
+    'tensor(int16)': 5,
+    'tensor(int32)': 6,
+    'tensor(int64)': 7,
+    'tensor(string)': 8,
+    'tensor(bool)': 9,
+    'tensor(float16)': 10,
+    'tensor(double)': 11,
+    'tensor(uint32)': 12,
+    'tensor(uint64)': 13,
+}
+
+class _Reader():
+    def __init__(self, buffer: bytes):
+        self.view = memoryview(buffer)
+        self.offset = 0
+
+    def take(self, size: int) -> memoryview:
+        if self.offset + size > len(self.view):
+            raise ValueError("Truncated tensor message")
+        chunk = self.view[self.offset:self.offset + size]
+        self.offset += size
+        return chunk
+
+    def unpack(self, fmt: struct.Struct) -> tuple:
+        return fmt.unpack(self.take(fmt.size))
+
+    def text(self) -> str:
+        (length,) = self.unpack(_U16)
+        return str(self.take(length), "utf-8")
+
+def decode(buffer: bytes) -> tuple:
+    """
+    Decodes a message into (hash, {name: ndarray}). Numeric tensors are read-only
+    views over the message buffer, nothing is copied.
+    """
+    reader = _Reader(buffer)
+    if reader.take(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a tensor message, bad magic")
+
+    hash_str = reader.text()
+    (count,) = reader.unpack(_U32)
+
+    tensors = {}
+    for _ in range(count):
+        name = reader.text()
+        dtype_code, ndim = reader.unpack(_DTYPE_NDIM)
+        shape = tuple(_U64.unpack(reader.take(_U64.size))[0] for _ in range(ndim))
+        (nbytes,) = reader.unpack(_U64)
+        data = reader.take(nbytes)
+
+        if dtype_code == STRING_DTYPE:
+            tensor = _decode_strings(data, shape)
+        elif dtype_code in _onnx_dtypes:
+            dtype = _onnx_dtypes[dtype_code]
+            if nbytes != dtype.itemsize * math.prod(shape):
+                raise ValueError("Tensor %s has %d bytes, expected shape %s of %s" % (name, nbytes, shape, dtype))
+            tensor = np.frombuffer(data, dtype=dtype).reshape(shape)
+        else:
+            raise ValueError("Unsupported tensor dtype code: %d" % dtype_code)
+
+        if name in tensors:
+            raise ValueError("Duplicate tensor name: %s" % name)
+        tensors[name] = tensor
+
+    if reader.offset != len(reader.view):
+        raise ValueError("Trailing bytes after tensor message")
+    return hash_str, tensors
+
+def _decode_strings(data: memoryview, shape: tuple) -> np.ndarray:
+    reader = _Reader(data)
+    count = math.prod(shape)
+    # Every element takes at least its u32 length, so a shape the data can't hold is
+    # rejected before anything is allocated for it
+    if count > MAX_STRING_ELEMENTS:
+        raise ValueError("String tensor of shape %s has more than %d elements" % (shape, MAX_STRING_ELEMENTS))
+    if count * _U32.size > len(data):
+        raise ValueError("String tensor of shape %s needs at least %d bytes, has %d" % (shape, count * _U32.size, len(data)))
+    values = np.empty(count, dtype=object)
+    for i in range(count):
+        (length,) = reader.unpack(_U32)
+        values[i] = str(reader.take(length), "utf-8")
+    if reader.offset != len(data):
+        raise ValueError("String tensor has trailing bytes")
+    return values.reshape(shape)
+
+def encode(hash_str: str, tensors: list) -> list:
+    """
+    Encodes (name, ndarray) pairs into a list of buffers whose concatenation is the
+    message. Numeric tensor data is passed through as a memoryview of the array, so
+    C-contiguous little-endian outputs are never copied.
+    """
+    chunks = [MAGIC, _text(hash_str), _U32.pack(len(tensors))]
+    for name, tensor in tensors:
+        tensor = np.asarray(tensor)
+
+        if tensor.dtype == np.object_ or tensor.dtype.kind == 'U':
+            dtype_code = STRING_DTYPE
+            data = _encode_strings(tensor)
+        elif tensor.dtype.newbyteorder("=") in _numpy_dtypes:
+            dtype_code = _numpy_dtypes[tensor.dtype.newbyteorder("=")]
+            # Not ascontiguousarray, which turns scalars into 1-d arrays
+            tensor = np.asarray(tensor, dtype=_onnx_dtypes[dtype_code], order="C")
+            # As bytes, flattened first since memoryview can't cast scalars or empty views
+            data = memoryview(tensor.reshape(-1).view(np.uint8))
+        else:
+            raise ValueError("Unsupported output dtype for %s: %s" % (name, tensor.dtype))
+
+        header = [_text(name), _DTYPE_NDIM.pack(dtype_code, tensor.ndim)]
+        header.extend(_U64.pack(dim) for dim in tensor.shape)
+        header.append(_U64.pack(len(data)))
+        chunks.append(b"".join(header))
+        chunks.append(data)
+    return chunks
+
+def _encode_strings(tensor: np.ndarray) -> bytes:
+    parts = []
+    for value in tensor.ravel():
+        encoded = str(value).encode("utf-8")
+        parts.append(_U32.pack(len(encoded)))
+        parts.append(encoded)
+    return b"".join(parts)
+
+def _text(value: str) -> bytes:
+    encoded = value.encode("utf-8")
+    if len(encoded) > 0xFFFF:
+        raise ValueError("String too long for tensor message header")
+    return _U16.pack(len(encoded)) + encoded
+
+def match_inputs(session_inputs: list, tensors: dict) -> dict:
+    """
+    Checks decoded tensors against the session inputs, returning the ONNX input dict
+    """
+    inputs = {}
+    for session_input in session_inputs:
+        if session_input.name not in tensors:
+            raise ValueError("Input not found: %s" % session_input.name)
+
+        tensor = tensors[session_input.name]
+        expected = onnx_type_codes.get(session_input.type)
+        if expected == STRING_DTYPE:
+            matches = tensor.dtype == np.object_
+        else:
+            matches = expected is not None and _onnx_dtypes[expected] == tensor.dtype
+        if not matches:
+            raise ValueError("Input %s has dtype %s, model expects %s" % (session_input.name, tensor.dtype, session_input.type))
+
+        inputs[session_input.name] = tensor
+    return inputs